@@ -31,6 +31,22 @@ class Particle:
         self.mass = mass
         self.radius = radius
 
+    @classmethod
+    def view(cls, particle_array, index):
+        """Return a Particle backed by row index of a ParticleArray.  The
+        position and velocity of the view alias the rows of the array, so
+        updates made through the view are visible in the array.  The scalar
+        attributes are copies.
+        """
+        particle = cls.__new__(cls)
+        particle.particle_id = int(particle_array.ids[index])
+        particle.thread_num = int(particle_array.thread_nums[index])
+        particle.position = particle_array.positions[index]
+        particle.velocity = particle_array.velocities[index]
+        particle.mass = particle_array.masses[index].item()
+        particle.radius = particle_array.radii[index].item()
+        return particle
+
     def jsonify(self, indent = 4):
         """Hacky conversion to JSON to avoid infinite loop with jsonify and
         nested neighbors
@@ -46,8 +62,8 @@ class Particle:
         json =  " " * indent + "{\n"
         json += " " * 2 * indent + "\"particle_id\": " + str(self.particle_id) + ",\n"
         json += " " * 2 * indent + "\"thread_num\": " + str(self.thread_num) + ",\n"
-        json += " " * 2 * indent + "\"position\": " + str(self.position) + ",\n"
-        json += " " * 2 * indent + "\"velocity\": " + str(self.velocity) + ",\n"
+        json += " " * 2 * indent + "\"position\": " + str([float(c) for c in self.position]) + ",\n"
+        json += " " * 2 * indent + "\"velocity\": " + str([float(c) for c in self.velocity]) + ",\n"
         json += " " * 2 * indent + "\"mass\": " + str(self.mass) + ",\n"
         json += " " * 2 * indent + "\"radius\": " + str(self.radius) + "\n"
         json += " " * indent + "},\n"
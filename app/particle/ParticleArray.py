@@ -0,0 +1,196 @@
+#!/usr/bin/python
+"""
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+
+import util
+import params
+import timers
+from Particle import Particle
+import numpy as np
+
+# Number of float64 columns per particle in a packed ParticleArray
+num_fields = 13
+
+def validate_particle_array(*args):
+    for arg in args:
+        if type(arg) is not ParticleArray:
+            util.error("incorrect type argument: " + str(type(arg)) +
+                " was passed instead of a ParticleArray")
+
+class ParticleArray:
+    """Structure-of-arrays container for a group of Particles.
+
+    Each attribute of a Particle is stored in its own contiguous NumPy array,
+    so that row i of every array describes the same particle:
+
+        ids             (n,)    int64
+        thread_nums     (n,)    int64
+        positions       (n, 3)  float64
+        velocities      (n, 3)  float64
+        masses          (n,)    float64
+        radii           (n,)    float64
+        references      (n, 3)  float64
+
+    references holds the position of each particle at the last time that its
+    neighbors were searched for, which is used by neighbors.VerletList.  It
+    defaults to the positions.
+
+    Iterating over a ParticleArray (or indexing it with an int) yields Particle
+    views whose position and velocity alias the rows of this array.  Indexing
+    with a slice or a mask returns a new ParticleArray.
+
+    To move particles between ranks, pack copies every field into one
+    contiguous (n, num_fields) float64 buffer that can be sent with the
+    uppercase (buffer based) mpi4py calls instead of being pickled, and unpack
+    rebuilds the ParticleArray from such a buffer.
+    """
+    def __init__(self, ids = None, thread_nums = None, positions = None,
+            velocities = None, masses = None, radii = None, references = None):
+        self.ids = np.zeros(0, dtype=np.int64) if ids is None else \
+                np.ascontiguousarray(ids, dtype=np.int64)
+        n = len(self.ids)
+        self.thread_nums = np.zeros(n, dtype=np.int64) if thread_nums is None \
+                else np.ascontiguousarray(thread_nums, dtype=np.int64)
+        self.positions = np.zeros((n, 3)) if positions is None else \
+                np.ascontiguousarray(positions, dtype=np.float64).reshape(n, 3)
+        self.velocities = np.zeros((n, 3)) if velocities is None else \
+                np.ascontiguousarray(velocities, dtype=np.float64).reshape(n, 3)
+        self.masses = np.zeros(n) if masses is None else \
+                np.ascontiguousarray(masses, dtype=np.float64)
+        self.radii = np.zeros(n) if radii is None else \
+                np.ascontiguousarray(radii, dtype=np.float64)
+        self.references = self.positions.copy() if references is None else \
+                np.ascontiguousarray(references, dtype=np.float64).reshape(n, 3)
+
+    @classmethod
+    def from_particles(cls, particles):
+        """Build a ParticleArray out of an iterable of Particle objects"""
+        particles = list(particles)
+        return cls([p.particle_id for p in particles],
+                [p.thread_num for p in particles],
+                [list(p.position) for p in particles],
+                [list(p.velocity) for p in particles],
+                [p.mass for p in particles],
+                [p.radius for p in particles])
+
+    @classmethod
+    def concatenate(cls, *particle_arrays):
+        """Return a new ParticleArray holding the particles of every argument,
+        in order
+        """
+        return cls(np.concatenate([a.ids for a in particle_arrays]),
+                np.concatenate([a.thread_nums for a in particle_arrays]),
+                np.concatenate([a.positions for a in particle_arrays]),
+                np.concatenate([a.velocities for a in particle_arrays]),
+                np.concatenate([a.masses for a in particle_arrays]),
+                np.concatenate([a.radii for a in particle_arrays]),
+                np.concatenate([a.references for a in particle_arrays]))
+
+    def pack(self):
+        """Copy every field into one contiguous (n, num_fields) float64 buffer"""
+        buffer = np.empty((len(self), num_fields))
+        buffer[:, 0] = self.ids
+        buffer[:, 1] = self.thread_nums
+        buffer[:, 2:5] = self.positions
+        buffer[:, 5:8] = self.velocities
+        buffer[:, 8] = self.masses
+        buffer[:, 9] = self.radii
+        buffer[:, 10:13] = self.references
+        return buffer
+
+    @classmethod
+    def unpack(cls, buffer):
+        """Rebuild a ParticleArray from a buffer created by pack"""
+        buffer = buffer.reshape(-1, num_fields)
+        return cls(buffer[:, 0].astype(np.int64), buffer[:, 1].astype(np.int64),
+                buffer[:, 2:5], buffer[:, 5:8], buffer[:, 8], buffer[:, 9],
+                buffer[:, 10:13])
+
+    def send(self, dest, tag):
+        """Send this ParticleArray to another rank as a packed buffer, and
+        count the bytes sent in timers
+        """
+        buffer = self.pack()
+        params.comm.Send(buffer, dest = dest, tag = tag)
+        timers.count("bytes_sent", buffer.nbytes)
+
+    @classmethod
+    def recv(cls, source, tag, status = None):
+        """Receive a ParticleArray sent with send.  The size of the buffer is
+        found by probing the incoming message, and status (if given) holds the
+        source of the message afterwards
+        """
+        status = status if status is not None else params.mpi.Status()
+        params.comm.Probe(source = source, tag = tag, status = status)
+        buffer = np.empty((status.Get_count(params.mpi.DOUBLE)//num_fields, num_fields))
+        params.comm.Recv(buffer, source = status.Get_source(), tag = tag)
+        return cls.unpack(buffer)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Particle.view(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Particle.view(self, index)
+        return self.select(index)
+
+    def select(self, index):
+        """Return a new ParticleArray with the rows picked out by a slice, a
+        boolean mask or an array of indices
+        """
+        return ParticleArray(self.ids[index], self.thread_nums[index],
+                self.positions[index], self.velocities[index],
+                self.masses[index], self.radii[index], self.references[index])
+
+    def extend(self, particle_array):
+        """Append every particle of another ParticleArray to this one"""
+        merged = ParticleArray.concatenate(self, particle_array)
+        self.__dict__.update(merged.__dict__)
+
+    def append(self, particle):
+        """Append a single Particle to this ParticleArray"""
+        self.extend(ParticleArray.from_particles([particle]))
+
+    def remove(self, particle_array):
+        """Remove every particle whose id appears in another ParticleArray"""
+        keep = ~np.isin(self.ids, particle_array.ids)
+        self.__dict__.update(self.select(keep).__dict__)
+
+    def kinetic_energy(self):
+        """Return the total kinetic energy of the particles in this array"""
+        return 0.5*float(np.dot(self.masses,
+            np.einsum("ij,ij->i", self.velocities, self.velocities)))
+
+    def jsonify(self, indent = 4):
+        """Serialize every particle in the same layout as Particle.jsonify"""
+        outer = " " * indent
+        inner = " " * 2 * indent
+        template = (outer + "{{\n" +
+                inner + "\"particle_id\": {},\n" +
+                inner + "\"thread_num\": {},\n" +
+                inner + "\"position\": {},\n" +
+                inner + "\"velocity\": {},\n" +
+                inner + "\"mass\": {},\n" +
+                inner + "\"radius\": {}\n" +
+                outer + "}},\n")
+        return "".join(template.format(*fields) for fields in zip(
+            self.ids.tolist(), self.thread_nums.tolist(),
+            self.positions.tolist(), self.velocities.tolist(),
+            self.masses.tolist(), self.radii.tolist()))
+
+    def __repr__(self):
+        return "ParticleArray(" + str(len(self)) + " particles)"
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""
+Unit test file for ParticleArray.py
+"""
+import unittest
+import json
+import numpy as np
+from ParticleArray import ParticleArray
+from ParticleArray import num_fields
+
+def make_particles(n, first_id = 0):
+    """Return n particles with distinct values in every field"""
+    ids = np.arange(first_id, first_id + n)
+    rows = 3*ids[:, None] + np.arange(3)
+    return ParticleArray(ids, ids % 3 + 1, rows + 0.25, -rows - 0.5,
+            ids + 1.5, ids + 2.0, rows + 0.75)
+
+class TestParticleArray(unittest.TestCase):
+    def assertParticlesEqual(self, first, second):
+        for name in ("ids", "thread_nums", "positions", "velocities", "masses", "radii", "references"):
+            np.testing.assert_array_equal(getattr(first, name), getattr(second, name), err_msg = name)
+            self.assertEqual(getattr(first, name).dtype, getattr(second, name).dtype, name)
+
+    def test_pack_unpack_round_trip(self):
+        particles = make_particles(5)
+        buffer = particles.pack()
+        self.assertEqual(buffer.shape, (5, num_fields))
+        self.assertEqual(buffer.dtype, np.float64)
+        self.assertParticlesEqual(ParticleArray.unpack(buffer), particles)
+        # A flat buffer, as received from another rank, unpacks the same way
+        self.assertParticlesEqual(ParticleArray.unpack(buffer.reshape(-1)), particles)
+
+    def test_pack_unpack_empty(self):
+        buffer = ParticleArray().pack()
+        self.assertEqual(buffer.shape, (0, num_fields))
+        self.assertEqual(len(ParticleArray.unpack(buffer)), 0)
+
+    def test_select(self):
+        particles = make_particles(6)
+        mask = particles.ids % 2 == 0
+        self.assertEqual(particles.select(mask).ids.tolist(), [0, 2, 4])
+        self.assertEqual(particles.select(slice(1, 3)).ids.tolist(), [1, 2])
+        self.assertEqual(particles.select(np.array([5, 0])).ids.tolist(), [5, 0])
+        np.testing.assert_array_equal(particles.select(mask).positions, particles.positions[mask])
+        # Selecting copies, so the original is left alone
+        particles.select(mask).positions[:] = 0
+        self.assertParticlesEqual(particles, make_particles(6))
+
+    def test_remove(self):
+        particles = make_particles(6)
+        particles.remove(particles.select(np.array([1, 4])))
+        self.assertEqual(particles.ids.tolist(), [0, 2, 3, 5])
+        self.assertParticlesEqual(particles, make_particles(6).select(np.array([0, 2, 3, 5])))
+
+    def test_extend(self):
+        particles = make_particles(3)
+        particles.extend(make_particles(2, first_id = 3))
+        self.assertParticlesEqual(particles, make_particles(5))
+        particles.extend(ParticleArray())
+        self.assertEqual(len(particles), 5)
+
+    def test_jsonify_matches_particles(self):
+        particles = make_particles(3)
+        text = particles.jsonify()
+        self.assertEqual(text, "".join(particle.jsonify() for particle in particles))
+        parsed = json.loads("[" + text.rstrip().rstrip(",") + "]")
+        self.assertEqual([particle["particle_id"] for particle in parsed], [0, 1, 2])
+        self.assertEqual(parsed[1]["position"], [3.25, 4.25, 5.25])
+        self.assertEqual(parsed[2]["radius"], 4.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,31 @@ Acknowledgment:
 
 import util
 import params
+import kernels
+import integrators
+import neighbors
+import timers
+from ParticleArray import ParticleArray
+from ParticleArray import validate_particle_array
+from ParticleArray import num_fields
+import numpy as np
 import sys
+import time
+
+# Offsets to the (up to) 26 Partitions that share a face, an edge or a corner
+# with a Partition in the grid
+directions = neighbors.offsets[(neighbors.offsets != 0).any(axis=1)]
+
+# Messages between neighbors in direction k are tagged with halo_tag + k or
+# exchange_tag + k
+halo_tag = 100
+exchange_tag = 200
+# Messages that move particles to their new owners after a change in the
+# number of workers
+resize_tag = 300
+# Smallest number of particles that the first message of a neighbor exchange
+# can hold
+min_capacity = 16
 
 class Partition:
     """Partition class, where each Partition corresponds to the area of the
@@ -23,243 +47,412 @@ class Partition:
     Invariant: If Partition i is active (that is, if there are i threads working
     on the simulation), then for all partitions j < i, j is active as well
 
+    The active Partitions form a Cartesian grid of params.dims Partitions (see
+    util.update_decomposition), and Partition i owns the box between self.start
+    and self.end at grid coordinates self.coordinates.
+
     When changing the ownership of a particle, the sending partition always changes
     the owner of each particle.  The reciving partition validates that the change
     was made correctly.
     """
     def __init__(self, thread_num):
-        """Delta calculation assumes that there will be num_threads - 1
-        partitions since num_active_workers is incremented within the
+        """The bounds assume that params.dims and params.cuts already describe
+        the decomposition.  num_active_workers is incremented within the
         constructor
         """
         util.validate_int(thread_num)
 
         self.thread_num = thread_num
-        self.particles = set()
-        self.neighbor_particles = set()
-        self.delta_x = params.simulation_width//(params.num_threads - 1)
-        self.start_x = self.delta_x*(self.thread_num-1)
-        self.end_x = params.simulation_width if self.thread_num is params.num_active_workers else self.start_x + self.delta_x
+        self.particles = ParticleArray()
+        self.neighbor_particles = ParticleArray()
+        self.update_start_end()
+        self.verlet_lists = (neighbors.VerletList(params.verlet_skin),
+                neighbors.VerletList(params.verlet_skin))
+        self.neighbor_list_rebuilds = 0
+        self.neighbor_list_size = 0
+        self.work = 0.0
+        self.pending_neighbor_particles = None
+        self.message_capacities = {}
+        self.velocity_deltas = None
+        self.max_velocity_change = 0.0
 
         params.num_active_workers += 1
         params.new_num_active_workers += 1
 
     def update_start_end(self):
-        """This method is used to pick volume that does not evenly divide into
-        the number of active workers when the number of workers changes
+        """Look up the grid coordinates and the bounds of this Partition in the
+        current decomposition.  This is used when the number of workers changes
 
-        Note that the delta is calculated based on the number of active workers
-        and not the number of threads, since the number of threads no longer
-        necessarily correlates to the number of active workers
+        Partitions that are not part of the grid (inactive workers) have no
+        coordinates or bounds
+        """
+        if self.thread_num > np.prod(params.dims):
+            self.coordinates = self.start = self.end = None
+            return
+        self.coordinates = util.worker_coordinates(self.thread_num)
+        self.start = np.array([params.cuts[axis][self.coordinates[axis]] for axis in range(3)])
+        self.end = np.array([params.cuts[axis][self.coordinates[axis] + 1] for axis in range(3)])
+
+    def neighbor_thread_num(self, direction):
+        """Return the thread number of the neighboring Partition in the given
+        direction, or MPI.PROC_NULL if there is no Partition there
         """
-        self.delta_x = params.simulation_width//(params.num_active_workers)
-        self.start_x = self.delta_x*(self.thread_num-1)
-        self.end_x = params.simulation_width if self.thread_num is params.num_active_workers else self.start_x + self.delta_x
+        thread_num = util.worker_thread_num([c + d for c, d in zip(self.coordinates, direction)])
+        return params.mpi.PROC_NULL if thread_num is None else thread_num
 
-    def add_particles(self, particle_set):
-        """Add multiple Particles to the set of Particles that this Partition is
-        responsible for
+    def neighbor_rank(self, direction):
+        """Return the rank that computes the neighboring Partition in the given
+        direction, or MPI.PROC_NULL if there is no Partition there
         """
-        util.validate_particle_set(particle_set)
-        for particle in particle_set:
-            if particle.thread_num != self.thread_num:
-                util.error("Thread numbers don't match: particle is " +
-                        str(particle.thread_num) + " and self is: " +
-                        str(self.thread_num))
-        self.particles = self.particles.union(particle_set)
-
-    def add_particle(self, particle):
-        """Add a single Particle to the set of Particles that this Partition is
-        responsible for
+        thread_num = self.neighbor_thread_num(direction)
+        return params.mpi.PROC_NULL if thread_num == params.mpi.PROC_NULL else util.worker_rank(thread_num)
+
+    def validate_thread_nums(self, particle_array):
+        """Make sure every particle in a ParticleArray is owned by this
+        Partition
         """
-        if particle.thread_num != self.thread_num:
+        mismatched = particle_array.thread_nums != self.thread_num
+        if mismatched.any():
             util.error("Thread numbers don't match: particle is " +
-                    str(particle.thread_num) + " and self is: " +
-                    str(self.thread_num))
-        self.particles.add(particle)
+                    str(particle_array.thread_nums[mismatched][0]) +
+                    " and self is: " + str(self.thread_num))
 
-    def remove_particles(self, particle_set):
-        """Remove a set of particles from this Partition"""
-        util.validate_particle_set(particle_set)
-        self.particles.difference_update(particle_set)
+    def add_particles(self, particle_array):
+        """Add multiple Particles to the set of Particles that this Partition is
+        responsible for
+        """
+        validate_particle_array(particle_array)
+        self.validate_thread_nums(particle_array)
+        self.particles.extend(particle_array)
 
-    def set_particles(self, particle_set):
+    def set_particles(self, particle_array):
         """Overwrite the set of Particles that tis Partition is responsible for.
         This is used when changing the number of Partitions
         """
-        util.validate_particle_set(particle_set)
-        for particle in particle_set:
-            if particle.thread_num != self.thread_num:
-                util.error("Thread numbers don't match: particle is " +
-                        str(particle.thread_num) + " and self is: " +
-                        str(self.thread_num))
-        self.particles = particle_set
-
-    def particle_is_not_in_range(self, particle):
-        """Helps determine whether or not a Particle belongs to this Partition
-        or another partition.  This method assumes that the particle will never
-        be travelling fast enough to jump more than one partition at a time.
-
-        Returns -1 if the particle is in the previous partition
-                0 if the particle is still in this partition
-                1 if the particle is in the next partition
+        validate_particle_array(particle_array)
+        self.validate_thread_nums(particle_array)
+        self.particles = particle_array
+
+    def particles_not_in_range(self):
+        """Helps determine whether or not each Particle belongs to this
+        Partition or another partition.  This method assumes that no particle
+        will ever be travelling fast enough to jump more than one partition at
+        a time.
+
+        Returns an (n, 3) array holding, for each particle and axis,
+                -1 if the particle is in the previous partition along the axis
+                0 if the particle is still in this partition along the axis
+                1 if the particle is in the next partition along the axis
         """
-        if particle.position[0] < self.start_x:
-            return -1
-        elif particle.position[0] > self.end_x:
-            return 1
-        else:
-            return 0
+        positions = self.particles.positions
+        return (positions > self.end).astype(int) - (positions < self.start).astype(int)
 
     def handoff_neighboring_particles(self):
-        """This method returns all particles that touch the border between
-        neighboring partitions
+        """This method returns, for each of the directions, all particles that
+        touch the border between this partition and the neighboring partition
+        in that direction
+        """
+        positions = self.particles.positions
+        reach = (self.particles.radii + params.max_radius)[:, None]
+        touching = {1: positions + reach > self.end, -1: positions - reach < self.start}
+        handoffs = []
+        for direction in directions:
+            touches = np.ones(len(self.particles), dtype=bool)
+            for axis in range(3):
+                if direction[axis]:
+                    touches &= touching[direction[axis]][:, axis]
+            handoffs.append(self.particles.select(touches))
+        return handoffs
+
+    def start_neighboring_sendrecv(self, sendobjs, tag):
+        """This helper method starts sending sendobjs[k] to the neighbor in
+        directions[k] and receiving a ParticleArray from the neighbor in the
+        opposite direction, for every direction at once.  Returns the pending
+        exchange, to be passed to finish_neighboring_sendrecv
+
+        The particle count and the packed particles are sent to each neighbor
+        with non-blocking sends, and the receives of both the counts and the
+        particles are posted, without waiting for any of them.  The particles
+        are received into a buffer of the capacity that both sides derive
+        from the previous exchange (see update_capacities), so the receive
+        can be posted before the count is known.  Particles that do not fit
+        follow in a second message.  Messages in direction k use tag + k
+        """
+        send_capacities, receive_capacities = self.capacities(tag)
+        destinations = [self.neighbor_rank(direction) for direction in directions]
+        sources = [self.neighbor_rank(-direction) for direction in directions]
+        send_counts = np.array([len(sendobj) for sendobj in sendobjs], dtype=np.int64)
+        receive_counts = np.zeros(len(directions), dtype=np.int64)
+        send_buffers = [sendobj.pack() for sendobj in sendobjs]
+        receive_buffers = [np.empty((capacity, num_fields)) for capacity in receive_capacities]
+        count_requests = []
+        requests = []
+        for k in range(len(directions)):
+            if sources[k] != params.mpi.PROC_NULL:
+                count_requests.append(params.comm.Irecv(receive_counts[k:k+1],
+                    source = sources[k], tag = tag + k))
+                requests.append(params.comm.Irecv(receive_buffers[k],
+                    source = sources[k], tag = tag + k))
+            if destinations[k] != params.mpi.PROC_NULL:
+                requests.append(params.comm.Isend(send_counts[k:k+1],
+                    dest = destinations[k], tag = tag + k))
+                requests.append(params.comm.Isend(send_buffers[k][:send_capacities[k]],
+                    dest = destinations[k], tag = tag + k))
+                if send_counts[k] > send_capacities[k]:
+                    requests.append(params.comm.Isend(send_buffers[k][send_capacities[k]:],
+                        dest = destinations[k], tag = tag + k))
+                timers.count("bytes_sent", send_buffers[k].nbytes)
+        self.update_capacities(send_capacities, send_counts, destinations)
+        return (tag, sources, count_requests, requests, send_buffers, receive_counts, receive_buffers)
+
+    def finish_neighboring_sendrecv(self, pending):
+        """Wait for an exchange started by start_neighboring_sendrecv and
+        return the received ParticleArrays.  Once the counts have arrived,
+        the receives of the particles that did not fit into the receive
+        buffers are posted; messages from one rank with the same tag arrive
+        in order, so the counts, the particles and the overflow are never
+        confused
         """
-        right = set()
-        left = set()
-        for particle in self.particles:
-            if particle.position[0] + particle.radius + params.max_radius > self.end_x:
-                right.add(particle)
-            elif particle.position[0] - particle.radius - params.max_radius < self.start_x:
-                left.add(particle)
-        return (right, left)
-
-    def neighboring_sendrecv(self, sendobj, source_destination, tag):
-        """This helper method performs a sendrecv for
-        send_and_receive_neighboring_particles
+        tag, sources, count_requests, requests, send_buffers, receive_counts, receive_buffers = pending
+        receive_capacities = self.capacities(tag)[1]
+        params.mpi.Request.Waitall(count_requests)
+        overflow_buffers = [np.empty((max(count - capacity, 0), num_fields))
+                for count, capacity in zip(receive_counts, receive_capacities)]
+        for k in range(len(directions)):
+            if len(overflow_buffers[k]):
+                requests.append(params.comm.Irecv(overflow_buffers[k],
+                    source = sources[k], tag = tag + k))
+        params.mpi.Request.Waitall(requests)
+        self.update_capacities(receive_capacities, receive_counts, sources)
+        return [ParticleArray.unpack(np.concatenate((buffer, overflow)) if len(overflow) else buffer[:count])
+                for buffer, overflow, count in zip(receive_buffers, overflow_buffers, receive_counts)]
+
+    def capacities(self, tag):
+        """Return the capacities (in particles) of the first message sent to
+        and received from the neighbor in each direction in the exchanges
+        tagged with tag
         """
-        neighbor_particles = params.comm.sendrecv(sendobj = sendobj,
-                dest = source_destination, sendtag = tag,
-                source = source_destination, recvtag = tag)
-        self.neighbor_particles = self.neighbor_particles.union(neighbor_particles)
+        if tag not in self.message_capacities:
+            self.message_capacities[tag] = (np.full(len(directions), min_capacity, dtype=np.int64),
+                    np.full(len(directions), min_capacity, dtype=np.int64))
+        return self.message_capacities[tag]
+
+    def update_capacities(self, capacities, counts, ranks):
+        """Make room for twice the particles exchanged with each neighbor this
+        time.  The sender and the receiver of a message see the same counts,
+        so they always agree on its capacity
+        """
+        exchanged = np.array([rank != params.mpi.PROC_NULL for rank in ranks])
+        capacities[exchanged] = np.maximum(2*counts[exchanged], min_capacity)
 
-    def send_and_receive_neighboring_particles(self):
-        """Call handoff_neighboring_particles to get all particles that touch
-        the border between this partition and its one (or two) neighbors.  Then
-        send the neighbor the particle set and add the set that it sends to this
-        Partition to self.neighbor_particles by calling neighboring_sendrecv
-
-        There are two steps:
-        1. Rank 1 and 2 exchange while
-           Rank 3 and 4 exchange while
-           ...
-        2. Rank 2 and 3 exchange while
-           Rank 4 and 5 exchange while
-           ...
+    def neighboring_sendrecv(self, sendobjs, tag):
+        """Exchange ParticleArrays with every neighbor and wait for the
+        exchange to complete.  See start_neighboring_sendrecv
         """
-        right, left = self.handoff_neighboring_particles()
-        self.neighbor_particles = set()
+        return self.finish_neighboring_sendrecv(
+                self.start_neighboring_sendrecv(sendobjs, tag))
 
-        if params.rank == 1:
-            if params.num_active_workers != 1:
-                self.neighboring_sendrecv(right, self.thread_num + 1, 1)
+    def start_sending_neighboring_particles(self):
+        """Call handoff_neighboring_particles to get all particles that touch
+        the border between this partition and each of its (up to 26)
+        neighbors, and start sending each neighbor its particle set.  The
+        exchange is finished by finish_receiving_neighboring_particles
+        """
+        handoffs = self.handoff_neighboring_particles()
+        self.pending_neighbor_particles = self.start_neighboring_sendrecv(handoffs, halo_tag)
 
-        elif params.rank == params.num_active_workers and params.rank % 2 == 0:
-            self.neighboring_sendrecv(left, self.thread_num - 1, 1)
+    def finish_receiving_neighboring_particles(self):
+        """Wait for the particle sets that the neighbors send to this
+        Partition and store them in self.neighbor_particles
+        """
+        self.neighbor_particles = ParticleArray.concatenate(
+                *self.finish_neighboring_sendrecv(self.pending_neighbor_particles))
+        self.pending_neighbor_particles = None
+        timers.count("halo_particles", len(self.neighbor_particles))
 
-        elif params.rank == params.num_active_workers and params.rank % 2 == 1:
-            self.neighboring_sendrecv(left, self.thread_num - 1, 2)
+    def send_and_receive_neighboring_particles(self):
+        """Send each neighbor the particles that touch the border between it
+        and this partition, and add the sets that they send to this Partition
+        to self.neighbor_particles
+        """
+        self.start_sending_neighboring_particles()
+        self.finish_receiving_neighboring_particles()
+
+    def find_pairs(self, others, verlet_list):
+        """Find every pair of interacting particles between this Partition and
+        others, which is either self.particles or self.neighbor_particles.
+        With params.neighbor_search set to "cells", the other particles are
+        binned into a CellList sized to the cutoff once per timestep; "brute"
+        tests every pair of particles; "verlet" reuses the cached verlet_list,
+        and only rebuilds the candidates of particles that moved more than half
+        of params.verlet_skin or that are new to this Partition.
+
+        Returns the index pairs (i, j) into (self.particles, others), and
+        counts them in timers
+        """
+        particles = self.particles
+        exclude_self = others is particles
+        if params.neighbor_search == "brute":
+            pairs = kernels.all_pairs(particles, others, exclude_self)
+        elif params.neighbor_search == "verlet":
+            pairs = verlet_list.pairs(particles, others, exclude_self)
+            self.neighbor_list_rebuilds += verlet_list.rebuilt
+            self.neighbor_list_size += verlet_list.size
+        else:
+            cells = neighbors.CellList(others, neighbors.max_cutoff(particles, others))
+            pairs = cells.pairs(particles, exclude_self)
+        timers.count("neighbor_pairs", len(pairs[0]))
+        return pairs
 
-        elif params.rank % 2 == 0:
-            self.neighboring_sendrecv(left, self.thread_num - 1, 1)
-            self.neighboring_sendrecv(right, self.thread_num + 1, 2)
+    def interact_local_particles(self):
+        """Compute the change in velocity of each particle due to the other
+        particles within this Partition.  This does not need the neighboring
+        particles, so it can run while they are being received
 
-        else:
-            self.neighboring_sendrecv(right, self.thread_num + 1, 1)
-            self.neighboring_sendrecv(left, self.thread_num - 1, 2)
+        The time spent is added to self.work for load balancing
+        """
+        start = time.time()
+        particles = self.particles
+        self.velocity_deltas = integrators.velocity_deltas(particles, particles,
+                self.find_pairs(particles, self.verlet_lists[0]))
+        self.work += time.time() - start
+
+    def interact_neighboring_particles(self):
+        """Add the change in velocity of each particle due to the particles
+        bordering this Partition, and then update the velocity and the position
+        of each particle
+
+        The time spent is added to self.work for load balancing
+        """
+        start = time.time()
+        particles = self.particles
+        neighbor_particles = self.neighbor_particles
+        self.velocity_deltas += integrators.velocity_deltas(particles, neighbor_particles,
+                self.find_pairs(neighbor_particles, self.verlet_lists[1]))
+        particles.velocities += self.velocity_deltas
+        if params.adaptive_dt:
+            self.max_velocity_change = float(np.sqrt(np.einsum("ij,ij->i",
+                self.velocity_deltas, self.velocity_deltas)).max(initial=0.0))
+        self.velocity_deltas = None
+        integrators.update_positions(particles)
+        if params.neighbor_search == "verlet":
+            neighbors.reset_references(particles, params.verlet_skin)
+        self.work += time.time() - start
 
     def interact_particles(self):
         """Do computation and interact particles within this Partition.
         Includes interactions between particles that are bordering this
         Partition.  Update the velocity and the position of each particle
         """
-        for particle in self.particles:
-            particle.update_velocity(self.particles | self.neighbor_particles)
-#        for particle in self.particles:
-#            particle.update_velocity()
-        for particle in self.particles:
-            particle.update_position(params.dt)
-
-    def exchange_sendrecv(self, increment, sendobj, source_destination, tag):
-        """This helper method removes the particles from this Partition,
-        decrements or incrments each particle's thread number, and then performs
-        a sendrecv for exchange_particles
+        self.interact_local_particles()
+        self.interact_neighboring_particles()
+
+    def timestep(self):
+        """Run one timestep of this Partition, overlapping the exchange of
+        neighboring particles with the interactions between the particles
+        within this Partition:
+
+        1. Start sending the particles bordering each neighbor
+        2. Interact the particles within this Partition
+        3. Wait for the particles bordering this Partition
+        4. Interact with the bordering particles and move every particle
+        5. Hand particles that left this Partition to their new owners
+
+        The time spent in each step is added to timers
         """
-        self.remove_particles(sendobj)
-        if increment:
-            for particle in sendobj:
-                particle.thread_num += 1
-        else:
-            for particle in sendobj:
-                particle.thread_num -= 1
-        new_particles = params.comm.sendrecv(sendobj = sendobj,
-                dest = source_destination, sendtag = tag,
-                source = source_destination, recvtag = tag)
-        self.add_particles(new_particles)
+        with timers.phase("halo"):
+            self.start_sending_neighboring_particles()
+        with timers.phase("forces"):
+            self.interact_local_particles()
+        with timers.phase("halo_wait"):
+            self.finish_receiving_neighboring_particles()
+        with timers.phase("forces"):
+            self.interact_neighboring_particles()
+        with timers.phase("migration"):
+            self.exchange_particles()
 
     def exchange_particles(self):
         """Send particles that should now belong to neighboring partitions to
         neighbors, and receive any particles that now belong to this partition
 
-        Call particle_is_not_in_range for each particle to determine which
+        Call particles_not_in_range to determine which
         particles should now belong to a different Partition.
 
         Then, remove the particles from this Partition's list of particles,
-        decrement or increment each particle's thread number, and send the
-        neighbor the particle set to the respective neighbor using
-        exchange_sendrecv.  Also add the set that it sends to this Partition to
-        self.particles
-
-        There are two steps in the exchange:
-        1. Rank 1 and 2 exchange while
-           Rank 3 and 4 exchange while
-           ...
-        2. Rank 2 and 3 exchange while
-           Rank 4 and 5 exchange while
-           ...
+        change each particle's thread number, and send the particle set to the
+        respective neighbor using neighboring_sendrecv.  Also add the sets that
+        they send to this Partition to self.particles
         """
         sys.stdout.flush()
-        right, left = set(), set()
-        for particle in self.particles:
-            if particle.thread_num != params.rank:
-                util.debug("Rank is " + str(params.rank) + " but particle has thread number " + str(particle.thread_num))
-            switch = self.particle_is_not_in_range(particle)
-            if switch is -1:
-                left.add(particle)
-            elif switch is 1:
-                right.add(particle)
+        if (self.particles.thread_nums != self.thread_num).any():
+            util.debug("Rank is " + str(params.rank) + " but some particles have a different thread number")
+        switch = self.particles_not_in_range()
+        leaving = switch.any(axis=1)
+        outgoing = self.particles.select(leaving)
+        self.particles = self.particles.select(~leaving)
+        switch = switch[leaving]
+        timers.count("migrated_particles", len(outgoing))
 
         # Send neighbors their new particles
-        if params.rank == 1:
-            if params.num_active_workers != 1:
-                self.exchange_sendrecv(True, right, self.thread_num + 1, 1)
-
-        elif params.rank == params.num_active_workers and params.rank % 2 == 0:
-            self.exchange_sendrecv(False, left, self.thread_num - 1, 1)
-
-        elif params.rank == params.num_active_workers and params.rank % 2 == 1:
-            self.exchange_sendrecv(False, left, self.thread_num - 1, 2)
-
-        elif params.rank % 2 == 0:
-            self.exchange_sendrecv(False, left, self.thread_num - 1, 1)
-            self.exchange_sendrecv(True, right, self.thread_num + 1, 2)
-
-        else:
-            self.exchange_sendrecv(True, right, self.thread_num + 1, 1)
-            self.exchange_sendrecv(False, left, self.thread_num - 1, 2)
+        sendobjs = []
+        for direction in directions:
+            destination = self.neighbor_thread_num(direction)
+            sendobj = outgoing.select((switch == direction).all(axis=1))
+            if destination == params.mpi.PROC_NULL and len(sendobj):
+                util.debug("Rank " + str(params.rank) + " has " + str(len(sendobj)) + " particles outside of the simulation")
+            sendobj.thread_nums[:] = destination
+            sendobjs.append(sendobj)
+        for new_particles in self.neighboring_sendrecv(sendobjs, exchange_tag):
+            self.add_particles(new_particles)
 
     def update_master(self):
         """Update the master node with new particles"""
 #        if len(self.particles) is not 0:
 #            util.debug("Rank " + str(params.rank) + " is sending back " + str(len(self.particles)) + " particles")
-        params.comm.send(self.particles, tag = 0)
-
-    def receive_new_particles(self):
-        """Receive new particle set after changing the number of threads"""
-        new_particles = params.comm.recv(source = 0, tag = 11)
-        self.set_particles(new_particles)
-        #self.update_start_x()
+        self.particles.send(0, 0)
+
+    def redistribute_particles(self):
+        """Move particles to their new owners after the number of workers
+        changed.  Every worker (active or not) calls this once params.dims and
+        params.cuts describe the new decomposition.  Only the particles whose
+        owner changed are sent, directly to the rank of their new Partition,
+        and particles that stay are never copied
+
+        The particle counts are exchanged first so that every receive buffer
+        can be allocated; unlike the neighbor exchanges, a resize is too rare
+        to be worth posting the receives early
+        """
         self.update_start_end()
+        # The neighbors change, so start over from the smallest capacities
+        self.message_capacities = {}
+        thread_nums = util.determine_particle_thread_nums(self.particles.positions)
+        staying = thread_nums == self.thread_num
+        outgoing = self.particles.select(~staying)
+        outgoing.thread_nums = thread_nums[~staying]
+        self.particles = self.particles.select(staying)
+
+        peers = [thread_num for thread_num in range(1, params.max_workers + 1) if thread_num != self.thread_num]
+        send_buffers = [outgoing.select(outgoing.thread_nums == peer).pack() for peer in peers]
+        send_counts = np.array([len(buffer) for buffer in send_buffers], dtype=np.int64)
+        receive_counts = np.zeros(len(peers), dtype=np.int64)
+        requests = []
+        for k, peer in enumerate(peers):
+            requests.append(params.comm.Irecv(receive_counts[k:k+1], source = util.worker_rank(peer), tag = resize_tag))
+            requests.append(params.comm.Isend(send_counts[k:k+1], dest = util.worker_rank(peer), tag = resize_tag))
+        params.mpi.Request.Waitall(requests)
+
+        receive_buffers = [np.empty((count, num_fields)) for count in receive_counts]
+        requests = []
+        for k, peer in enumerate(peers):
+            if receive_counts[k]:
+                requests.append(params.comm.Irecv(receive_buffers[k], source = util.worker_rank(peer), tag = resize_tag))
+            if send_counts[k]:
+                requests.append(params.comm.Isend(send_buffers[k], dest = util.worker_rank(peer), tag = resize_tag))
+                timers.count("bytes_sent", send_buffers[k].nbytes)
+        params.mpi.Request.Waitall(requests)
+        for buffer in receive_buffers:
+            if len(buffer):
+                self.add_particles(ParticleArray.unpack(buffer))
 
     def __repr__(self):
         """Represent a Partition by the number of particles that the Partition
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+"""
+Unit test file for Partition.py, running every rank as a process with
+localcomm
+"""
+import unittest
+import params
+import util
+import timers
+import localcomm
+import initialization
+from Partition import Partition
+
+num_particles = 400
+
+def simulate(num_workers, decomposition, steps = 15, master_computes = False, resizes = ()):
+    """Run steps timesteps of num_workers Partitions split along the axes in
+    decomposition, then switch to each number of active workers in resizes
+    and run steps more timesteps after every switch.  Return the ids of the
+    particles of every Partition and the number of particles that migrated,
+    as gathered on the master
+    """
+    results = {}
+    params.decomposition = decomposition
+    params.master_computes = master_computes
+    def function():
+        params.rank = params.comm.Get_rank()
+        params.mpi_status = params.mpi.Status()
+        params.thread_num = util.rank_thread_num(params.rank)
+        params.max_workers = num_workers
+        params.num_active_workers = params.new_num_active_workers = 0
+        util.update_decomposition(num_workers)
+        params.partitions = {i: Partition(i) for i in range(1, num_workers + 1)}
+        partition = params.partitions.get(params.thread_num)
+        if partition:
+            partition.set_particles(initialization.generate(0, num_particles,
+                params.thread_num, partition.start, partition.end))
+        timers.reset()
+
+        for num_active_workers in (num_workers,) + tuple(resizes):
+            if num_active_workers != params.num_active_workers:
+                params.num_active_workers = num_active_workers
+                util.update_decomposition(num_active_workers)
+                if partition:
+                    partition.redistribute_particles()
+            for params.iterations in range(1, steps + 1):
+                if partition and partition.thread_num <= params.num_active_workers:
+                    partition.timestep()
+
+        ids = params.comm.gather(partition.particles.ids.tolist() if partition else [])
+        migrated = params.comm.gather(timers.counts.get("migrated_particles", 0))
+        if params.rank == 0:
+            results["ids"] = ids
+            results["migrated"] = sum(migrated)
+    localcomm.run(num_workers + (0 if master_computes else 1), function)
+    return results
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        params.master_computes = False
+        params.simulation_width = params.simulation_height = params.simulation_depth = 1000
+        params.max_radius = 31
+        # Fast enough for particles to cross several boundaries
+        params.dt = 0.01
+        params.force = 100000
+        params.integrator = "euler"
+        params.neighbor_search = "cells"
+        params.verlet_skin = 30.0
+        params.adaptive_dt = False
+
+    def tearDown(self):
+        params.mpi = None
+        params.comm = None
+        params.master_computes = False
+
+    def assertConserved(self, results):
+        """Every particle is owned by exactly one Partition"""
+        ids = [particle_id for partition_ids in results["ids"] for particle_id in partition_ids]
+        self.assertEqual(sorted(ids), list(range(num_particles)))
+
+    def test_decompositions(self):
+        for decomposition, num_workers in (("x", 3), ("xy", 4), ("xyz", 8)):
+            with self.subTest(decomposition = decomposition):
+                results = simulate(num_workers, decomposition)
+                self.assertConserved(results)
+                self.assertGreater(results["migrated"], 0)
+
+    def test_resize(self):
+        """Particles move to their new owners when the number of active
+        workers shrinks and grows again, and the inactive workers keep none
+        """
+        for decomposition in ("x", "xy"):
+            with self.subTest(decomposition = decomposition):
+                results = simulate(4, decomposition, resizes = (2, 3))
+                self.assertConserved(results)
+                self.assertEqual(results["ids"][4], [])
+
+    def test_master_computes(self):
+        """The master computes Partition 1 and exchanges particles with the
+        workers like any other Partition
+        """
+        results = simulate(4, "xy", master_computes = True)
+        self.assertConserved(results)
+        self.assertEqual(len(results["ids"]), 4)
+        self.assertGreater(len(results["ids"][0]), 0)
+        self.assertGreater(results["migrated"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,531 @@
+#!/usr/bin/python
+"""HTTP API through which the visualizer watches and steers the simulation.
+
+The simulation loop publishes each snapshot of the particles as an immutable
+Snapshot that is serialized once, and every request is answered from the
+latest published Snapshot, so serving clients does no work for the
+simulation loop.  Each connection is handled on its own thread, and
+connections are kept alive (HTTP/1.1) so that pollers do not reconnect for
+every frame.
+
+The server can also run in a separate process (python3 api.py), so that
+serializing snapshots and socket I/O do not compete with the simulation.  The
+master then only copies each snapshot into a SnapshotBuffer in shared memory,
+and the server process serializes and serves it.  Either way, a snapshot is
+only serialized into a format once a client asks for it in that format.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+import params
+import frames
+from ParticleArray import ParticleArray
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler
+
+def api_params():
+    """Return the params reported with every snapshot of the particles"""
+    return {
+        "num_particles": params.num_particles,
+        "num_active_workers": params.num_active_workers,
+        "simulation_height": params.simulation_height,
+        "simulation_width": params.simulation_width,
+        "simulation_depth": params.simulation_depth,
+        "dt": params.dt,
+        "timesteps_per_second": params.timesteps_per_second,
+        "neighbor_list_rebuild_rate": params.neighbor_list_rebuild_rate,
+        "total_energy": params.curr_total_energy,
+    }
+
+class Snapshot:
+    """The serialized bodies of one snapshot of the particles, by format
+    ("json" or "frame").  Each body is given either serialized or as a
+    function that serializes it, which is only called by the first request
+    that asks for that format, so snapshots that nobody asks for in a format
+    are never serialized in it.  The gzipped body of each format is likewise
+    compressed by the first request that asks for it, and shared by every
+    later one
+    """
+    def __init__(self, json_body, frame_body):
+        self.bodies = {"json": json_body, "frame": frame_body}
+        self.gzipped_bodies = {}
+        self.lock = threading.Lock()
+
+    def body(self, body_format, gzipped = False):
+        with self.lock:
+            if callable(self.bodies[body_format]):
+                self.bodies[body_format] = self.bodies[body_format]()
+            if not gzipped:
+                return self.bodies[body_format]
+            if body_format not in self.gzipped_bodies:
+                self.gzipped_bodies[body_format] = gzip.compress(
+                        self.bodies[body_format], compresslevel = 1)
+            return self.gzipped_bodies[body_format]
+
+snapshot = Snapshot(b"{\n}", frames.encode({}, ParticleArray()))
+frame_history = frames.FrameHistory()
+metrics = {}
+
+def publish(new_snapshot):
+    """Make new_snapshot the one served to clients"""
+    global snapshot
+    snapshot = new_snapshot
+
+def publish_metrics(new_metrics):
+    """Make new_metrics, gathered by particle_simulation.update_metrics, the
+    ones served by /api/v1/metrics
+    """
+    global metrics
+    metrics = new_metrics
+
+def prometheus_body(metrics):
+    """Format metrics in the Prometheus text exposition format.  Every value
+    of a rank is labeled with its rank and thread number
+    """
+    lines = []
+    def add(name, help_text, samples):
+        lines.append("# HELP compactcori_" + name + " " + help_text)
+        lines.append("# TYPE compactcori_" + name + " gauge")
+        for labels, value in samples:
+            label_text = ",".join(key + "=\"" + str(label) + "\"" for key, label in labels)
+            lines.append("compactcori_" + name + ("{" + label_text + "}" if label_text else "") +
+                    " " + repr(float(value)))
+
+    ranks = metrics.get("ranks", [])
+    add("iterations", "Timestep at which the metrics were gathered",
+            [((), metrics["iterations"])] if metrics else [])
+    add("timesteps_per_second", "Timesteps per second of the simulation",
+            [((), metrics["timesteps_per_second"])] if metrics else [])
+    add("total_energy", "Total kinetic energy of the particles",
+            [((), metrics["total_energy"])] if metrics else [])
+    add("particles", "Particles owned by each rank",
+            [((("rank", rank["rank"]), ("thread_num", rank["thread_num"])), rank["particles"])
+                for rank in ranks])
+    add("phase_milliseconds", "Milliseconds per timestep spent in each phase",
+            [((("rank", rank["rank"]), ("thread_num", rank["thread_num"]), ("phase", name)), value)
+                for rank in ranks for name, value in sorted(rank["phase_ms"].items())])
+    add("count", "Count per timestep of each counter",
+            [((("rank", rank["rank"]), ("thread_num", rank["thread_num"]), ("counter", name)), value)
+                for rank in ranks for name, value in sorted(rank["counts"].items())])
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def json_body(header, particles):
+    """Serialize the params in header and every particle in a ParticleArray
+    as the JSON document served by /api/v1/get_particles
+    """
+    param_endpoint =  "    \"params\": {\n"
+    param_endpoint += ",\n".join("        " + json.dumps(key) + ": " + json.dumps(value)
+            for key, value in header.items()) + "\n"
+    param_endpoint += "    },\n"
+
+    particles_endpoint = "    \"particles\": [\n"
+    particles_endpoint += particles.jsonify()
+    particles_endpoint = particles_endpoint[:-2] # trim extra comma
+    return ("{\n" + param_endpoint + particles_endpoint + "\n    ]\n}\n").encode("utf-8")
+
+def particle_snapshot(header, particles):
+    """Return a Snapshot of the params in header and the particles in a
+    ParticleArray, which is serialized when a client first asks for it.
+    particles must not be modified afterwards
+    """
+    return Snapshot(lambda: json_body(header, particles),
+            lambda: frames.encode(header, particles))
+
+def publish_particles(header, particles):
+    """Serve a snapshot of the params in header and the particles in a
+    ParticleArray to clients.  particles must not be modified afterwards
+    """
+    frame_history.add(header, particles)
+    publish(particle_snapshot(header, particles))
+
+class SnapshotBuffer:
+    """Double-buffered snapshot of the particles in shared memory, written by
+    the master and read by the server process.
+
+    The shared memory starts with a control block of int64s, followed by two
+    slots that each hold the length of a JSON header, the header and the
+    fields of up to capacity particles, laid out as the arrays of a
+    ParticleArray.  The master writes each snapshot into the slot that is not
+    being read and then increments the sequence number, which publishes it.
+    A reader copies the published slot, and then checks that the sequence
+    number did not change while it did so (in which case it copies the new
+    slot instead), so that it serializes the copy without holding up the
+    master or being overtaken by it.
+
+    The control block also carries the requests from the API back to the
+    master: whether a client asked for a snapshot, and the number of workers
+    that a client asked for.
+
+    The metrics of /api/v1/metrics are kept as JSON after the slots.  Their
+    sequence number is odd while the master writes them, so a reader retries
+    until it copied them with the same even sequence number before and after
+    """
+    control_fields = ["sequence", "capacity", "snapshot_requested", "new_num_active_workers",
+            "metrics_sequence", "metrics_length"]
+    header_size = 4096
+    metrics_size = 65536
+    # (name, dtype, values per particle) of the arrays in a slot
+    fields = [
+        ("ids", np.int64, 1),
+        ("thread_nums", np.int64, 1),
+        ("positions", np.float64, 3),
+        ("velocities", np.float64, 3),
+        ("masses", np.float64, 1),
+        ("radii", np.float64, 1),
+    ]
+
+    def __init__(self, capacity = None, name = None):
+        """Create a SnapshotBuffer for capacity particles, or attach to the
+        one called name
+        """
+        control_size = 8*len(self.control_fields)
+        if name is None:
+            self.shared_memory = shared_memory.SharedMemory(create = True,
+                    size = control_size + 2*self.slot_size(capacity) + self.metrics_size)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name = name)
+            # Only the process that created the shared memory unlinks it
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shared_memory._name, "shared_memory")
+        self.name = self.shared_memory.name
+        self.control = np.ndarray(len(self.control_fields), dtype=np.int64,
+                buffer=self.shared_memory.buf)
+        if name is None:
+            self.control[:] = 0
+            self.control[self.control_fields.index("capacity")] = capacity
+        self.capacity = int(self.control[self.control_fields.index("capacity")])
+
+        self.slots = []
+        offset = control_size
+        for slot in range(2):
+            self.slots.append(self.slot_arrays(offset))
+            offset += self.slot_size(self.capacity)
+        self.metrics = np.ndarray(self.metrics_size, dtype=np.uint8,
+                buffer=self.shared_memory.buf, offset=offset)
+
+    @classmethod
+    def slot_size(cls, capacity):
+        return 16 + cls.header_size + capacity*8*sum(width for name, dtype, width in cls.fields)
+
+    def slot_arrays(self, offset):
+        """Return a dict of the arrays of the slot that starts at offset, all
+        backed by the shared memory
+        """
+        arrays = {"lengths": np.ndarray(2, dtype=np.int64, buffer=self.shared_memory.buf, offset=offset)}
+        offset += 16
+        arrays["header"] = np.ndarray(self.header_size, dtype=np.uint8,
+                buffer=self.shared_memory.buf, offset=offset)
+        offset += self.header_size
+        for name, dtype, width in self.fields:
+            shape = (self.capacity, 3) if width == 3 else (self.capacity,)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.capacity*width*8
+        return arrays
+
+    def get(self, field):
+        return int(self.control[self.control_fields.index(field)])
+
+    def set(self, field, value):
+        self.control[self.control_fields.index(field)] = value
+
+    def write(self, header, particles):
+        """Publish the params in header and the particles in a ParticleArray"""
+        if len(particles) > self.capacity:
+            util.error("snapshot of " + str(len(particles)) +
+                    " particles does not fit in a SnapshotBuffer for " + str(self.capacity))
+        header = json.dumps(header).encode("utf-8")
+        sequence = self.get("sequence")
+        slot = self.slots[(sequence + 1) % 2]
+        n = len(particles)
+        slot["lengths"][:] = (n, len(header))
+        slot["header"][:len(header)] = np.frombuffer(header, dtype=np.uint8)
+        for name, dtype, width in self.fields:
+            slot[name][:n] = getattr(particles, name)
+        self.set("sequence", sequence + 1)
+
+    def read(self, function, sequence = 0):
+        """Return the sequence number of the newest snapshot and
+        function(header, particles) called on it, or None if there is no
+        snapshot after sequence yet.  The published slot is copied out of
+        the shared memory first, and only the copy is retried if the master
+        published again while it was being made, so function runs once
+        however long it takes
+        """
+        while True:
+            newest = self.get("sequence")
+            if newest == sequence:
+                return None
+            slot = self.slots[newest % 2]
+            n, header_length = slot["lengths"]
+            header = slot["header"][:header_length].tobytes()
+            arrays = {name: slot[name][:n].copy() for name, dtype, width in self.fields}
+            # The master only starts overwriting this slot after publishing
+            # the next snapshot
+            if self.get("sequence") == newest:
+                break
+        header = json.loads(header.decode("utf-8"))
+        particles = ParticleArray(*[arrays[name] for name, dtype, width in self.fields],
+                references = arrays["positions"])
+        return newest, function(header, particles)
+
+    def write_metrics(self, metrics):
+        """Publish the metrics of /api/v1/metrics"""
+        metrics = json.dumps(metrics).encode("utf-8")
+        if len(metrics) > self.metrics_size:
+            util.info("metrics of " + str(len(metrics)) + " bytes do not fit in a SnapshotBuffer")
+            return
+        sequence = self.get("metrics_sequence")
+        self.set("metrics_sequence", sequence + 1)
+        self.metrics[:len(metrics)] = np.frombuffer(metrics, dtype=np.uint8)
+        self.set("metrics_length", len(metrics))
+        self.set("metrics_sequence", sequence + 2)
+
+    def read_metrics(self, sequence = 0):
+        """Return the sequence number of the newest metrics and the metrics,
+        or None if there are no metrics after sequence yet
+        """
+        while True:
+            newest = self.get("metrics_sequence")
+            if newest == sequence:
+                return None
+            if newest % 2:
+                time.sleep(0)
+                continue
+            metrics = self.metrics[:self.get("metrics_length")].tobytes()
+            if self.get("metrics_sequence") == newest:
+                return newest, json.loads(metrics.decode("utf-8"))
+
+    def take_requests(self):
+        """Move the requests that the server process received into params"""
+        if self.get("snapshot_requested"):
+            self.set("snapshot_requested", 0)
+            params.snapshot_requested = True
+        new_num_active_workers = self.get("new_num_active_workers")
+        if new_num_active_workers:
+            self.set("new_num_active_workers", 0)
+            params.new_num_active_workers = new_num_active_workers
+
+    def close(self, unlink = False):
+        self.control = self.slots = self.metrics = None
+        self.shared_memory.close()
+        if unlink:
+            self.shared_memory.unlink()
+
+class Server(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, body, content_type, content_encoding = None):
+        self.send_response(200)
+        # TODO: Security?
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept, Accept-Encoding")
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_bad_request(self):
+        self.send_response(400)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        """Handle GET requests to the API endpoint.  Particles are sent as
+        JSON unless the client asks for a binary frame (see frames.py) with
+        ?format=binary or an Accept header, and gzipped if the client accepts
+        it.  Metrics are sent as JSON, or in the Prometheus text format with
+        ?format=prometheus or an Accept header of text/plain
+        """
+        parsed_path = urlparse(self.path)
+        if "/api/v1/get_particles" in parsed_path:
+            params.snapshot_requested = True
+            current = snapshot
+            gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+            if frames.wants_frame(parse_qs(parsed_path.query), self.headers.get("Accept")):
+                body_format, content_type = "frame", frames.content_type
+            else:
+                body_format, content_type = "json", "application/json"
+            self.send_body(current.body(body_format, gzipped), content_type,
+                    "gzip" if gzipped else None)
+        elif "/api/v1/stream_particles" in parsed_path:
+            self.stream_particles(parse_qs(parsed_path.query))
+        elif "/api/v1/metrics" in parsed_path:
+            # Prometheus asks for text/plain
+            if (parse_qs(parsed_path.query).get("format", [None])[0] == "prometheus" or
+                    "text/plain" in self.headers.get("Accept", "")):
+                self.send_body(prometheus_body(metrics), "text/plain; version=0.0.4")
+            else:
+                self.send_body(json.dumps(metrics, indent = 4).encode("utf-8"), "application/json")
+        else:
+            util.info("GET sent to " + str(parsed_path[2]))
+            self.send_not_found()
+
+    def stream_particles(self, query):
+        """Stream the stream frames of frames.py as server-sent events, each
+        one base64 encoded with its frame number as the event id.  A client
+        resumes from the frame in its Last-Event-ID header (sent by browsers
+        when they reconnect) or ?from=, and otherwise starts at a keyframe
+        """
+        frame_number = self.headers.get("Last-Event-ID") or query.get("from", [None])[0]
+        try:
+            frame_number = int(frame_number)
+        except (TypeError, ValueError):
+            frame_number = None
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            with frame_history.subscribe():
+                while True:
+                    params.snapshot_requested = True
+                    events = frame_history.frames_since(frame_number)
+                    for frame_number, frame in events:
+                        self.wfile.write(("id: " + str(frame_number) + "\ndata: " +
+                            base64.b64encode(frame).decode("ascii") + "\n\n").encode("ascii"))
+                    if not events:
+                        # Comment line, so that closed connections are noticed
+                        self.wfile.write(b": waiting\n\n")
+                    self.wfile.flush()
+                    frame_history.wait(frame_number, timeout = 15)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def do_POST(self):
+        """Handle POST requests to the API endpoint"""
+        parsed_path = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        post_data = self.rfile.read(length).decode("utf-8")
+        if "/api/v1/post_parameters" in parsed_path:
+            # Parse data from POST
+            new_data = parse_qs(post_data)
+            util.debug("POST parameters: " + str(new_data))
+            if 'num_workers' in new_data:
+                # The master also clamps it to the number of workers it has
+                try:
+                    num_workers = int(new_data['num_workers'][0])
+                except ValueError:
+                    num_workers = 0
+                if num_workers < 1:
+                    util.info("Invalid number of active workers requested: " + new_data['num_workers'][0])
+                    self.send_bad_request()
+                    return
+                params.new_num_active_workers = num_workers
+            # Only used when replaying a trajectory
+            if 'frame' in new_data:
+                params.seek_frame = int(new_data['frame'][0])
+            self.send_response(200)
+            # TODO: Security?
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            util.info("POST sent to " + str(parsed_path[2]))
+            self.send_not_found()
+
+    def log_message(self, format, *args):
+        return
+
+def serve(host, port_number):
+    """Start serving the API on a background thread, and return the server"""
+    from http.server import ThreadingHTTPServer
+    class APIServer(ThreadingHTTPServer):
+        daemon_threads = True
+        # Let hundreds of pollers connect at once
+        request_queue_size = 1024
+    server = APIServer((host, port_number), Server)
+    util.info("Starting server on " + host + ":" + str(port_number) + ", ^c to exit")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_server_process(snapshot_buffer, host, port_number):
+    """Start serving the API from a separate process that reads the
+    snapshots from snapshot_buffer, and return the process
+    """
+    import subprocess
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__),
+        "--shared-memory", snapshot_buffer.name, "--host", host,
+        "--port", str(port_number)])
+
+def run_server_process(name, host, port_number, poll_interval = 0.005):
+    """Serve the API from the snapshots in the SnapshotBuffer called name
+    until the process that started this one exits
+    """
+    snapshot_buffer = SnapshotBuffer(name = name)
+    serve(host, port_number)
+    parent = os.getppid()
+    sequence = 0
+    metrics_sequence = 0
+    params.snapshot_requested = False
+    params.new_num_active_workers = None
+
+    def quantize(header, particles):
+        return header, particles, frames.quantized_state(particles)
+
+    while os.getppid() == parent:
+        # Forward the requests from clients to the master
+        if params.snapshot_requested:
+            params.snapshot_requested = False
+            snapshot_buffer.set("snapshot_requested", 1)
+        if params.new_num_active_workers:
+            snapshot_buffer.set("new_num_active_workers", params.new_num_active_workers)
+            params.new_num_active_workers = None
+
+        newest_metrics = snapshot_buffer.read_metrics(metrics_sequence)
+        if newest_metrics is not None:
+            metrics_sequence, new_metrics = newest_metrics
+            publish_metrics(new_metrics)
+
+        newest = snapshot_buffer.read(quantize, sequence)
+        if newest is None:
+            time.sleep(poll_interval)
+            continue
+        sequence, (header, particles, state) = newest
+        frame_history.add_state(header, state)
+        publish(particle_snapshot(header, particles))
+    snapshot_buffer.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shared-memory", required = True,
+            help = "name of the SnapshotBuffer written by the master")
+    parser.add_argument("--host", default = "10.0.0.101",
+            help = "address that the API server listens on")
+    parser.add_argument("--port", type=int, default = 8080,
+            help = "port that the API server listens on")
+    args = parser.parse_args()
+    run_server_process(args.shared_memory, args.host, args.port)
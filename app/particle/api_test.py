@@ -0,0 +1,188 @@
+#!/usr/bin/python
+"""
+Unit test file for api.py
+"""
+import unittest
+import gzip
+import json
+import http.client
+import threading
+import time
+import numpy as np
+import params
+import frames
+import api
+from ParticleArray import ParticleArray
+
+metrics = {
+    "iterations": 100,
+    "steps": 100,
+    "num_active_workers": 1,
+    "timesteps_per_second": 50.0,
+    "total_energy": 1000.0,
+    "ranks": [
+        {"rank": 0, "thread_num": 0, "particles": 0, "phase_ms": {"master_sync": 0.5}, "counts": {}},
+        {"rank": 1, "thread_num": 1, "particles": 10, "phase_ms": {"forces": 2.0},
+            "counts": {"neighbor_pairs": 45.0}},
+    ],
+}
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = api.serve("127.0.0.1", 0)
+        cls.port = cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        api.publish(api.Snapshot(b"{\"particles\": []}", frames.encode({"a": 1}, ParticleArray())))
+        self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout = 10)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def get(self, path, headers = {}):
+        self.connection.request("GET", path, headers = headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_keep_alive(self):
+        for i in range(3):
+            response, body = self.get("/api/v1/get_particles")
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader("Content-Type"), "application/json")
+            self.assertEqual(body, b"{\"particles\": []}")
+        response, body = self.get("/api/v1/get_particles?format=binary")
+        self.assertEqual(frames.decode(body)[0], {"a": 1})
+        response, body = self.get("/missing")
+        self.assertEqual(response.status, 404)
+
+    def test_gzip(self):
+        response, body = self.get("/api/v1/get_particles",
+                {"Accept-Encoding": "gzip", "Accept": frames.content_type})
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(frames.decode(gzip.decompress(body))[0], {"a": 1})
+
+    def test_metrics(self):
+        api.publish_metrics(metrics)
+        response, body = self.get("/api/v1/metrics")
+        self.assertEqual(response.getheader("Content-Type"), "application/json")
+        self.assertEqual(json.loads(body), metrics)
+        response, body = self.get("/api/v1/metrics", {"Accept": "text/plain"})
+        self.assertEqual(response.getheader("Content-Type"), "text/plain; version=0.0.4")
+        lines = body.decode("utf-8").splitlines()
+        self.assertIn("compactcori_iterations 100.0", lines)
+        self.assertIn("compactcori_total_energy 1000.0", lines)
+        self.assertIn("compactcori_phase_milliseconds{rank=\"1\",thread_num=\"1\",phase=\"forces\"} 2.0", lines)
+        self.assertIn("compactcori_count{rank=\"1\",thread_num=\"1\",counter=\"neighbor_pairs\"} 45.0", lines)
+        self.assertEqual(self.get("/api/v1/metrics?format=prometheus")[1], body)
+
+    def test_post_parameters(self):
+        self.connection.request("POST", "/api/v1/post_parameters", body = "num_workers=3",
+                headers = {"Content-Type": "application/x-www-form-urlencoded"})
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(params.new_num_active_workers, 3)
+
+    def test_post_invalid_num_workers(self):
+        params.new_num_active_workers = 2
+        for num_workers in ("0", "-1", "many"):
+            self.connection.request("POST", "/api/v1/post_parameters", body = "num_workers=" + num_workers,
+                    headers = {"Content-Type": "application/x-www-form-urlencoded"})
+            response = self.connection.getresponse()
+            response.read()
+            self.assertEqual(response.status, 400)
+        self.assertEqual(params.new_num_active_workers, 2)
+
+class TestSnapshot(unittest.TestCase):
+    def test_serialize_on_first_request(self):
+        calls = []
+        def serialize():
+            calls.append(1)
+            return b"{}"
+        snapshot = api.Snapshot(serialize, b"frame")
+        self.assertEqual(calls, [])
+        self.assertEqual(snapshot.body("json"), b"{}")
+        self.assertEqual(gzip.decompress(snapshot.body("json", True)), b"{}")
+        self.assertEqual(calls, [1])
+
+class TestSnapshotBuffer(unittest.TestCase):
+    def setUp(self):
+        self.writer = api.SnapshotBuffer(10)
+        self.reader = api.SnapshotBuffer(name = self.writer.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close(unlink = True)
+
+    def test_read_newest(self):
+        def ids(header, particles):
+            return header["step"], particles.ids.tolist(), particles.positions.tolist()
+
+        self.assertIsNone(self.reader.read(ids))
+        for step in range(3):
+            particles = ParticleArray(np.arange(step + 1) + 10*step, np.ones(step + 1),
+                    np.full((step + 1, 3), float(step)))
+            self.writer.write({"step": step}, particles)
+        sequence, (step, particle_ids, positions) = self.reader.read(ids)
+        self.assertEqual(sequence, 3)
+        self.assertEqual(step, 2)
+        self.assertEqual(particle_ids, [20, 21, 22])
+        self.assertEqual(positions, [[2.0]*3]*3)
+        self.assertIsNone(self.reader.read(ids, sequence))
+
+    def test_metrics(self):
+        self.assertIsNone(self.reader.read_metrics())
+        self.writer.write_metrics(metrics)
+        sequence, read_metrics = self.reader.read_metrics()
+        self.assertEqual(read_metrics, metrics)
+        self.assertIsNone(self.reader.read_metrics(sequence))
+
+    def test_read_while_writing_faster(self):
+        """The reader gets a consistent snapshot even when the master
+        publishes several snapshots while it serializes one
+        """
+        stop = threading.Event()
+        def write():
+            step = 0
+            while not stop.is_set():
+                self.writer.write({"step": step}, ParticleArray(np.full(10, step), np.ones(10),
+                    np.full((10, 3), float(step))))
+                step += 1
+                time.sleep(0.001)
+        def slow_serialize(header, particles):
+            time.sleep(0.05)
+            return header["step"], particles.ids.tolist(), particles.positions.tolist()
+
+        writer_thread = threading.Thread(target = write)
+        writer_thread.start()
+        try:
+            while self.writer.get("sequence") == 0:
+                time.sleep(0.001)
+            start = time.time()
+            sequence = 0
+            for i in range(3):
+                sequence, (step, particle_ids, positions) = self.reader.read(slow_serialize, sequence)
+                self.assertEqual(particle_ids, [step]*10)
+                self.assertEqual(positions, [[float(step)]*3]*10)
+            self.assertLess(time.time() - start, 1.0)
+        finally:
+            stop.set()
+            writer_thread.join()
+
+    def test_requests(self):
+        params.snapshot_requested = False
+        self.reader.set("snapshot_requested", 1)
+        self.reader.set("new_num_active_workers", 4)
+        self.writer.take_requests()
+        self.assertTrue(params.snapshot_requested)
+        self.assertEqual(params.new_num_active_workers, 4)
+        self.assertEqual(self.writer.get("new_num_active_workers"), 0)
+
+if __name__ == '__main__':
+    unittest.main()
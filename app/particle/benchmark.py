@@ -0,0 +1,192 @@
+#!/usr/bin/python
+"""Benchmark the simulation over a matrix of particle counts, worker counts
+and neighbor searches.
+
+    python3 benchmark.py [--particles 1000 10000] [--workers 1 2 4]
+            [--neighbor-search cells verlet] [--steps 50]
+            [--backend local|mpi] [--mpirun "mpirun --hostfile hosts"]
+            [--output results.json] [--csv results.csv]
+            [--baseline old.json] [--tolerance 0.1]
+
+Every configuration runs particle_simulation.py headless (no API server, no
+LEDs) for --steps timesteps from the same seeded initial particles, and
+reports the steps per second, the time per step of each phase (on the
+slowest worker, in milliseconds, and separately on the master) and the
+strong and weak scaling efficiency:
+
+    strong  speedup over the fewest workers with the same number of
+            particles, divided by the increase in the number of workers
+    weak    steps per second relative to the fewest workers with the same
+            number of particles per worker
+
+With --baseline, configurations that got more than --tolerance slower than
+in the results of an earlier run are reported as regressions, and the exit
+status is 1.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+
+import argparse
+import csv
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+
+simulation = os.path.join(os.path.dirname(os.path.abspath(__file__)), "particle_simulation.py")
+
+def command(backend, num_particles, num_workers, neighbor_search, steps, timings,
+        extra_args = (), mpirun = "mpirun"):
+    """Return the command that runs one configuration and writes its timings"""
+    arguments = [simulation, "-n", str(num_particles), "--neighbor-search",
+            neighbor_search, "--steps", str(steps), "--headless", "--timings",
+            timings, "--initialization", "parallel", "--seed", "0"] + list(extra_args)
+    if backend == "local":
+        return [sys.executable, *arguments, "--backend", "local", "--num-workers", str(num_workers)]
+    num_ranks = num_workers if "--master-computes" in extra_args else num_workers + 1
+    return shlex.split(mpirun) + ["-n", str(num_ranks), sys.executable, *arguments]
+
+def summarize(timings):
+    """Reduce the timings written by particle_simulation.py --timings to one
+    result: the time per step of each phase on the slowest worker.  The
+    phases of a master that does not compute are kept apart, since most of
+    its time is spent waiting for the workers
+    """
+    steps = timings["steps"]
+    workers = timings["phases"] if timings["master_computes"] else timings["phases"][1:]
+    phases = sorted(set(name for rank in workers for name in rank))
+    return {
+        "num_particles": timings["num_particles"],
+        "num_workers": timings["num_workers"],
+        "neighbor_search": timings["neighbor_search"],
+        "steps_per_second": timings["steps_per_second"],
+        "phase_ms": {name: 1000*max(rank.get(name, 0.0) for rank in workers)/steps
+            for name in phases},
+        "master_phase_ms": {} if timings["master_computes"] else
+            {name: 1000*seconds/steps for name, seconds in timings["phases"][0].items()},
+    }
+
+def key(result):
+    return (result["num_particles"], result["num_workers"], result["neighbor_search"])
+
+def add_efficiencies(results):
+    """Add the strong and weak scaling efficiency to every result"""
+    for result in results:
+        same_particles = [other for other in results if
+                other["neighbor_search"] == result["neighbor_search"] and
+                other["num_particles"] == result["num_particles"]]
+        reference = min(same_particles, key = lambda other: other["num_workers"])
+        speedup = result["steps_per_second"]/reference["steps_per_second"]
+        result["strong_efficiency"] = speedup*reference["num_workers"]/result["num_workers"]
+
+        per_worker = result["num_particles"]/result["num_workers"]
+        same_load = [other for other in results if
+                other["neighbor_search"] == result["neighbor_search"] and
+                other["num_particles"]/other["num_workers"] == per_worker]
+        reference = min(same_load, key = lambda other: other["num_workers"])
+        result["weak_efficiency"] = result["steps_per_second"]/reference["steps_per_second"]
+
+def regressions(results, baseline, tolerance):
+    """Return (result, baseline steps per second) for every result that is
+    more than tolerance slower than the same configuration in baseline
+    """
+    baseline = {key(result): result for result in baseline}
+    slower = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old and result["steps_per_second"] < (1 - tolerance)*old["steps_per_second"]:
+            slower.append((result, old["steps_per_second"]))
+    return slower
+
+def write_csv(results, filename):
+    phases = sorted(set(name for result in results for name in result["phase_ms"]))
+    with open(filename, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["num_particles", "num_workers", "neighbor_search",
+            "steps_per_second", "strong_efficiency", "weak_efficiency"] +
+            [name + "_ms" for name in phases])
+        for result in results:
+            writer.writerow([result["num_particles"], result["num_workers"],
+                result["neighbor_search"], result["steps_per_second"],
+                result["strong_efficiency"], result["weak_efficiency"]] +
+                [result["phase_ms"].get(name, 0.0) for name in phases])
+
+def run(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        timings = os.path.join(directory, "timings.json")
+        for neighbor_search in args.neighbor_search:
+            for num_particles in args.particles:
+                for num_workers in args.workers:
+                    util.info("Running " + str(num_particles) + " particles on " +
+                            str(num_workers) + " workers with " + neighbor_search)
+                    subprocess.run(command(args.backend, num_particles, num_workers,
+                        neighbor_search, args.steps, timings, args.simulation_args, args.mpirun),
+                        check = True, stdout = subprocess.DEVNULL)
+                    with open(timings) as f:
+                        results.append(summarize(json.load(f)))
+    add_efficiencies(results)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--particles", type=int, nargs="+", default = [1000, 10000],
+            help = "numbers of particles")
+    parser.add_argument("--workers", type=int, nargs="+", default = [1, 2, 4],
+            help = "numbers of workers")
+    parser.add_argument("--neighbor-search", nargs="+", default = ["cells"],
+            choices = ["cells", "verlet", "brute"],
+            help = "neighbor searches to compare")
+    parser.add_argument("--steps", type=int, default = 50,
+            help = "timesteps run by every configuration")
+    parser.add_argument("--backend", choices = ["local", "mpi"], default = "local",
+            help = "run the workers as local processes, or with mpirun")
+    parser.add_argument("--mpirun", default = "mpirun",
+            help = "command that starts the ranks of --backend mpi, without -n")
+    parser.add_argument("--output", default = "benchmark.json",
+            help = "JSON file that the results are written to")
+    parser.add_argument("--csv",
+            help = "CSV file that the results are also written to")
+    parser.add_argument("--baseline",
+            help = "JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default = 0.1,
+            help = "slowdown relative to --baseline that counts as a regression")
+    parser.add_argument("simulation_args", nargs = argparse.REMAINDER,
+            help = "arguments passed on to particle_simulation.py, after --")
+    args = parser.parse_args()
+    args.simulation_args = [arg for arg in args.simulation_args if arg != "--"]
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 4)
+    if args.csv:
+        write_csv(results, args.csv)
+    for result in results:
+        print("{:>9} particles {:>3} workers {:>6}: {:8.2f} steps/s, strong {:.2f}, weak {:.2f}".format(
+            result["num_particles"], result["num_workers"], result["neighbor_search"],
+            result["steps_per_second"], result["strong_efficiency"], result["weak_efficiency"]))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for result, old in slower:
+            util.info("Regression: {} particles on {} workers with {}: {:.2f} steps/s, was {:.2f}".format(
+                result["num_particles"], result["num_workers"],
+                result["neighbor_search"], result["steps_per_second"], old))
+        if slower:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+"""
+Unit test file for benchmark.py
+"""
+import unittest
+import benchmark
+
+def result(num_particles, num_workers, steps_per_second):
+    return {"num_particles": num_particles, "num_workers": num_workers,
+            "neighbor_search": "cells", "steps_per_second": steps_per_second,
+            "phase_ms": {}}
+
+class TestBenchmark(unittest.TestCase):
+    def test_summarize(self):
+        summary = benchmark.summarize({"num_particles": 100, "num_workers": 2,
+            "neighbor_search": "cells", "master_computes": False, "steps": 10,
+            "steps_per_second": 5.0,
+            "phases": [{"master_sync": 0.1}, {"forces": 0.5, "halo": 0.2}, {"forces": 1.0}]})
+        self.assertEqual(summary["phase_ms"], {"forces": 100.0, "halo": 20.0})
+        self.assertEqual(summary["master_phase_ms"], {"master_sync": 10.0})
+
+    def test_efficiencies(self):
+        results = [result(1000, 1, 10.0), result(1000, 2, 15.0), result(2000, 2, 5.0)]
+        benchmark.add_efficiencies(results)
+        self.assertEqual([r["strong_efficiency"] for r in results], [1.0, 0.75, 1.0])
+        self.assertEqual([r["weak_efficiency"] for r in results], [1.0, 1.0, 0.5])
+
+    def test_regressions(self):
+        baseline = [result(1000, 1, 10.0), result(1000, 2, 20.0)]
+        results = [result(1000, 1, 9.5), result(1000, 2, 17.0), result(1000, 4, 1.0)]
+        slower = benchmark.regressions(results, baseline, 0.1)
+        self.assertEqual([(r["num_workers"], old) for r, old in slower], [(2, 20.0)])
+
+if __name__ == '__main__':
+    unittest.main()
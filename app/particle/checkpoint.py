@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""Checkpoint/restart of the full state of a simulation.
+
+A checkpoint is a single uncompressed .npz file holding every particle as the
+packed (n, num_fields) buffer of a ParticleArray, and the params needed to
+resume the run (box, dt, force, energies, active workers, decomposition,
+iteration and the state of the random module) as a JSON document.  write
+hands the packed copy of the particles to a background thread, so the
+simulation keeps running while the file is written.  The file is written
+next to its destination and then renamed over it, so a crash never leaves
+a partial checkpoint behind.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+import params
+from ParticleArray import ParticleArray
+
+import json
+import os
+import random
+import threading
+import numpy as np
+
+# params that are saved in a checkpoint and restored on restart
+saved_params = ["num_particles", "simulation_height", "simulation_width",
+        "simulation_depth", "dt", "force", "max_radius", "init_total_energy",
+        "curr_total_energy", "num_active_workers", "decomposition", "dims",
+        "previous_dt"]
+
+writer = None
+
+def state(iterations):
+    """Return the params to save in a checkpoint taken after iterations
+    timesteps, as a dict that can be serialized to JSON
+    """
+    saved = {name: getattr(params, name) for name in saved_params}
+    saved["dims"] = [int(d) for d in params.dims]
+    saved["cuts"] = [[float(c) for c in cuts] for cuts in params.cuts]
+    saved["iterations"] = iterations
+    saved["random_state"] = random.getstate()
+    return json.loads(json.dumps(saved))
+
+def save(filename, saved_state, buffer):
+    """Write a checkpoint file from a state dict and packed particles"""
+    temp_filename = filename + ".tmp.npz"
+    header = np.frombuffer(json.dumps(saved_state).encode("utf-8"), dtype=np.uint8)
+    with open(temp_filename, "wb") as f:
+        np.savez(f, state=header, particles=buffer)
+    os.replace(temp_filename, filename)
+
+def write(filename, iterations, particles):
+    """Start writing a checkpoint of the particles in a ParticleArray in the
+    background.  The previous checkpoint is finished first
+    """
+    global writer
+    wait()
+    writer = threading.Thread(target=save, args=(filename, state(iterations), particles.pack()))
+    writer.start()
+
+def wait():
+    """Block until the checkpoint being written (if any) is finished"""
+    if writer is not None:
+        writer.join()
+
+def read(filename):
+    """Return the state dict and the ParticleArray saved in a checkpoint"""
+    with np.load(filename, allow_pickle=False) as checkpoint:
+        saved_state = json.loads(checkpoint["state"].tobytes().decode("utf-8"))
+        particles = ParticleArray.unpack(checkpoint["particles"])
+    return saved_state, particles
+
+def restore(saved_state):
+    """Restore the params saved in a state dict, other than the number of
+    active workers and the shape of the decomposition, which depend on the
+    number of ranks of the new run (see restore_decomposition)
+    """
+    for name in saved_params:
+        if name not in ("num_active_workers", "dims") and name in saved_state:
+            setattr(params, name, saved_state[name])
+    random.setstate(tuple(tuple(x) if isinstance(x, list) else x
+        for x in saved_state["random_state"]))
+
+def restore_decomposition(saved_state):
+    """Switch to the decomposition of the number of active workers saved in
+    a state dict (at most params.max_workers), and restore the saved
+    partition boundaries if the decomposition has the same shape as the
+    saved one.  Returns the number of active workers
+    """
+    num_active_workers = min(saved_state["num_active_workers"], params.max_workers)
+    util.update_decomposition(num_active_workers)
+    if list(params.dims) == saved_state["dims"]:
+        params.cuts = [np.array(cuts) for cuts in saved_state["cuts"]]
+    return num_active_workers
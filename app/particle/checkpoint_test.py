@@ -0,0 +1,122 @@
+#!/usr/bin/python
+"""
+Unit test file for checkpoint.py
+"""
+import unittest
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import util
+import params
+import checkpoint
+from ParticleArray import ParticleArray
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        params.num_particles = 20
+        params.simulation_height = params.simulation_width = params.simulation_depth = 1000
+        params.dt = 0.0005
+        params.force = 100000
+        params.max_radius = 31
+        params.init_total_energy = params.curr_total_energy = 12.5
+        params.num_active_workers = 2
+        params.max_workers = 2
+        params.previous_dt = None
+        params.decomposition = "x"
+        util.update_decomposition(2)
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        particles = ParticleArray(np.arange(20), np.ones(20), rng.uniform(0, 1000, (20, 3)),
+                rng.uniform(-100, 100, (20, 3)), np.full(20, 3), np.full(20, 30))
+        random.seed(1)
+        expected_random = random.random()
+        random.seed(1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "checkpoint.npz")
+            params.cuts[0] = np.array([0, 400, 1000])
+            checkpoint.write(filename, 7, particles)
+            checkpoint.wait()
+            self.assertEqual(os.listdir(directory), ["checkpoint.npz"])
+
+            params.dt = params.init_total_energy = None
+            util.update_decomposition(2)
+            random.random()
+            saved_state, restored = checkpoint.read(filename)
+
+        checkpoint.restore(saved_state)
+        self.assertEqual(checkpoint.restore_decomposition(saved_state), 2)
+        self.assertEqual(saved_state["iterations"], 7)
+        self.assertEqual(params.dt, 0.0005)
+        self.assertEqual(params.init_total_energy, 12.5)
+        self.assertEqual(list(params.cuts[0]), [0, 400, 1000])
+        self.assertEqual(random.random(), expected_random)
+        self.assertEqual(restored.ids.tolist(), particles.ids.tolist())
+        self.assertTrue((restored.positions == particles.positions).all())
+        self.assertTrue((restored.velocities == particles.velocities).all())
+
+    def test_resized_round_trip(self):
+        """A run that was resized to fewer workers than it has restarts with
+        that many workers, its boundaries and the dt of its last step
+        """
+        params.max_workers = 4
+        params.num_active_workers = 2
+        params.dt = 0.0004
+        params.previous_dt = 0.0003
+        util.update_decomposition(2)
+        params.cuts[0] = np.array([0, 300, 1000])
+        particles = ParticleArray(np.arange(2), np.ones(2), np.full((2, 3), 500.0),
+                np.zeros((2, 3)), np.full(2, 3), np.full(2, 30))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "checkpoint.npz")
+            checkpoint.write(filename, 7, particles)
+            checkpoint.wait()
+            params.dt = params.previous_dt = None
+            util.update_decomposition(4)
+            saved_state, restored = checkpoint.read(filename)
+
+        checkpoint.restore(saved_state)
+        self.assertEqual(checkpoint.restore_decomposition(saved_state), 2)
+        self.assertEqual(params.dims, [2, 1, 1])
+        self.assertEqual(list(params.cuts[0]), [0, 300, 1000])
+        self.assertEqual(params.dt, 0.0004)
+        self.assertEqual(params.previous_dt, 0.0003)
+
+        # With fewer ranks than active workers, the boundaries cannot be kept
+        params.max_workers = 1
+        self.assertEqual(checkpoint.restore_decomposition(saved_state), 1)
+        self.assertEqual(list(params.cuts[0]), [0, 1000])
+
+class TestRestart(unittest.TestCase):
+    def run_simulation(self, directory, steps, checkpoint_file, *extra_args):
+        simulation = os.path.join(os.path.dirname(os.path.abspath(__file__)), "particle_simulation.py")
+        subprocess.run([sys.executable, simulation, "--backend", "local", "--num-workers", "3",
+            "-n", "300", "--headless", "--initialization", "parallel", "--seed", "0",
+            "--load-balance-interval", "3", "--load-balance-metric", "particles",
+            "--steps", str(steps), "--checkpoint-interval", str(steps),
+            "--checkpoint-file", os.path.join(directory, checkpoint_file), *extra_args],
+            check = True, cwd = directory, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        saved_state, particles = checkpoint.read(os.path.join(directory, checkpoint_file))
+        return saved_state, particles.select(np.argsort(particles.ids))
+
+    def test_restart_at_load_balance_step(self):
+        """A run restarted from a checkpoint taken at a load balancing step
+        matches the run that went on
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_simulation(directory, 6, "first.npz")
+            continuous_state, continuous = self.run_simulation(directory, 9, "continuous.npz")
+            restarted_state, restarted = self.run_simulation(directory, 3, "restarted.npz",
+                    "--restart", os.path.join(directory, "first.npz"))
+        self.assertEqual(restarted_state["iterations"], 9)
+        self.assertEqual(restarted_state["cuts"], continuous_state["cuts"])
+        self.assertEqual(restarted.ids.tolist(), continuous.ids.tolist())
+        np.testing.assert_array_equal(restarted.positions, continuous.positions)
+        np.testing.assert_array_equal(restarted.velocities, continuous.velocities)
+
+if __name__ == '__main__':
+    unittest.main()
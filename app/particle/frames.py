@@ -0,0 +1,313 @@
+#!/usr/bin/python
+"""Binary frame format for /api/v1/get_particles.
+
+A frame holds the same information as the JSON endpoint in a fraction of the
+size, and can be read by a client straight into typed arrays.  Every field is
+little-endian and every array starts on a 4 byte boundary:
+
+    magic           4 bytes     b"CCFR"
+    version         uint32
+    num_particles   uint32      n
+    header_length   uint32      length of the header in bytes, a multiple of 4
+    header          JSON object with the simulation params, padded with spaces
+    ids             uint32[n]
+    positions       float32[n][3]
+    velocities      float32[n][3]
+    radii           float32[n]
+    thread_nums     uint16[n]
+
+For live streaming, frames are delta encoded instead.  Positions are
+quantized to multiples of quantum, and a stream frame only carries the
+changes since the previous frame:
+
+    magic           4 bytes     b"CCFS"
+    version         uint32
+    frame_number    uint32
+    keyframe        uint32      1 if the client has to drop its state first
+    header_length   uint32
+    num_removed     uint32      r
+    num_added       uint32      a
+    num_migrated    uint32      m
+    num_moved       uint32      n
+    header          JSON object with the simulation params, padded with spaces
+    removed ids     uint32[r]
+    added ids       uint32[a]
+    added positions int32[a][3] in multiples of quantum
+    added radii     float32[a]
+    migrated ids    uint32[m]
+    moved deltas    int16[n][3] change in the quantized position of every
+                    particle left after removing the removed ids, in order
+                    of increasing id
+    added threads   uint16[a]
+    migrated threads uint16[m]
+
+A keyframe is a stream frame from an empty state, so it adds every particle.
+A particle that moves further than an int16 delta can hold is removed and
+added again.  apply_stream_frame shows how a client rebuilds the particles.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import collections
+import contextlib
+import threading
+import json
+import numpy as np
+
+magic = b"CCFR"
+version = 1
+content_type = "application/vnd.compactcori.frame"
+
+stream_magic = b"CCFS"
+quantum = 1/16
+
+prefix_dtype = np.dtype([("magic", "S4"), ("version", "<u4"),
+    ("num_particles", "<u4"), ("header_length", "<u4")])
+
+# (name, dtype, number of values per particle) in the order of the frame
+fields = [
+    ("ids", np.dtype("<u4"), 1),
+    ("positions", np.dtype("<f4"), 3),
+    ("velocities", np.dtype("<f4"), 3),
+    ("radii", np.dtype("<f4"), 1),
+    ("thread_nums", np.dtype("<u2"), 1),
+]
+
+def encode(header, particles):
+    """Return the frame holding the header dict and every particle in a
+    ParticleArray as bytes
+    """
+    header = json.dumps(header).encode("utf-8")
+    header += b" "*(-len(header) % 4)
+    prefix = np.array([(magic, version, len(particles), len(header))], dtype=prefix_dtype)
+    parts = [prefix.tobytes(), header]
+    for name, dtype, width in fields:
+        parts.append(np.ascontiguousarray(getattr(particles, name), dtype=dtype).tobytes())
+    return b"".join(parts)
+
+def decode(frame):
+    """Return the header dict and a dict of numpy arrays (keyed by the names
+    in fields) read from a frame created by encode
+    """
+    prefix = np.frombuffer(frame, dtype=prefix_dtype, count=1)[0]
+    if prefix["magic"] != magic or prefix["version"] != version:
+        raise ValueError("not a version " + str(version) + " particle frame")
+    n = int(prefix["num_particles"])
+    offset = prefix_dtype.itemsize + int(prefix["header_length"])
+    header = json.loads(frame[prefix_dtype.itemsize:offset].decode("utf-8"))
+    arrays = {}
+    for name, dtype, width in fields:
+        array = np.frombuffer(frame, dtype=dtype, count=n*width, offset=offset)
+        arrays[name] = array.reshape(n, 3) if width == 3 else array
+        offset += n*width*dtype.itemsize
+    return header, arrays
+
+def wants_frame(query, accept):
+    """Return whether a GET request with the parsed query string and Accept
+    header negotiated the binary frame format instead of JSON
+    """
+    if "format" in query:
+        return query["format"][0] == "binary"
+    accept = accept or ""
+    return content_type in accept or "application/octet-stream" in accept
+
+stream_prefix_dtype = np.dtype([("magic", "S4"), ("version", "<u4"),
+    ("frame_number", "<u4"), ("keyframe", "<u4"), ("header_length", "<u4"),
+    ("num_removed", "<u4"), ("num_added", "<u4"), ("num_migrated", "<u4"),
+    ("num_moved", "<u4")])
+
+# (name, dtype, values per item, count) in the order of a stream frame
+stream_fields = [
+    ("removed_ids", np.dtype("<u4"), 1, "num_removed"),
+    ("added_ids", np.dtype("<u4"), 1, "num_added"),
+    ("added_positions", np.dtype("<i4"), 3, "num_added"),
+    ("added_radii", np.dtype("<f4"), 1, "num_added"),
+    ("migrated_ids", np.dtype("<u4"), 1, "num_migrated"),
+    ("moved_deltas", np.dtype("<i2"), 3, "num_moved"),
+    ("added_thread_nums", np.dtype("<u2"), 1, "num_added"),
+    ("migrated_thread_nums", np.dtype("<u2"), 1, "num_migrated"),
+]
+
+def empty_state():
+    """Return the state of a client that has not received any frame"""
+    return {"ids": np.zeros(0, dtype=np.int64),
+            "positions": np.zeros((0, 3), dtype=np.int64),
+            "radii": np.zeros(0, dtype=np.float32),
+            "thread_nums": np.zeros(0, dtype=np.int64)}
+
+def quantized_state(particles):
+    """Return the state that a client holds after receiving the particles in
+    a ParticleArray, sorted by id
+    """
+    order = np.argsort(particles.ids, kind="stable")
+    return {"ids": particles.ids[order],
+            "positions": np.rint(particles.positions[order]/quantum).astype(np.int64),
+            "radii": particles.radii[order].astype(np.float32),
+            "thread_nums": particles.thread_nums[order]}
+
+def encode_stream_frame(header, frame_number, previous, state, keyframe):
+    """Return the stream frame that turns the state previous into state.  If
+    keyframe is set, previous must be empty_state()
+    """
+    # Particles in both states that did not move too far are moved, and every
+    # other particle in previous is removed
+    both = np.intersect1d(previous["ids"], state["ids"], assume_unique=True)
+    old = np.searchsorted(previous["ids"], both)
+    new = np.searchsorted(state["ids"], both)
+    deltas = state["positions"][new] - previous["positions"][old]
+    small = (np.abs(deltas) <= np.iinfo(np.int16).max).all(axis=1)
+    old, new, deltas = old[small], new[small], deltas[small]
+    removed = np.ones(len(previous["ids"]), dtype=bool)
+    removed[old] = False
+    added = np.ones(len(state["ids"]), dtype=bool)
+    added[new] = False
+    migrated = new[previous["thread_nums"][old] != state["thread_nums"][new]]
+
+    arrays = {
+        "removed_ids": previous["ids"][removed],
+        "added_ids": state["ids"][added],
+        "added_positions": state["positions"][added],
+        "added_radii": state["radii"][added],
+        "migrated_ids": state["ids"][migrated],
+        "moved_deltas": deltas,
+        "added_thread_nums": state["thread_nums"][added],
+        "migrated_thread_nums": state["thread_nums"][migrated],
+    }
+    header = dict(header, quantum=quantum)
+    header = json.dumps(header).encode("utf-8")
+    header += b" "*(-len(header) % 4)
+    prefix = np.array([(stream_magic, version, frame_number, int(keyframe),
+        len(header), len(arrays["removed_ids"]), len(arrays["added_ids"]),
+        len(migrated), len(deltas))], dtype=stream_prefix_dtype)
+    parts = [prefix.tobytes(), header]
+    for name, dtype, width, count in stream_fields:
+        parts.append(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+    return b"".join(parts)
+
+def decode_stream_frame(frame):
+    """Return the prefix, header dict and a dict of numpy arrays (keyed by
+    the names in stream_fields) read from a stream frame
+    """
+    prefix = np.frombuffer(frame, dtype=stream_prefix_dtype, count=1)[0]
+    if prefix["magic"] != stream_magic or prefix["version"] != version:
+        raise ValueError("not a version " + str(version) + " stream frame")
+    offset = stream_prefix_dtype.itemsize + int(prefix["header_length"])
+    header = json.loads(frame[stream_prefix_dtype.itemsize:offset].decode("utf-8"))
+    arrays = {}
+    for name, dtype, width, count in stream_fields:
+        n = int(prefix[count])
+        array = np.frombuffer(frame, dtype=dtype, count=n*width, offset=offset)
+        arrays[name] = array.reshape(n, 3) if width == 3 else array
+        offset += n*width*dtype.itemsize
+    return prefix, header, arrays
+
+def apply_stream_frame(state, frame):
+    """Return the frame number, header dict and the new state of a client
+    with the given state after it receives a stream frame
+    """
+    prefix, header, arrays = decode_stream_frame(frame)
+    if prefix["keyframe"]:
+        state = empty_state()
+    keep = ~np.isin(state["ids"], arrays["removed_ids"])
+    ids = np.concatenate([state["ids"][keep], arrays["added_ids"]])
+    positions = state["positions"][keep] + arrays["moved_deltas"]
+    positions = np.concatenate([positions, arrays["added_positions"]])
+    radii = np.concatenate([state["radii"][keep], arrays["added_radii"]])
+    thread_nums = np.concatenate([state["thread_nums"][keep], arrays["added_thread_nums"]])
+    order = np.argsort(ids, kind="stable")
+    state = {"ids": ids[order], "positions": positions[order],
+            "radii": radii[order], "thread_nums": thread_nums[order]}
+    migrated = np.searchsorted(state["ids"], arrays["migrated_ids"])
+    state["thread_nums"][migrated] = arrays["migrated_thread_nums"]
+    return int(prefix["frame_number"]), header, state
+
+class FrameHistory:
+    """The stream frames of the most recent snapshots, shared between the
+    simulation loop that adds them and the server threads that stream them.
+
+    Adding a snapshot only stores its quantized state.  While a client is
+    subscribed, each snapshot is also encoded as a delta from the previous
+    snapshot, and the keyframe of the latest snapshot is encoded when a
+    client first asks for it.  A client that has frame k catches up with the
+    deltas after k while they are still in the history, and otherwise with
+    the latest keyframe, so the work done per snapshot does not grow with the
+    number of clients, and there is none while nobody is watching
+    """
+    def __init__(self, size = 64):
+        self.deltas = collections.deque(maxlen=size)
+        self.keyframe = None
+        self.frame_number = 0
+        self.header = None
+        self.state = empty_state()
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def add(self, header, particles):
+        """Store a snapshot of the particles in a ParticleArray and wake up
+        every client waiting for it
+        """
+        self.add_state(header, quantized_state(particles))
+
+    def add_state(self, header, state):
+        """Store a snapshot of the particles in a state returned by
+        quantized_state and wake up every client waiting for it.  The delta
+        from the previous snapshot is only encoded while a client is
+        subscribed, and otherwise the deltas are dropped, since they no
+        longer lead up to the latest frame
+        """
+        frame_number = self.frame_number + 1
+        delta = None
+        if self.subscribers:
+            delta = encode_stream_frame(header, frame_number, self.state, state, False)
+        with self.condition:
+            if delta is None:
+                self.deltas.clear()
+            else:
+                self.deltas.append((frame_number, delta))
+            self.keyframe = None
+            self.frame_number = frame_number
+            self.header = header
+            self.state = state
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        """Keep encoding deltas for the body of the with statement"""
+        with self.condition:
+            self.subscribers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def frames_since(self, frame_number):
+        """Return the (frame number, stream frame) pairs that bring a client
+        that has frame_number (None for a new client) up to date
+        """
+        with self.condition:
+            if frame_number == self.frame_number:
+                return []
+            if self.deltas and frame_number is not None and \
+                    self.deltas[0][0] <= frame_number + 1 <= self.frame_number:
+                return [delta for delta in self.deltas if delta[0] > frame_number]
+            if not self.frame_number:
+                return []
+            if self.keyframe is None:
+                self.keyframe = (self.frame_number, encode_stream_frame(self.header,
+                    self.frame_number, empty_state(), self.state, True))
+            return [self.keyframe]
+
+    def wait(self, frame_number, timeout = None):
+        """Block until there is a frame after frame_number, or timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_number and
+                    self.frame_number != frame_number, timeout)
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+"""
+Unit test file for frames.py
+"""
+import unittest
+import numpy as np
+import frames
+from ParticleArray import ParticleArray
+
+def random_particle_array(num_particles, seed):
+    rng = np.random.default_rng(seed)
+    return ParticleArray(np.arange(num_particles), rng.integers(1, 16, num_particles),
+            rng.uniform(0, 1000, (num_particles, 3)),
+            rng.uniform(-100, 100, (num_particles, 3)),
+            np.full(num_particles, 3), np.full(num_particles, 30))
+
+def assert_states_equal(test, state, expected):
+    for key in ("ids", "positions", "radii", "thread_nums"):
+        test.assertEqual(state[key].tolist(), expected[key].tolist())
+
+class TestFrames(unittest.TestCase):
+    def test_round_trip(self):
+        particles = random_particle_array(50, 0)
+        frame = frames.encode({"num_particles": 50, "total_energy": 1.5}, particles)
+        header, arrays = frames.decode(frame)
+        self.assertEqual(header, {"num_particles": 50, "total_energy": 1.5})
+        self.assertEqual(arrays["ids"].tolist(), particles.ids.tolist())
+        self.assertEqual(arrays["thread_nums"].tolist(), particles.thread_nums.tolist())
+        np.testing.assert_allclose(arrays["positions"], particles.positions, rtol=1e-6)
+        np.testing.assert_allclose(arrays["velocities"], particles.velocities, rtol=1e-6)
+        np.testing.assert_allclose(arrays["radii"], particles.radii)
+        self.assertLess(len(frame), len(particles.jsonify())/5)
+
+    def test_empty(self):
+        header, arrays = frames.decode(frames.encode({}, ParticleArray()))
+        self.assertEqual(header, {})
+        self.assertEqual(len(arrays["positions"]), 0)
+
+    def test_wants_frame(self):
+        self.assertTrue(frames.wants_frame({"format": ["binary"]}, None))
+        self.assertFalse(frames.wants_frame({"format": ["json"]}, frames.content_type))
+        self.assertTrue(frames.wants_frame({}, frames.content_type))
+        self.assertFalse(frames.wants_frame({}, "application/json, */*"))
+        self.assertFalse(frames.wants_frame({}, None))
+
+class TestStreamFrames(unittest.TestCase):
+    def test_deltas_rebuild_every_snapshot(self):
+        rng = np.random.default_rng(1)
+        particles = random_particle_array(200, 2)
+        history = frames.FrameHistory()
+        state = frames.empty_state()
+        frame_number = None
+        with history.subscribe():
+            for step in range(10):
+                history.add({"step": step}, particles)
+                for frame_number, frame in history.frames_since(frame_number):
+                    frame_number, header, state = frames.apply_stream_frame(state, frame)
+                self.assertEqual(header["step"], step)
+                assert_states_equal(self, state, frames.quantized_state(particles))
+
+                # Move every particle a little, one of them very far, migrate
+                # a few and swap some particles for new ones
+                particles.positions += rng.uniform(-5, 5, particles.positions.shape)
+                particles.positions[step] += 5000
+                particles.thread_nums[rng.integers(0, 200, 5)] = 16
+                particles = particles[5:]
+                particles.extend(random_particle_array(5, step))
+                particles.ids[-5:] = 1000 + 5*step + np.arange(5)
+        self.assertEqual(frame_number, 10)
+        # Every frame was caught up with a delta
+        self.assertIsNone(history.keyframe)
+
+        delta = history.deltas[-1][1]
+        self.assertLess(len(delta), len(history.frames_since(None)[0][1])/2)
+
+    def test_resume(self):
+        particles = random_particle_array(20, 3)
+        history = frames.FrameHistory(size = 2)
+        self.assertEqual(history.frames_since(None), [])
+        with history.subscribe():
+            for step in range(4):
+                history.add({}, particles)
+        self.assertEqual(history.frames_since(4), [])
+        self.assertEqual([number for number, frame in history.frames_since(2)], [3, 4])
+        self.assertEqual(history.frames_since(1), [history.keyframe])
+        self.assertEqual(history.frames_since(None), [history.keyframe])
+        history.wait(3, timeout = 1)
+
+    def test_no_subscribers(self):
+        """Without subscribers no frame is encoded until a client asks for
+        one, and a client that comes back catches up with a keyframe
+        """
+        particles = random_particle_array(20, 4)
+        history = frames.FrameHistory()
+        with history.subscribe():
+            history.add({}, particles)
+            history.add({}, particles)
+        self.assertEqual(len(history.deltas), 2)
+        history.add({"step": 3}, particles)
+        self.assertEqual(len(history.deltas), 0)
+        self.assertIsNone(history.keyframe)
+
+        events = history.frames_since(2)
+        self.assertEqual([number for number, frame in events], [3])
+        self.assertIs(history.frames_since(None)[0], events[0])
+        frame_number, header, state = frames.apply_stream_frame(frames.empty_state(), events[0][1])
+        self.assertEqual(header["step"], 3)
+        assert_states_equal(self, state, frames.quantized_state(particles))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+"""Parallel creation of the initial particles (--initialization parallel).
+
+The simulation is split into a fixed grid of blocks_per_axis**3 blocks that
+does not depend on the decomposition.  How many particles start in each
+block is drawn from the seed alone, and the particles of each block are then
+drawn from their own random stream, seeded with the seed and the index of
+the block.  Each worker only draws the blocks that overlap its Partition
+and keeps the particles that fall inside it, so no rank ever holds every
+particle, and the particles are the same however many workers there are.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+import params
+from ParticleArray import ParticleArray
+import numpy as np
+
+blocks_per_axis = 16
+
+# Every particle starts with the same radius and mass
+radius = 30
+mass = 3
+
+def block_edges():
+    """Return the boundaries of the blocks along each axis.  Particles start
+    at least their radius away from the lower edges of the simulation, as
+    they always have
+    """
+    sizes = [params.simulation_width, params.simulation_height, params.simulation_depth]
+    return [np.linspace(radius, size - 1, blocks_per_axis + 1) for size in sizes]
+
+def block_counts(seed, num_particles):
+    """Return the number of particles that start in each block, as a flat
+    array in C order.  Blocks get particles in proportion to their volume
+    """
+    edges = block_edges()
+    volumes = np.einsum("i,j,k->ijk", *[np.diff(axis_edges) for axis_edges in edges]).ravel()
+    rng = np.random.default_rng([seed, 0])
+    return rng.multinomial(num_particles, volumes/volumes.sum())
+
+def generate_block(seed, index, first_id, count):
+    """Draw the count particles of the block with the given flat index, with
+    ids starting at first_id
+    """
+    edges = block_edges()
+    coordinates = np.unravel_index(index, (blocks_per_axis,)*3)
+    low = [edges[axis][coordinates[axis]] for axis in range(3)]
+    high = [edges[axis][coordinates[axis] + 1] for axis in range(3)]
+    rng = np.random.default_rng([seed, 1, index])
+    positions = rng.uniform(low, high, (count, 3))
+    velocities = 400.0*rng.integers(0, radius//4, (count, 3), endpoint=True)
+    return ParticleArray(first_id + np.arange(count), np.zeros(count), positions,
+            velocities, np.full(count, mass), np.full(count, radius))
+
+def generate(seed, num_particles, thread_num, start, end):
+    """Return the particles that start in the Partition of thread_num, which
+    spans from start to end
+    """
+    counts = block_counts(seed, num_particles)
+    first_ids = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    edges = block_edges()
+    overlapping = [(edges[axis][1:] >= start[axis]) & (edges[axis][:-1] <= end[axis]) for axis in range(3)]
+    overlapping = overlapping[0][:, None, None] & overlapping[1][None, :, None] & overlapping[2][None, None, :]
+    blocks = np.flatnonzero(overlapping.ravel() & (counts > 0))
+
+    particles = ParticleArray.concatenate(ParticleArray(),
+            *[generate_block(seed, index, first_ids[index], counts[index]) for index in blocks])
+    particles.thread_nums = util.determine_particle_thread_nums(particles.positions)
+    return particles.select(particles.thread_nums == thread_num)
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+"""
+Unit test file for initialization.py
+"""
+import unittest
+import numpy as np
+import util
+import params
+import initialization
+
+def generate_all(seed, num_particles, num_workers):
+    """Generate the particles of every Partition of num_workers workers"""
+    util.update_decomposition(num_workers)
+    particles = []
+    for thread_num in range(1, num_workers + 1):
+        coordinates = util.worker_coordinates(thread_num)
+        start = [params.cuts[axis][coordinates[axis]] for axis in range(3)]
+        end = [params.cuts[axis][coordinates[axis] + 1] for axis in range(3)]
+        generated = initialization.generate(seed, num_particles, thread_num, start, end)
+        np.testing.assert_array_equal(generated.thread_nums, thread_num)
+        particles.append(generated)
+    return particles
+
+class TestInitialization(unittest.TestCase):
+    def setUp(self):
+        params.simulation_width = 1000
+        params.simulation_height = 800
+        params.simulation_depth = 600
+        params.decomposition = "xyz"
+
+    def test_same_particles_for_any_number_of_workers(self):
+        one = generate_all(7, 5000, 1)[0]
+        self.assertEqual(sorted(one.ids.tolist()), list(range(5000)))
+        self.assertTrue((one.positions >= initialization.radius).all())
+        self.assertTrue((one.positions <= [999, 799, 599]).all())
+
+        many = generate_all(7, 5000, 12)
+        self.assertEqual(sum(len(particles) for particles in many), 5000)
+        for particles in many:
+            order = np.searchsorted(one.ids, particles.ids)
+            np.testing.assert_array_equal(particles.positions, one.positions[order])
+            np.testing.assert_array_equal(particles.velocities, one.velocities[order])
+
+    def test_seed(self):
+        first = generate_all(1, 100, 2)[0]
+        self.assertEqual(first.positions.tolist(), generate_all(1, 100, 2)[0].positions.tolist())
+        self.assertNotEqual(first.positions.tolist(), generate_all(2, 100, 2)[0].positions.tolist())
+
+if __name__ == '__main__':
+    unittest.main()
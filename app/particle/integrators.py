@@ -0,0 +1,110 @@
+#!/usr/bin/python
+"""Integrators that turn the pairwise forces of kernels.velocity_deltas into
+a timestep of a Partition, selected with --integrator:
+
+    euler   The original first-order update: every step adds the clamped
+            force per unit mass to the velocity, whatever params.dt is, and
+            kernels.update_positions halves the velocity of particles that
+            move further than their radius.
+    verlet  Velocity Verlet, in its kick-drift (leapfrog) arrangement.  The
+            closing half kick of one step and the opening half kick of the
+            next use the forces at the same positions, so they are applied
+            together at the start of each step, and only the very first
+            step kicks by half of dt.  The forces are an acceleration, so the
+            simulated motion does not depend on dt.
+    respa   Verlet with two time steps (RESPA).  Pairs closer than
+            params.respa_split*(r_i + r_j) are the fast forces and kick every
+            step.  The remaining pairs are the slow forces, which are only
+            evaluated every params.respa_steps steps, with a kick that covers
+            all of those steps.
+
+The force field is scaled so that one step of verlet at dt = force_time
+gives the same kick as one step of euler.  Velocities between the steps of
+verlet and respa are half a step behind the positions, as in any leapfrog
+scheme.
+
+With --adaptive-dt, adaptive_dt picks the dt of each step from the fastest
+speed and the largest acceleration in the simulation.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import params
+import kernels
+import numpy as np
+
+# The time over which the velocity change of kernels.velocity_deltas acts
+force_time = 0.0005
+
+# With --adaptive-dt, no particle should move more than this fraction of the
+# smallest radius in one step
+max_step_fraction = 0.1
+
+def kick(steps):
+    """Return the factor that turns kernels.velocity_deltas into the kick for
+    a force that acts for the given number of steps.  The first step of a run
+    only kicks by half, to bring the velocities half a step ahead.  After dt
+    changed, the kick spans half of the previous step and half of this one
+    """
+    if params.iterations == 1:
+        return steps*params.dt/2/force_time
+    previous_dt = params.previous_dt if params.previous_dt else params.dt
+    return steps*(previous_dt + params.dt)/2/force_time
+
+def is_slow_step():
+    """Return whether the slow forces of respa are evaluated this step"""
+    return (params.iterations - 1) % params.respa_steps == 0
+
+def split_pairs(particles, others, pairs):
+    """Split the (i, j) index pairs into the fast (close) and the slow pairs
+    of respa
+    """
+    i, j = pairs
+    distances = particles.positions[i] - others.positions[j]
+    euclidean_distances = np.sqrt(np.einsum("ij,ij->i", distances, distances))
+    fast = euclidean_distances < params.respa_split*(particles.radii[i] + others.radii[j])
+    return (i[fast], j[fast]), (i[~fast], j[~fast])
+
+def velocity_deltas(particles, others, pairs):
+    """Return the change in velocity of each particle in particles due to
+    others this step, over the (i, j) index pairs in pairs
+    """
+    if params.integrator == "euler":
+        return kernels.velocity_deltas(particles, others, pairs)
+    if params.integrator == "verlet":
+        return kick(1)*kernels.velocity_deltas(particles, others, pairs)
+
+    fast, slow = split_pairs(particles, others, pairs)
+    deltas = kick(1)*kernels.velocity_deltas(particles, others, fast)
+    if is_slow_step():
+        deltas += kick(params.respa_steps)*kernels.velocity_deltas(particles, others, slow)
+    return deltas
+
+def adaptive_dt(speed, acceleration, radius):
+    """Return the dt for the next step, given the largest speed and
+    acceleration and the smallest radius of every particle: the largest dt
+    that moves no particle more than max_step_fraction of radius, within
+    params.min_dt and params.max_dt
+    """
+    distance = max_step_fraction*radius
+    dt = params.max_dt
+    if speed > 0:
+        dt = min(dt, distance/speed)
+    if acceleration > 0:
+        dt = min(dt, np.sqrt(2*distance/acceleration))
+    return max(dt, params.min_dt)
+
+def update_positions(particles):
+    """Move every particle for one step after its velocity was updated"""
+    if params.integrator == "euler":
+        kernels.update_positions(particles, params.dt)
+    else:
+        kernels.drift(particles, params.dt)
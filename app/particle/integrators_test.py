@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Unit test file for integrators.py
+"""
+import unittest
+import numpy as np
+import params
+import kernels
+import integrators
+from ParticleArray import ParticleArray
+
+def colliding_pair():
+    """Two particles that approach each other head on, bounce off each other
+    and leave the interaction cutoff (300) again
+    """
+    return ParticleArray([0, 1], [1, 1], [[400, 500, 500], [600, 500, 500]],
+            [[300, 0, 0], [-300, 0, 0]], [3, 3], [30, 30])
+
+def energy(particles):
+    """Kinetic energy plus the potential of the pair, shifted to 0 at the
+    cutoff
+    """
+    distance = np.linalg.norm(particles.positions[0] - particles.positions[1])
+    potential = params.force/integrators.force_time*max(1/distance - 1/300, 0)
+    return particles.kinetic_energy() + potential
+
+class TestIntegrators(unittest.TestCase):
+    def setUp(self):
+        params.force = 100000
+        params.simulation_width = 1000
+        params.simulation_height = 1000
+        params.simulation_depth = 1000
+        params.respa_steps = 4
+        params.respa_split = 2.0
+
+    def run_pair(self, integrator, dt, time = 0.4):
+        params.integrator = integrator
+        params.dt = dt
+        particles = colliding_pair()
+        for iterations in range(1, int(round(time/dt)) + 1):
+            params.iterations = iterations
+            particles.velocities += integrators.velocity_deltas(particles, particles,
+                    kernels.all_pairs(particles, particles, True))
+            integrators.update_positions(particles)
+        return particles
+
+    def test_verlet_conserves_energy(self):
+        initial_energy = energy(colliding_pair())
+        self.assertLess(abs(energy(self.run_pair("verlet", 0.002)) - initial_energy), 0.01*initial_energy)
+        # The first order update gains energy at the same dt
+        self.assertGreater(energy(self.run_pair("euler", 0.002)), 1.5*initial_energy)
+
+    def test_verlet_does_not_depend_on_dt(self):
+        fine = self.run_pair("verlet", 0.0005)
+        coarse = self.run_pair("verlet", 0.002)
+        np.testing.assert_allclose(coarse.positions, fine.positions, atol=0.1)
+
+    def test_verlet_matches_euler_at_force_time(self):
+        euler = self.run_pair("euler", integrators.force_time, 0.01)
+        verlet = self.run_pair("verlet", integrators.force_time, 0.01)
+        # Only the first half kick differs
+        np.testing.assert_allclose(verlet.positions, euler.positions, atol=1.0)
+
+    def test_respa_without_slow_forces_is_verlet(self):
+        params.respa_split = 10.0
+        np.testing.assert_array_equal(self.run_pair("respa", 0.001).positions,
+                self.run_pair("verlet", 0.001).positions)
+
+    def test_respa_slow_forces_every_step_is_verlet(self):
+        params.respa_split = 0.0
+        params.respa_steps = 1
+        np.testing.assert_allclose(self.run_pair("respa", 0.001).positions,
+                self.run_pair("verlet", 0.001).positions)
+
+    def test_adaptive_dt(self):
+        params.min_dt = 0.0001
+        params.max_dt = 0.01
+        self.assertEqual(integrators.adaptive_dt(0, 0, 30), 0.01)
+        # A particle at 1500 should move 3 (a tenth of the radius) per step
+        self.assertAlmostEqual(integrators.adaptive_dt(1500, 0, 30), 0.002)
+        self.assertAlmostEqual(integrators.adaptive_dt(1500, 6e6, 30), 0.001)
+        self.assertEqual(integrators.adaptive_dt(1e9, 0, 30), 0.0001)
+
+if __name__ == '__main__':
+    unittest.main()
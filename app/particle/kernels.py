@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""Vectorized kernels that operate on whole ParticleArrays at once.  These
+compute the same updates as Particle.update_velocity and
+Particle.update_position, but in one pass over numpy arrays instead of one
+Particle at a time.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+import params
+import numpy as np
+
+max_force = 5000
+
+# Upper bound on the number of distances computed at once by all_pairs
+pair_block_size = 1 << 20
+
+def all_pairs(particles, others, exclude_self):
+    """Brute force search for every pair (i, j) where particles[i] and
+    others[j] are within the interaction cutoff 5*(r_i + r_j) of each other.
+    If exclude_self is set, particles and others are the same ParticleArray and
+    a particle is not paired with itself.
+
+    Returns two index arrays i and j
+    """
+    i_all, j_all = [], []
+    rows = max(1, pair_block_size//max(1, len(others)))
+    for start in range(0, len(particles), rows):
+        stop = min(start + rows, len(particles))
+        distances = particles.positions[start:stop, None, :] - others.positions[None, :, :]
+        euclidean_distances = np.sqrt(np.einsum("ijk,ijk->ij", distances, distances))
+        cutoffs = 5*(particles.radii[start:stop, None] + others.radii[None, :])
+        close = euclidean_distances <= cutoffs
+        if exclude_self:
+            close[np.arange(stop - start), np.arange(start, stop)] = False
+        i, j = np.nonzero(close)
+        i_all.append(i + start)
+        j_all.append(j)
+    if not i_all:
+        return (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+    return (np.concatenate(i_all), np.concatenate(j_all))
+
+def velocity_deltas(particles, others, pairs):
+    """Return the change in velocity of each particle in particles due to the
+    clamped force from others, summed over the (i, j) index pairs in pairs.
+    Matches Particle.update_velocity
+    """
+    i, j = pairs
+    distances = particles.positions[i] - others.positions[j]
+    euclidean_distances = np.sqrt(np.einsum("ij,ij->i", distances, distances))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        forces = params.force*distances/(euclidean_distances**3)[:, None]
+    forces /= particles.masses[i][:, None]
+    forces[euclidean_distances == 0] = max_force
+    np.clip(forces, -max_force, max_force, out=forces)
+
+    deltas = np.empty((len(particles), 3))
+    for k in range(3):
+        deltas[:, k] = np.bincount(i, weights=forces[:, k], minlength=len(particles))
+    return deltas
+
+def update_positions(particles, time):
+    """Update the position of every particle based on its velocity.  Matches
+    Particle.update_position
+    """
+    delta = particles.velocities*time
+    particles.positions += delta
+
+    too_fast = (delta > particles.radii[:, None]).any(axis=1)
+    if too_fast.any():
+        util.debug(str(int(too_fast.sum())) + " particles are moving a distance of more than their radius")
+        particles.velocities[too_fast] /= 2
+    bounce_off_edges(particles)
+
+def drift(particles, time):
+    """Move every particle along its velocity for time, without slowing down
+    the particles that move further than their radius as update_positions
+    does
+    """
+    particles.positions += particles.velocities*time
+    bounce_off_edges(particles)
+
+def bounce_off_edges(particles):
+    """Reflect the particles that left the simulation back into it, reversing
+    their velocity along each axis that they crossed
+    """
+    simulation = np.array([params.simulation_width, params.simulation_height, params.simulation_depth])
+    out_of_bounds = (particles.positions < 0) | (particles.positions > simulation)
+    while out_of_bounds.any():
+        particles.velocities[out_of_bounds] *= -1
+        particles.positions = np.where(particles.positions < 0,
+                -particles.positions, np.where(particles.positions > simulation,
+                    2*simulation - particles.positions, particles.positions))
+        out_of_bounds = (particles.positions < 0) | (particles.positions > simulation)
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+"""
+Unit test file for kernels.py
+"""
+import unittest
+import random
+import params
+import kernels
+from Particle import Particle
+from ParticleArray import ParticleArray
+
+def random_particles(num_particles, seed):
+    rng = random.Random(seed)
+    particles = []
+    for i in range(num_particles):
+        position = [rng.randint(0, 300), rng.randint(0, 300), rng.randint(0, 300)]
+        velocity = [rng.randint(-2000, 2000), rng.randint(-2000, 2000), rng.randint(-2000, 2000)]
+        particles.append(Particle(i, 1, position, velocity, rng.randint(1, 10), rng.randint(1, 8)))
+    return particles
+
+class TestKernels(unittest.TestCase):
+    def setUp(self):
+        params.force = 100000
+        params.simulation_width = 300
+        params.simulation_height = 300
+        params.simulation_depth = 300
+
+    def test_velocity_deltas_match_update_velocity(self):
+        particles = random_particles(200, 0)
+        # Two particles on top of each other take the max_force branch
+        particles[1].position = list(particles[0].position)
+        array = ParticleArray.from_particles(particles)
+
+        for particle in particles:
+            particle.update_velocity(particles)
+        array.velocities += kernels.velocity_deltas(array, array,
+                kernels.all_pairs(array, array, True))
+
+        for i, particle in enumerate(particles):
+            for k in range(3):
+                self.assertAlmostEqual(particle.velocity[k], array.velocities[i, k], places=6)
+
+    def test_velocity_deltas_with_neighbors(self):
+        particles = random_particles(150, 1)
+        array = ParticleArray.from_particles(particles[:100])
+        neighbors = ParticleArray.from_particles(particles[100:])
+
+        for particle in particles[:100]:
+            particle.update_velocity(particles)
+        deltas = kernels.velocity_deltas(array, array, kernels.all_pairs(array, array, True))
+        deltas += kernels.velocity_deltas(array, neighbors, kernels.all_pairs(array, neighbors, False))
+        array.velocities += deltas
+
+        for i, particle in enumerate(particles[:100]):
+            for k in range(3):
+                self.assertAlmostEqual(particle.velocity[k], array.velocities[i, k], places=6)
+
+    def test_update_positions_match_update_position(self):
+        particles = random_particles(200, 2)
+        array = ParticleArray.from_particles(particles)
+
+        for particle in particles:
+            particle.update_position(0.05)
+        kernels.update_positions(array, 0.05)
+
+        for i, particle in enumerate(particles):
+            for k in range(3):
+                self.assertAlmostEqual(particle.position[k], array.positions[i, k])
+                self.assertAlmostEqual(particle.velocity[k], array.velocities[i, k])
+                self.assertGreaterEqual(array.positions[i, k], 0)
+                self.assertLessEqual(array.positions[i, k], 300)
+
+if __name__ == '__main__':
+    unittest.main()
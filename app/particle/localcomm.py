@@ -0,0 +1,302 @@
+#!/usr/bin/python
+"""Stand-in for the part of mpi4py that the simulation uses, so that every
+rank can run as a process on one machine without MPI (--backend local).
+
+run starts one process per rank, and each process gets a Comm that behaves
+like MPI.COMM_WORLD.  Every rank has an inbox (a multiprocessing.Queue) that
+only carries small message envelopes.  Buffers of the uppercase calls (Send,
+Isend, Allreduce, ...) of up to inline_size bytes travel in the envelope.
+Larger buffers are copied into a ring of shared memory that run sets up for
+every pair of ranks, and the receiver copies them out of it, so particles
+are never pickled on their way between ranks.  A buffer that does not fit
+into the free part of its ring gets a shared memory segment of its own,
+which the receiver unlinks.  The lowercase calls (bcast, gather, ...) pickle
+their objects, as they do in mpi4py.
+
+Like MPI, messages from one rank to another are received in the order that
+they were sent, and a receive can pick out a message by source and tag.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import params
+
+import multiprocessing
+import os
+import signal
+import sys
+import traceback
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+ANY_SOURCE = -1
+ANY_TAG = -1
+PROC_NULL = -2
+# Datatypes are their size in bytes
+DOUBLE = 8
+SUM = "sum"
+MAX = "max"
+
+# Tag of the messages of collective operations
+collective_tag = -10
+# Buffers of up to inline_size bytes are sent in the message envelope
+inline_size = 8192
+# Bytes of shared memory for the buffers that one rank sends to another
+ring_size = 1 << 20
+
+class Status:
+    def __init__(self):
+        self.source = None
+        self.tag = None
+        self.nbytes = 0
+
+    def Get_source(self):
+        return self.source
+
+    def Get_tag(self):
+        return self.tag
+
+    def Get_count(self, datatype = 1):
+        return self.nbytes//datatype
+
+class Request:
+    """A pending receive (or an already completed send)"""
+    def __init__(self, complete = None):
+        self.complete = complete
+
+    def Wait(self):
+        if self.complete is not None:
+            self.complete()
+            self.complete = None
+
+    @staticmethod
+    def Waitall(requests):
+        for request in requests:
+            request.Wait()
+
+def as_bytes(buffer):
+    """A flat uint8 view of a contiguous numpy buffer"""
+    return np.asarray(buffer).reshape(-1).view(np.uint8)
+
+class Ring:
+    """Shared memory for the buffers that one rank sends to another.  The
+    sender writes each buffer after the previous one, wrapping around to the
+    start of the ring, and never overwrites bytes that the receiver has not
+    released yet.  Both count bytes from the creation of the ring: the
+    sender keeps the count of bytes written to itself, and the count of
+    bytes released is stored in the segment, where the sender can read it
+    """
+    def __init__(self):
+        self.segment = shared_memory.SharedMemory(create = True, size = 8 + ring_size)
+        self.released = np.ndarray(1, np.int64, self.segment.buf)
+        self.data = np.ndarray(ring_size, np.uint8, self.segment.buf, offset = 8)
+        self.written = 0
+        # Released spans that wait for an earlier span to be released
+        self.spans = {}
+
+    def write(self, data):
+        """Copy data into the ring and return the span of bytes that it
+        takes up (including any skipped bytes at the end of the ring), or
+        None if there is no room
+        """
+        start = self.written
+        if start % ring_size + data.nbytes > ring_size:
+            start += ring_size - start % ring_size
+        end = start + data.nbytes
+        if end - self.released[0] > ring_size:
+            return None
+        self.data[start % ring_size:start % ring_size + data.nbytes] = data
+        span = (self.written, end)
+        self.written = end
+        return span
+
+    def read(self, span, buffer):
+        """Copy the buffer written in span out of the ring and release it.
+        Messages may be received out of order, so the count of bytes
+        released only moves past spans once every earlier span is released
+        """
+        start = (span[1] - len(buffer)) % ring_size
+        buffer[:] = self.data[start:start + len(buffer)]
+        self.spans[span[0]] = span[1]
+        while self.released[0] in self.spans:
+            self.released[0] = self.spans.pop(self.released[0])
+
+    def close(self):
+        del self.released, self.data
+        self.segment.close()
+        self.segment.unlink()
+
+class Comm:
+    """The communicator of one rank.  A message is a tuple of its source,
+    tag, the location of its buffer (if any), the size of that buffer and a
+    picklable object (if any).  The location is the buffer itself as bytes,
+    the span of the buffer in the ring from the source to this rank, or the
+    name of a shared memory segment holding the buffer
+    """
+    def __init__(self, rank, inboxes, rings):
+        self.rank = rank
+        self.inboxes = inboxes
+        # rings[(source, dest)] carries the buffers from source to dest
+        self.rings = rings
+        # Messages taken out of the inbox that were not received yet, in order
+        self.pending = []
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return len(self.inboxes)
+
+    def post(self, dest, tag, location = None, nbytes = 0, obj = None):
+        self.inboxes[dest].put((self.rank, tag, location, nbytes, obj))
+
+    def find(self, source, tag):
+        """Return the index in self.pending of the first message from source
+        with tag, waiting for one to arrive if needed
+        """
+        def matches(message):
+            return (source == ANY_SOURCE or message[0] == source) and \
+                    (tag == ANY_TAG or message[1] == tag)
+        for index, message in enumerate(self.pending):
+            if matches(message):
+                return index
+        while True:
+            message = self.inboxes[self.rank].get()
+            self.pending.append(message)
+            if matches(message):
+                return len(self.pending) - 1
+
+    def take(self, source, tag, status = None):
+        message = self.pending.pop(self.find(source, tag))
+        if status is not None:
+            status.source, status.tag, status.nbytes = message[0], message[1], message[3]
+        return message
+
+    def Send(self, buffer, dest, tag = 0):
+        if dest == PROC_NULL:
+            return
+        data = as_bytes(buffer)
+        if data.nbytes == 0:
+            self.post(dest, tag)
+            return
+        if data.nbytes <= inline_size:
+            self.post(dest, tag, data.tobytes(), data.nbytes)
+            return
+        span = self.rings[(self.rank, dest)].write(data)
+        if span is not None:
+            self.post(dest, tag, span, data.nbytes)
+            return
+        segment = shared_memory.SharedMemory(create = True, size = data.nbytes)
+        segment.buf[:data.nbytes] = data
+        # The receiver unlinks the segment
+        resource_tracker.unregister(segment._name, "shared_memory")
+        segment.close()
+        self.post(dest, tag, segment.name, data.nbytes)
+
+    def Recv(self, buffer, source = ANY_SOURCE, tag = ANY_TAG, status = None):
+        if source == PROC_NULL:
+            return
+        source, tag, location, nbytes, obj = self.take(source, tag, status)
+        if not nbytes:
+            return
+        data = as_bytes(buffer)[:nbytes]
+        if isinstance(location, bytes):
+            data[:] = np.frombuffer(location, np.uint8)
+        elif isinstance(location, tuple):
+            self.rings[(source, self.rank)].read(location, data)
+        else:
+            segment = shared_memory.SharedMemory(name = location)
+            data[:] = np.frombuffer(segment.buf, np.uint8, nbytes)
+            segment.close()
+            segment.unlink()
+
+    def Probe(self, source = ANY_SOURCE, tag = ANY_TAG, status = None):
+        message = self.pending[self.find(source, tag)]
+        if status is not None:
+            status.source, status.tag, status.nbytes = message[0], message[1], message[3]
+
+    def Isend(self, buffer, dest, tag = 0):
+        # Sends never block, so they complete at once
+        self.Send(buffer, dest, tag)
+        return Request()
+
+    def Irecv(self, buffer, source = ANY_SOURCE, tag = ANY_TAG):
+        return Request(lambda: self.Recv(buffer, source, tag))
+
+    def send(self, obj, dest, tag = 0):
+        if dest != PROC_NULL:
+            self.post(dest, tag, obj = obj)
+
+    def recv(self, source = ANY_SOURCE, tag = ANY_TAG, status = None):
+        return self.take(source, tag, status)[4]
+
+    def bcast(self, obj, root = 0):
+        if self.rank == root:
+            for rank in range(self.Get_size()):
+                if rank != root:
+                    self.post(rank, collective_tag, obj = obj)
+            return obj
+        return self.take(root, collective_tag)[4]
+
+    def gather(self, obj, root = 0):
+        if self.rank != root:
+            self.post(root, collective_tag, obj = obj)
+            return None
+        gathered = []
+        for rank in range(self.Get_size()):
+            gathered.append(obj if rank == root else self.take(rank, collective_tag)[4])
+        return gathered
+
+    def allgather(self, obj):
+        return self.bcast(self.gather(obj))
+
+    def Allreduce(self, sendbuf, recvbuf, op = SUM):
+        if op not in (SUM, MAX):
+            raise ValueError("only SUM and MAX are supported by the local backend")
+        reduce = np.sum if op == SUM else np.max
+        recvbuf[...] = reduce(self.allgather(np.array(sendbuf)), axis=0)
+
+    def Barrier(self):
+        self.allgather(None)
+
+def start(rank, inboxes, rings, function):
+    params.mpi = sys.modules[__name__]
+    params.comm = Comm(rank, inboxes, rings)
+    if rank == 0:
+        function()
+        return
+    try:
+        function()
+    except BaseException:
+        # Nothing else would stop the ranks that wait on this one, so
+        # interrupt rank 0, which takes the daemonic ranks down with it
+        traceback.print_exc()
+        os.kill(os.getppid(), signal.SIGINT)
+        os._exit(1)
+
+def run(num_ranks, function):
+    """Call function in num_ranks processes, with params.mpi and params.comm
+    set up as they would be by mpirun.  Rank 0 runs in this process, and the
+    other ranks are forked from it.  The rings are created before the fork,
+    so every rank inherits them, and are unlinked once rank 0 is done
+    """
+    context = multiprocessing.get_context("fork")
+    inboxes = [context.Queue() for rank in range(num_ranks)]
+    rings = {(source, dest): Ring() for source in range(num_ranks)
+            for dest in range(num_ranks) if source != dest}
+    try:
+        for rank in range(1, num_ranks):
+            context.Process(target=start, args=(rank, inboxes, rings, function), daemon=True).start()
+        start(0, inboxes, rings, function)
+    finally:
+        for ring in rings.values():
+            ring.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+"""
+Unit test file for localcomm.py
+"""
+import unittest
+import numpy as np
+import params
+import localcomm
+from ParticleArray import ParticleArray
+
+class TestLocalComm(unittest.TestCase):
+    def tearDown(self):
+        params.mpi = None
+        params.comm = None
+
+    def test_collectives(self):
+        results = {}
+        def function():
+            rank = params.comm.Get_rank()
+            total = np.zeros(2)
+            params.comm.Allreduce(np.array([1.0, rank]), total, op = params.mpi.SUM)
+            gathered = params.comm.gather(rank*rank)
+            if rank == 0:
+                results["size"] = params.comm.Get_size()
+                results["total"] = total.tolist()
+                results["gathered"] = gathered
+                results["bcast"] = params.comm.bcast("hello")
+            else:
+                params.comm.bcast(None)
+            params.comm.Barrier()
+        localcomm.run(3, function)
+        self.assertEqual(results["size"], 3)
+        self.assertEqual(results["total"], [3.0, 3.0])
+        self.assertEqual(results["gathered"], [0, 1, 4])
+        self.assertEqual(results["bcast"], "hello")
+
+    def test_send_particles(self):
+        received = []
+        def function():
+            rank = params.comm.Get_rank()
+            if rank == 1:
+                ParticleArray().send(0, tag = 3)
+                ParticleArray(np.arange(4), np.full(4, 1), np.ones((4, 3)),
+                        np.zeros((4, 3)), np.ones(4), np.ones(4)).send(0, tag = 2)
+            elif rank == 0:
+                # Messages are picked out by tag, whatever order they arrive in
+                received.append(ParticleArray.recv(1, 2, params.mpi_status))
+                received.append(ParticleArray.recv(localcomm.ANY_SOURCE, 3, params.mpi_status))
+                received.append(params.mpi_status.Get_source())
+        params.mpi_status = localcomm.Status()
+        localcomm.run(2, function)
+        self.assertEqual(received[0].ids.tolist(), [0, 1, 2, 3])
+        self.assertEqual(len(received[1]), 0)
+        self.assertEqual(received[2], 1)
+
+    def test_buffer_sizes(self):
+        """Buffers that travel inline, through the ring (wrapping around it
+        and received out of order) and in a segment of their own all arrive
+        intact
+        """
+        sizes = [1, localcomm.inline_size//8 + 1, localcomm.ring_size//8 + 1] + \
+                [localcomm.ring_size//80]*25
+        received = {}
+        def function():
+            rank = params.comm.Get_rank()
+            if rank == 1:
+                for tag, size in enumerate(sizes):
+                    params.comm.Send(np.arange(size, dtype=np.float64) + tag, dest = 0, tag = tag)
+            elif rank == 0:
+                for tag in reversed(range(len(sizes))):
+                    buffer = np.empty(sizes[tag])
+                    params.comm.Recv(buffer, source = 1, tag = tag)
+                    received[tag] = buffer
+        localcomm.run(2, function)
+        for tag, size in enumerate(sizes):
+            np.testing.assert_array_equal(received[tag], np.arange(size) + tag)
+
+    def test_ring(self):
+        """The ring wraps around, and only reuses the bytes of buffers that
+        were read, even when they are read out of order
+        """
+        ring = localcomm.Ring()
+        try:
+            size = localcomm.ring_size//3 + 1
+            chunks = [np.full(size, i, dtype=np.uint8) for i in range(3)]
+            spans = [ring.write(chunks[0]), ring.write(chunks[1])]
+            self.assertIsNone(ring.write(chunks[2]))
+            # Reading the second buffer does not free the first one
+            buffer = np.empty(size, dtype=np.uint8)
+            ring.read(spans[1], buffer)
+            np.testing.assert_array_equal(buffer, chunks[1])
+            self.assertIsNone(ring.write(chunks[2]))
+            ring.read(spans[0], buffer)
+            np.testing.assert_array_equal(buffer, chunks[0])
+            for i in range(10):
+                span = ring.write(chunks[i % 3])
+                self.assertIsNotNone(span)
+                ring.read(span, buffer)
+                np.testing.assert_array_equal(buffer, chunks[i % 3])
+            self.assertGreater(ring.written, 3*localcomm.ring_size)
+        finally:
+            ring.close()
+
+if __name__ == '__main__':
+    unittest.main()
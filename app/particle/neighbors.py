@@ -0,0 +1,235 @@
+#!/usr/bin/python
+"""Neighbor search for the short range interaction cutoff of 5*(r_i + r_j).
+
+A CellList bins a ParticleArray into a uniform grid of cells that are at least
+as wide as the largest cutoff, so that each particle only has to be checked
+against the particles in the 27 cells surrounding it.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+from ParticleArray import ParticleArray
+import itertools
+import numpy as np
+
+# The 27 cells surrounding (and including) a cell
+offsets = np.array(list(itertools.product((-1, 0, 1), repeat=3)), dtype=np.int64)
+
+def empty_pairs():
+    return (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+def max_cutoff(particles, others):
+    """Return the largest interaction cutoff between any particle in particles
+    and any particle in others
+    """
+    if len(particles) == 0 or len(others) == 0:
+        return 0.0
+    return 5*(float(particles.radii.max()) + float(others.radii.max()))
+
+def filter_pairs(particles, others, pairs, skin = 0.0):
+    """Keep only the candidate pairs that are within the cutoff plus skin"""
+    i, j = pairs
+    distances = particles.positions[i] - others.positions[j]
+    euclidean_distances = np.sqrt(np.einsum("ij,ij->i", distances, distances))
+    close = euclidean_distances <= 5*(particles.radii[i] + others.radii[j]) + skin
+    return (i[close], j[close])
+
+class CellList:
+    """Uniform grid of cells over the particles in a ParticleArray.
+
+    The particles are sorted by the linear index of the cell that they fall in,
+    so that the particles in any one cell are a contiguous run of self.order.
+    """
+    def __init__(self, particles, cell_size):
+        self.particles = particles
+        self.cell_size = max(float(cell_size), np.finfo(float).tiny)
+        if len(particles) == 0:
+            self.origin = np.zeros(3)
+            self.shape = np.ones(3, dtype=np.int64)
+        else:
+            self.origin = particles.positions.min(axis=0)
+            self.shape = self.cell_coordinates(particles.positions.max(axis=0)) + 1
+
+        keys = self.cell_keys(self.cell_coordinates(particles.positions))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def cell_coordinates(self, positions):
+        """Return the integer grid coordinates of the cell containing each
+        position
+        """
+        return np.floor((positions - self.origin)/self.cell_size).astype(np.int64)
+
+    def cell_keys(self, coordinates):
+        """Return the linear index of each cell in the grid"""
+        return coordinates[..., 0] + self.shape[0]*(coordinates[..., 1] +
+                self.shape[1]*coordinates[..., 2])
+
+    def candidate_pairs(self, particles):
+        """Return every pair (i, j) where particles[i] and self.particles[j]
+        are in the same or adjacent cells
+        """
+        if len(particles) == 0 or len(self.particles) == 0:
+            return empty_pairs()
+
+        coordinates = self.cell_coordinates(particles.positions)
+        i_all, j_all = [], []
+        for offset in offsets:
+            neighbor_cells = coordinates + offset
+            inside = ((neighbor_cells >= 0) & (neighbor_cells < self.shape)).all(axis=1)
+            i = np.nonzero(inside)[0]
+            keys = self.cell_keys(neighbor_cells[i])
+            lo = np.searchsorted(self.sorted_keys, keys, side="left")
+            hi = np.searchsorted(self.sorted_keys, keys, side="right")
+            counts = hi - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            run_starts = np.cumsum(counts) - counts
+            within_run = np.arange(total) - np.repeat(run_starts, counts)
+            i_all.append(np.repeat(i, counts))
+            j_all.append(self.order[np.repeat(lo, counts) + within_run])
+        if not i_all:
+            return empty_pairs()
+        return (np.concatenate(i_all), np.concatenate(j_all))
+
+    def pairs(self, particles, exclude_self, skin = 0.0):
+        """Return every pair (i, j) where particles[i] and self.particles[j]
+        are within the interaction cutoff (plus skin) of each other.  If
+        exclude_self is set, particles is the ParticleArray that this CellList
+        was built from and a particle is not paired with itself.
+
+        The cell size must be at least the largest cutoff plus skin
+        """
+        i, j = self.candidate_pairs(particles)
+        if exclude_self:
+            different = i != j
+            i, j = i[different], j[different]
+        return filter_pairs(particles, self.particles, (i, j), skin)
+
+def reset_references(particles, skin):
+    """Move the reference position of every particle that has drifted more
+    than half of the skin away from it back to the particle's position
+    """
+    displacement = particles.positions - particles.references
+    moved = np.einsum("ij,ij->i", displacement, displacement) > (skin/2)**2
+    particles.references[moved] = particles.positions[moved]
+
+def at_references(particles):
+    """Return a ParticleArray sharing the radii of particles but positioned at
+    their reference positions
+    """
+    return ParticleArray(particles.ids, particles.thread_nums,
+            particles.references, particles.velocities, particles.masses,
+            particles.radii, particles.references)
+
+def lookup(ids, wanted_ids):
+    """Return the index in ids of each of wanted_ids, or -1 if it is missing"""
+    if len(ids) == 0:
+        return np.full(len(wanted_ids), -1, dtype=np.intp)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    index = np.minimum(np.searchsorted(sorted_ids, wanted_ids), len(ids) - 1)
+    return np.where(sorted_ids[index] == wanted_ids, order[index], -1)
+
+class VerletList:
+    """Cached list of the pairs of particles whose reference positions are
+    within the interaction cutoff plus a skin distance of each other.
+
+    Every particle carries a reference position (ParticleArray.references),
+    which its owner resets with reset_references whenever the particle drifts
+    more than half of the skin away from it.  As long as every particle is
+    within half of the skin of its reference position, two particles whose
+    reference positions are further apart than the cutoff plus the skin cannot
+    be within the cutoff of each other.  So only the particles that are new to
+    this list, or whose reference position was reset, need their candidate
+    pairs rebuilt; every other cached candidate stays valid, even as particles
+    migrate between Partitions.
+    """
+    def __init__(self, skin):
+        self.skin = skin
+        self.pair_ids = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self.particle_ids = np.zeros(0, dtype=np.int64)
+        self.particle_references = np.zeros((0, 3))
+        self.other_ids = np.zeros(0, dtype=np.int64)
+        self.other_references = np.zeros((0, 3))
+        self.rebuilt = 0
+        self.size = 0
+
+    @staticmethod
+    def changed(particles, cached_ids, cached_references):
+        """Return a mask of the particles that were not in the cached
+        particles, or whose reference position changed since
+        """
+        index = lookup(cached_ids, particles.ids)
+        changed = index < 0
+        found = ~changed
+        changed[found] = (cached_references[index[found]] !=
+                particles.references[found]).any(axis=1)
+        return changed
+
+    def candidates(self, particles, cells, changed):
+        """Return the candidate pairs (i, j) between the changed particles[i]
+        and the particles that cells was built from
+        """
+        changed = np.nonzero(changed)[0]
+        i, j = cells.pairs(at_references(particles).select(changed), False, self.skin)
+        return (changed[i], j)
+
+    def pairs(self, particles, others, exclude_self):
+        """Return every pair (i, j) where particles[i] and others[j] are
+        within the interaction cutoff of each other.  If exclude_self is set,
+        particles and others are the same ParticleArray.  Sets self.rebuilt to
+        the number of particles whose candidates were rebuilt, out of
+        self.size
+        """
+        changed_particles = self.changed(particles, self.particle_ids,
+                self.particle_references)
+        changed_others = changed_particles if exclude_self else \
+                self.changed(others, self.other_ids, self.other_references)
+
+        # Keep the cached candidates between two unchanged particles
+        i = lookup(particles.ids, self.pair_ids[0])
+        j = lookup(others.ids, self.pair_ids[1])
+        keep = (i >= 0) & (j >= 0)
+        i, j = i[keep], j[keep]
+        keep = ~changed_particles[i] & ~changed_others[j]
+        i, j = [i[keep]], [j[keep]]
+
+        # Rebuild the candidates of the changed particles on both sides
+        cell_size = max_cutoff(particles, others) + self.skin
+        other_cells = CellList(at_references(others), cell_size)
+        particle_cells = other_cells if exclude_self else \
+                CellList(at_references(particles), cell_size)
+        new_i, new_j = self.candidates(particles, other_cells, changed_particles)
+        i.append(new_i)
+        j.append(new_j)
+        new_j, new_i = self.candidates(others, particle_cells, changed_others)
+        new = ~changed_particles[new_i]
+        i.append(new_i[new])
+        j.append(new_j[new])
+
+        i, j = np.concatenate(i), np.concatenate(j)
+        if exclude_self:
+            different = i != j
+            i, j = i[different], j[different]
+
+        self.pair_ids = (particles.ids[i], others.ids[j])
+        self.particle_ids = particles.ids.copy()
+        self.particle_references = particles.references.copy()
+        self.other_ids = others.ids.copy()
+        self.other_references = others.references.copy()
+        self.rebuilt = int(changed_particles.sum())
+        self.size = len(particles)
+        if not exclude_self:
+            self.rebuilt += int(changed_others.sum())
+            self.size += len(others)
+        return filter_pairs(particles, others, (i, j))
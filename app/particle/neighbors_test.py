@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""
+Unit test file for neighbors.py
+"""
+import unittest
+import numpy as np
+import kernels
+import neighbors
+from ParticleArray import ParticleArray
+
+def random_particle_array(num_particles, seed, size = 1000):
+    rng = np.random.default_rng(seed)
+    return ParticleArray(np.arange(num_particles), np.ones(num_particles),
+            rng.uniform(0, size, (num_particles, 3)),
+            rng.uniform(-100, 100, (num_particles, 3)),
+            rng.integers(1, 10, num_particles), rng.integers(1, 10, num_particles))
+
+def pair_set(pairs):
+    return set(zip(pairs[0].tolist(), pairs[1].tolist()))
+
+class TestCellList(unittest.TestCase):
+    def test_pairs_match_all_pairs(self):
+        particles = random_particle_array(500, 0)
+        cells = neighbors.CellList(particles, neighbors.max_cutoff(particles, particles))
+        self.assertEqual(pair_set(cells.pairs(particles, True)),
+                pair_set(kernels.all_pairs(particles, particles, True)))
+
+    def test_pairs_with_other_particles(self):
+        particles = random_particle_array(300, 1)
+        others = random_particle_array(200, 2)
+        cells = neighbors.CellList(others, neighbors.max_cutoff(particles, others))
+        self.assertEqual(pair_set(cells.pairs(particles, False)),
+                pair_set(kernels.all_pairs(particles, others, False)))
+
+    def test_empty(self):
+        particles = random_particle_array(10, 3)
+        cells = neighbors.CellList(ParticleArray(), 10)
+        self.assertEqual(len(cells.pairs(particles, False)[0]), 0)
+
+class TestVerletList(unittest.TestCase):
+    def test_pairs_match_all_pairs_while_moving(self):
+        particles = random_particle_array(400, 4)
+        verlet_list = neighbors.VerletList(20.0)
+        rebuilt = 0
+        rng = np.random.default_rng(5)
+        for step in range(20):
+            pairs = verlet_list.pairs(particles, particles, True)
+            rebuilt += verlet_list.rebuilt
+            self.assertEqual(pair_set(pairs),
+                    pair_set(kernels.all_pairs(particles, particles, True)))
+            particles.positions += rng.uniform(-2, 2, particles.positions.shape)
+            neighbors.reset_references(particles, verlet_list.skin)
+        self.assertLess(rebuilt, 20*400)
+
+    def test_pairs_with_other_particles_while_moving(self):
+        particles = random_particle_array(300, 7)
+        others = random_particle_array(300, 8)
+        others.ids += 300
+        verlet_list = neighbors.VerletList(20.0)
+        rng = np.random.default_rng(9)
+        for step in range(20):
+            pairs = verlet_list.pairs(particles, others, False)
+            self.assertEqual(pair_set(pairs),
+                    pair_set(kernels.all_pairs(particles, others, False)))
+            for array in (particles, others):
+                array.positions += rng.uniform(-2, 2, array.positions.shape)
+                neighbors.reset_references(array, verlet_list.skin)
+
+    def test_only_new_particles_are_rebuilt(self):
+        particles = random_particle_array(100, 6)
+        verlet_list = neighbors.VerletList(20.0)
+        verlet_list.pairs(particles, particles, True)
+        self.assertEqual(verlet_list.rebuilt, 100)
+        verlet_list.pairs(particles, particles, True)
+        self.assertEqual(verlet_list.rebuilt, 0)
+
+        moved = ParticleArray.concatenate(particles[1:], particles[:1])
+        pairs = verlet_list.pairs(moved, moved, True)
+        self.assertEqual(verlet_list.rebuilt, 0)
+        self.assertEqual(pair_set(pairs), pair_set(kernels.all_pairs(moved, moved, True)))
+
+        new = random_particle_array(1, 10)
+        new.ids += 100
+        grown = ParticleArray.concatenate(moved, new)
+        pairs = verlet_list.pairs(grown, grown, True)
+        self.assertEqual(verlet_list.rebuilt, 1)
+        self.assertEqual(pair_set(pairs), pair_set(kernels.all_pairs(grown, grown, True)))
+
+if __name__ == '__main__':
+    unittest.main()
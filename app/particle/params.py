@@ -21,10 +21,51 @@ num_active_workers = None
 new_num_active_workers = None
 partitions = {}
 max_radius = None
+checkpoint_interval = None
+checkpoint_file = None
+restart = None
+trajectory_dir = None
+trajectory_interval = None
+trajectory_chunk_size = None
+api_server = None
+backend = None
+num_workers = None
+master_computes = None
+seek_frame = None
+host = None
+port = None
+decomposition = None
+dims = None
+cuts = None
+snapshot_interval = None
+control_interval = None
+snapshot_requested = None
+thermostat_interval = None
+load_balance_interval = None
+load_balance_metric = None
+neighbor_search = None
+verlet_skin = None
+integrator = None
+respa_steps = None
+respa_split = None
+adaptive_dt = None
+min_dt = None
+max_dt = None
+previous_dt = None
+initialization = None
+seed = None
+steps = None
+headless = None
+timings = None
+metrics_interval = None
+neighbor_list_rebuild_rate = None
 timesteps_per_second = None
 init_total_energy = None
 curr_total_energy = None
+iterations = None
 
 comm = None
 rank = None
 num_threads = None
+thread_num = None
+max_workers = None
@@ -6,11 +6,14 @@ active workers, but other parameters are not guaranteed to be accurate.
 
 Threads are 0-indexed
 
-The master node does not do any computational work.
+The master node does not do any computational work, unless
+--master-computes is given.  The master then computes Partition 1 as well,
+in between coordinating the workers, and rank r computes Partition r + 1.
 
 Threads 1-n correspond to the n partitions that do computational work.
 
-Speedup could possibly occur by using numpy instead of arrays/lists
+Particles are stored in ParticleArrays, which keep each attribute in a
+contiguous numpy array
 
 Author: Nicholas Fong
         Lawrence Berkeley National Laboratory
@@ -25,27 +28,25 @@ Acknowledgment:
 """
 from Partition import Partition
 from Particle import Particle
+from ParticleArray import ParticleArray
 import util
 import params
+import api
+import checkpoint
+import trajectory
+import integrators
+import initialization
+import timers
 
 import argparse
 import random
 import math
-import threading
 import json
 import time
-from urllib.parse import urlparse
-from urllib.parse import parse_qs
-from http.server import BaseHTTPRequestHandler
-from mpi4py import MPI as mpi
 import subprocess
 import os
-
-params.mpi = mpi
-params.comm = mpi.COMM_WORLD
-params.rank = params.comm.Get_rank()
-params.num_threads = params.comm.Get_size()
-params.mpi_status = mpi.Status()
+import atexit
+import numpy as np
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -61,6 +62,77 @@ parser.add_argument("-d", "--dt", type=float,
         help = "time constant")
 parser.add_argument("-f", "--force", type=float,
         help = "force constant")
+parser.add_argument("--checkpoint-interval", type=int,
+        help = "timesteps between checkpoints of the simulation (0 to disable)")
+parser.add_argument("--checkpoint-file",
+        help = "file that checkpoints are written to")
+parser.add_argument("--restart",
+        help = "checkpoint file to resume the simulation from")
+parser.add_argument("--trajectory-dir",
+        help = "directory to record the trajectory of the particles in")
+parser.add_argument("--trajectory-interval", type=int,
+        help = "timesteps between frames of the trajectory")
+parser.add_argument("--trajectory-chunk-size", type=int,
+        help = "frames per file of the trajectory")
+parser.add_argument("--host",
+        help = "address that the API server listens on")
+parser.add_argument("--port", type=int,
+        help = "port that the API server listens on")
+parser.add_argument("--api-server", choices = ["process", "thread"],
+        default = "process",
+        help = "serve the API from a separate process fed through shared memory, or from a thread of the master")
+parser.add_argument("--backend", choices = ["mpi", "local"],
+        default = "mpi",
+        help = "run the ranks with MPI, or as processes on this machine")
+parser.add_argument("--num-workers", type=int,
+        help = "number of workers started by --backend local (default: one per core)")
+parser.add_argument("--master-computes", action = "store_true",
+        help = "let the master compute a partition too, instead of only coordinating the workers")
+parser.add_argument("--decomposition", choices = ["x", "xy", "xyz"],
+        default = "x",
+        help = "axes along which the simulation is split between workers")
+parser.add_argument("--snapshot-interval", type=int,
+        help = "timesteps between sending every particle to the master for the API (0 to only send them when a client asked for them)")
+parser.add_argument("--control-interval", type=int,
+        help = "timesteps between the master broadcasting requests from the API to the workers")
+parser.add_argument("--thermostat-interval", type=int,
+        help = "timesteps between rescaling velocities to the initial energy (0 to disable)")
+parser.add_argument("--load-balance-interval", type=int,
+        help = "timesteps between moving the partition boundaries to even out the work (0 to disable)")
+parser.add_argument("--load-balance-metric", choices = ["time", "particles"],
+        default = "time",
+        help = "work measured on each worker for load balancing")
+parser.add_argument("--neighbor-search", choices = ["cells", "verlet", "brute"],
+        default = "cells",
+        help = "how each Partition finds interacting particles")
+parser.add_argument("--verlet-skin", type=float,
+        help = "skin distance added to the cutoff by --neighbor-search verlet")
+parser.add_argument("--integrator", choices = ["euler", "verlet", "respa"],
+        default = "euler",
+        help = "how the particles are moved each timestep (see integrators.py)")
+parser.add_argument("--respa-steps", type=int,
+        help = "timesteps between evaluations of the slow forces of --integrator respa (default 4)")
+parser.add_argument("--respa-split", type=float,
+        help = "pairs closer than this many times the sum of their radii are the fast forces of --integrator respa (default 2)")
+parser.add_argument("--adaptive-dt", action = "store_true",
+        help = "pick the dt of each timestep from the fastest and the most accelerated particle")
+parser.add_argument("--min-dt", type=float,
+        help = "smallest dt picked by --adaptive-dt (default: a tenth of --dt)")
+parser.add_argument("--max-dt", type=float,
+        help = "largest dt picked by --adaptive-dt (default: ten times --dt)")
+parser.add_argument("--initialization", choices = ["serial", "parallel"],
+        default = "serial",
+        help = "create the particles on the master, or on every worker in parallel (see initialization.py)")
+parser.add_argument("--seed", type=int,
+        help = "seed of --initialization parallel (default: random)")
+parser.add_argument("--steps", type=int,
+        help = "stop after this many timesteps (default: run forever)")
+parser.add_argument("--headless", action = "store_true",
+        help = "run without the API server and without blinking the LEDs")
+parser.add_argument("--timings",
+        help = "write the time spent in each phase on every rank to this JSON file at the end of --steps")
+parser.add_argument("--metrics-interval", type=int,
+        help = "timesteps between gathering the timers and counters of every rank for /api/v1/metrics (0 to disable)")
 args = parser.parse_args()
 
 params.num_particles = args.numparticles if args.numparticles else 100
@@ -70,43 +142,172 @@ params.simulation_depth = args.depth if args.depth else 1000
 params.dt = args.dt if args.dt else 0.0005
 #params.force = args.force if args.force else 100
 params.force = args.force if args.force else 100000
-params.num_active_workers = 0
-params.new_num_active_workers = 0
-params.partitions = {}
-params.max_radius = min(params.simulation_width, params.simulation_height, params.simulation_depth)//32
-params.timesteps_per_second = 0
-params.init_total_energy = 0.0
-params.curr_total_energy = 0.0
-
-if params.rank is 0:
-    # Create partitions 1 through params.num_threads - 1
-    for i in range(1, params.num_threads):
-        params.partitions[i] = Partition(i)
+params.checkpoint_interval = args.checkpoint_interval if args.checkpoint_interval else 0
+params.checkpoint_file = args.checkpoint_file if args.checkpoint_file else "checkpoint.npz"
+params.restart = args.restart
+params.trajectory_dir = args.trajectory_dir
+params.trajectory_interval = args.trajectory_interval if args.trajectory_interval else 10
+params.trajectory_chunk_size = args.trajectory_chunk_size if args.trajectory_chunk_size else 100
+params.host = args.host if args.host else "10.0.0.101"
+params.port = args.port if args.port else 8080
+params.api_server = args.api_server
+params.backend = args.backend
+params.num_workers = args.num_workers if args.num_workers else os.cpu_count()
+params.master_computes = args.master_computes
+params.decomposition = args.decomposition
+params.snapshot_interval = args.snapshot_interval if args.snapshot_interval is not None else 1
+params.control_interval = args.control_interval if args.control_interval else 1
+params.thermostat_interval = args.thermostat_interval if args.thermostat_interval is not None else 1
+params.load_balance_interval = args.load_balance_interval if args.load_balance_interval else 0
+params.load_balance_metric = args.load_balance_metric
+params.neighbor_search = args.neighbor_search
+params.verlet_skin = args.verlet_skin if args.verlet_skin else 30.0
+params.integrator = args.integrator
+params.respa_steps = args.respa_steps if args.respa_steps else 4
+params.respa_split = args.respa_split if args.respa_split else 2.0
+params.adaptive_dt = args.adaptive_dt
+params.min_dt = args.min_dt if args.min_dt else params.dt/10
+params.max_dt = args.max_dt if args.max_dt else params.dt*10
+params.initialization = args.initialization
+params.seed = args.seed
+params.steps = args.steps
+params.headless = args.headless
+params.timings = args.timings
+params.metrics_interval = args.metrics_interval if args.metrics_interval is not None else 100
+snapshot_buffer = None
+previous_metrics = None
+restored_state = None
+def update_params():
+    """Control point: broadcast the requests that the master received through
+    the API since the last control point, after limiting the number of
+    workers asked for to the ones that exist.  Returns whether a client asked
+    for a snapshot of the particles
+    """
+    snapshot_requested = False
+    new_num_active_workers = None
+    if params.rank == 0:
+        if snapshot_buffer:
+            snapshot_buffer.take_requests()
+        snapshot_requested = params.snapshot_requested
+        params.snapshot_requested = False
+        # Read once, since the API server thread may set it again meanwhile
+        new_num_active_workers = params.new_num_active_workers
+        if not 1 <= new_num_active_workers <= params.max_workers:
+            util.info("Invalid number of active workers requested: " + str(new_num_active_workers))
+            new_num_active_workers = min(max(new_num_active_workers, 1), params.max_workers)
+    params.new_num_active_workers, snapshot_requested = params.comm.bcast(
+            (new_num_active_workers, snapshot_requested))
+    return snapshot_requested
+
+def distribute_particles(restored_state, restored_particles):
+    """The master creates every particle (or takes them from a checkpoint)
+    and sends each worker its own
+    """
+    if params.rank == 0:
+        if restored_state:
+            particles = restored_particles
+            particles.thread_nums = util.determine_particle_thread_nums(particles.positions)
+        else:
+            # Create Particles for Partitions
+            particles = []
+            for i in range(params.num_particles):
+                radius = 30#random.randint(1, params.max_radius)
+                position = [random.randint(radius, params.simulation_width - 1),
+                            random.randint(radius, params.simulation_height - 1),
+                            random.randint(radius, params.simulation_depth - 1)]
+                velocity = [400*random.randint(0,radius//4),
+                            400*random.randint(0,radius//4),
+                            400*random.randint(0,radius//4)]
+                mass = 3#random.randint(1,10)
+                params.init_total_energy += 0.5 * mass * (velocity[0]**2 + velocity[1]**2 + velocity[2]**2)
+                thread_num = util.determine_particle_thread_num(position)
+                particles.append(Particle(i, thread_num, position, velocity, mass, radius))
+
+            particles = ParticleArray.from_particles(particles)
+
+        for thread_num, partition in params.partitions.items():
+            partition.set_particles(particles.select(particles.thread_nums == thread_num))
+            if util.worker_rank(thread_num) != 0:
+                partition.particles.send(util.worker_rank(thread_num), 11)
+    else:
+        params.partitions[params.thread_num].set_particles(ParticleArray.recv(0, 11))
+    params.init_total_energy = params.comm.bcast(params.init_total_energy)
+
+def generate_particles():
+    """Every worker creates the particles that start in its own Partition
+    with initialization.generate, and only the total energy is shared.  The
+    master's copy of the particles is filled in by the first snapshot
+    """
+    if params.seed is None:
+        params.seed = params.comm.bcast(int(np.random.SeedSequence().entropy) if params.rank == 0 else None)
+    if params.rank == 0:
+        util.info("Creating the particles in parallel with seed " + str(params.seed))
+
+    local_energy = np.zeros(1)
+    if params.thread_num:
+        partition = params.partitions[params.thread_num]
+        partition.set_particles(initialization.generate(params.seed,
+            params.num_particles, params.thread_num, partition.start, partition.end))
+        local_energy[0] = partition.particles.kinetic_energy()
+    total_energy = np.zeros(1)
+    params.comm.Allreduce(local_energy, total_energy, op = params.mpi.SUM)
+    params.init_total_energy = total_energy[0]
+
+def init_mpi():
+    from mpi4py import MPI as mpi
+    params.mpi = mpi
+    params.comm = mpi.COMM_WORLD
+
+def setup():
+    """Set up the params, the decomposition and the Partitions on every rank,
+    once params.comm is set up
+    """
+    global restored_state
+    restored_particles = None
+    params.rank = params.comm.Get_rank()
+    params.num_threads = params.comm.Get_size()
+    params.mpi_status = params.mpi.Status()
+    params.thread_num = util.rank_thread_num(params.rank)
+    params.max_workers = params.num_threads - (0 if params.master_computes else 1)
+
+    params.num_active_workers = 0
+    params.new_num_active_workers = 0
+    params.partitions = {}
+    params.max_radius = min(params.simulation_width, params.simulation_height, params.simulation_depth)//32
+    params.timesteps_per_second = 0
+    params.neighbor_list_rebuild_rate = 0.0
+    params.init_total_energy = 0.0
+    params.curr_total_energy = 0.0
+    params.snapshot_requested = params.rank == 0
+
+    # Resume from a checkpoint?  Only the master reads the file
+    if params.restart:
+        if params.rank == 0:
+            util.info("Restarting from " + params.restart)
+            restored_state, restored_particles = checkpoint.read(params.restart)
+        restored_state = params.comm.bcast(restored_state)
+        checkpoint.restore(restored_state)
+
+    # A restarted run goes back to the number of workers and the partition
+    # boundaries at the time of the checkpoint
+    num_active_workers = params.max_workers
+    if restored_state:
+        num_active_workers = checkpoint.restore_decomposition(restored_state)
+    else:
+        util.update_decomposition(params.max_workers)
 
-    # Create Particles for Partitions
-    for i in range(params.num_particles):
-        radius = 30#random.randint(1, params.max_radius)
-        position = [random.randint(radius, params.simulation_width - 1),
-                    random.randint(radius, params.simulation_height - 1),
-                    random.randint(radius, params.simulation_depth - 1)]
-        velocity = [400*random.randint(0,radius//4),
-                    400*random.randint(0,radius//4),
-                    400*random.randint(0,radius//4)]
-        mass = 3#random.randint(1,10)
-        params.init_total_energy += 0.5 * mass * (velocity[0]**2 + velocity[1]**2 + velocity[2]**2)
-        thread_num = util.determine_particle_thread_num(position[0])
-        new_particle = Particle(i, thread_num, position, velocity, mass, radius)
-        params.partitions[thread_num].add_particle(new_particle)
+    # Every rank creates its own (empty) Partitions 1 through
+    # params.max_workers
+    for i in range(1, params.max_workers + 1):
+        params.partitions[i] = Partition(i)
+    params.num_active_workers = params.new_num_active_workers = num_active_workers
 
+    if restored_state or params.initialization == "serial":
+        distribute_particles(restored_state, restored_particles)
+    else:
+        generate_particles()
     params.curr_total_energy = params.init_total_energy
-
-def update_params():
-    params.new_num_active_workers = params.comm.bcast(params.new_num_active_workers)
-
-# Broadcast setup information
-params.partitions = params.comm.bcast(params.partitions)
-params.num_active_workers = params.comm.bcast(params.num_active_workers)
-update_params()
+    update_params()
 
 colors = {
     0: "255,255,255",
@@ -133,179 +334,339 @@ num_colors = len(colors)
 
 FNULL = open(os.devnull, 'w')
 
+def own_partition():
+    """Return the active Partition that this rank computes, or None"""
+    if 0 < params.thread_num <= params.num_active_workers:
+        return params.partitions[params.thread_num]
+    return None
+
+def receive_snapshot(num_workers):
+    """Replace the master's copy of the particles of each of the first
+    num_workers workers with the particles that they send through
+    update_master.  The Partition that the master computes itself is
+    already up to date
+    """
+    for i in range(1, num_workers + 1):
+        if util.worker_rank(i) == 0:
+            continue
+        new_particles = ParticleArray.recv(params.mpi.ANY_SOURCE, 0, params.mpi_status)
+        params.partitions[util.rank_thread_num(params.mpi_status.Get_source())].particles = new_particles
+
 # One timestep
-def timestep():
-    """Only do something as a slave if an active worker"""
-    if params.rank is 0:
+def timestep(take_snapshot):
+    """Only do something as a slave if an active worker.  The workers only
+    send their particles to the master if take_snapshot is set
+    """
+    partition = own_partition()
+    if params.rank == 0:
 #        threading.Thread(target=subprocess.call(["blink1-tool", "--rgb=" + str(colors[params.rank%4]), "--blink=1", "-m0", "-t20"],stdout=FNULL, stderr=subprocess.STDOUT)).start()
-        subprocess.Popen(["blink1-tool --rgb=" + str(colors[0]) + " --blink=1, -m0, -t20 > /dev/null"], shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
-        for i in range(1, params.num_active_workers+1):
-            new_particles = params.comm.recv(source = mpi.ANY_SOURCE, status = params.mpi_status, tag = 0)
-            params.partitions[params.mpi_status.Get_source()].particles = new_particles
-    elif params.rank <= params.num_active_workers:
-        subprocess.Popen(["blink1-tool --rgb=" + str(colors[params.rank % num_colors]) + " --blink=5, -m0, -t20 > /dev/null"], shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
-        partition = params.partitions[params.rank]
-        partition.send_and_receive_neighboring_particles()
-        partition.interact_particles()
-        partition.exchange_particles()
-        partition.update_master()
+        if not params.headless:
+            subprocess.Popen(["blink1-tool --rgb=" + str(colors[0]) + " --blink=1, -m0, -t20 > /dev/null"], shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
+        if partition:
+            partition.timestep()
+        if take_snapshot:
+            with timers.phase("master_sync"):
+                receive_snapshot(params.num_active_workers)
+    elif partition:
+        if not params.headless:
+            subprocess.Popen(["blink1-tool --rgb=" + str(colors[params.rank % num_colors]) + " --blink=5, -m0, -t20 > /dev/null"], shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
+        partition.timestep()
+        if take_snapshot:
+            with timers.phase("master_sync"):
+                partition.update_master()
 
 def change_num_active_workers():
+    """Switch to params.new_num_active_workers workers, which update_params
+    already limited to between 1 and params.max_workers.  Every rank computes
+    the new decomposition itself, and the workers move the particles that
+    change owner directly between each other with redistribute_particles,
+    without going through the master.  The master only sorts its copy of the
+    particles into the new Partitions, and the next snapshot refreshes it
+    """
     params.num_active_workers = params.new_num_active_workers
-    print("In change num_active_workers "+str(params.rank)+" "+str(params.num_active_workers))
-    if params.rank is 0:
-        if params.new_num_active_workers < 1 or params.new_num_active_workers > params.num_threads - 1:
-            util.debug("Invalid number of active workers requested: " + params.new_num_active_workers)
-
-        new_distribution = {}
-        for i in range(1, params.num_threads):
-            new_distribution[i] = set()
-
-        for partition_id, partition in params.partitions.items():
-            for particle in partition.particles:
-                new_thread = util.determine_particle_thread_num(particle.position[0])
-                particle.thread_num = new_thread
-                new_distribution[new_thread].add(particle)
-
-        for i in range(1, params.num_threads):
-            print("sending "+str(i))
-            params.partitions[i].particles = new_distribution[i]
-            params.comm.send(new_distribution[i], dest = i, tag = 11)
+    util.debug("Rank " + str(params.rank) + " switching to " + str(params.num_active_workers) + " workers")
+    util.update_decomposition(params.num_active_workers)
+    if params.rank == 0:
+        copies = [i for i in params.partitions if i != params.thread_num]
+        particles = ParticleArray.concatenate(*[params.partitions[i].particles for i in copies])
+        particles.thread_nums = util.determine_particle_thread_nums(particles.positions)
+        for i in copies:
+            params.partitions[i].particles = particles.select(particles.thread_nums == i)
+    if params.thread_num:
+        params.partitions[params.thread_num].redistribute_particles()
+
+def total_kinetic_energy():
+    """Return the total kinetic energy of the particles.  Each worker
+    computes the kinetic energy of its own particles, and a single Allreduce
+    sums it on every rank
+    """
+    partition = own_partition()
+    local_energy = np.zeros(1)
+    if partition:
+        local_energy[0] = partition.particles.kinetic_energy()
+    total_energy = np.zeros(1)
+    params.comm.Allreduce(local_energy, total_energy, op = params.mpi.SUM)
+    return total_energy[0]
+
+def rescale_energy():
+    """Thermostat: rescale every velocity so that the total kinetic energy
+    returns to params.init_total_energy, and every rank then rescales its
+    particles locally.  The master rescales its copy of the particles as
+    well, so that a redistribution of the particles after a change in the
+    number of workers starts from the rescaled velocities
+    """
+    partition = own_partition()
+    total_energy = total_kinetic_energy()
+    if total_energy == 0:
+        return
+
+    sqrt_ratio = math.sqrt(params.init_total_energy / total_energy)
+    if params.rank == 0:
+        util.debug('init_total_energy_______: ' + str(params.init_total_energy))
+        util.debug('curr_total_energy_before: ' + str(total_energy))
+        for key, partition in params.partitions.items():
+            partition.particles.velocities *= sqrt_ratio
+    elif partition:
+        partition.particles.velocities *= sqrt_ratio
+    params.curr_total_energy = total_energy*sqrt_ratio**2
+    if params.rank == 0:
+        util.debug('curr_total_energy_after_: ' + str(params.curr_total_energy))
+
+def update_dt():
+    """Adaptive timestep: pick params.dt for the next timestep with
+    integrators.adaptive_dt.  A single Allreduce finds the largest speed, the
+    largest acceleration during the last timestep and the smallest radius of
+    the particles of every worker
+    """
+    partition = own_partition()
+    local_extremes = np.array([0.0, 0.0, -np.inf])
+    if partition and len(partition.particles):
+        particles = partition.particles
+        local_extremes[0] = np.sqrt(np.einsum("ij,ij->i", particles.velocities, particles.velocities)).max()
+        local_extremes[1] = partition.max_velocity_change/params.dt
+        local_extremes[2] = -particles.radii.min()
+    extremes = np.zeros(3)
+    params.comm.Allreduce(local_extremes, extremes, op = params.mpi.MAX)
+    if np.isinf(extremes[2]):
+        return
+    params.previous_dt = params.dt
+    params.dt = integrators.adaptive_dt(extremes[0], extremes[1], -extremes[2])
+
+def balance_load():
+    """Gather the work that each worker measured since the last call and move
+    the partition boundaries to even it out.  Every rank computes the same new
+    boundaries, and particles then move to their new owners directly between
+    neighbors through exchange_particles, not through the master
+    """
+    partition = own_partition()
+    work = 0.0
+    if partition:
+        work = partition.work if params.load_balance_metric == "time" else len(partition.particles)
+        partition.work = 0.0
+    work = params.comm.allgather(work)
+    util.balance_cuts([work[util.worker_rank(i)] for i in range(1, params.num_active_workers + 1)])
+    if partition:
+        partition.update_start_end()
+        partition.exchange_particles()
+
+def update_neighbor_list_rebuild_rate():
+    """Gather how many particles had their Verlet list candidates rebuilt on
+    each worker since the last call, and store the fraction of rebuilt
+    neighbor lists
+    """
+    if params.thread_num == 0:
+        counts = (0, 0)
     else:
-        print("receiving "+str(params.rank))
-        params.partitions[params.rank].receive_new_particles()
-        #print("received "+str(params.rank))
-
-endpoint = "{\n}"
-class Server(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """Handle GET requests to the API endpoint"""
-        global endpoint
-        parsed_path = urlparse(self.path)
-        if "/api/v1/get_particles" in parsed_path:
-            message = endpoint
-            self.send_response(200)
-            # TODO: Security?
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
-            self.wfile.write(message.encode("utf-8"))
-        else:
-            util.info("GET sent to " + str(parsed_path[2]))
-
-    def do_POST(self):
-        """Handle POST requests to the API endpoint"""
-        global endpoint
-        parsed_path = urlparse(self.path)
-        if "/api/v1/post_parameters" in parsed_path:
-            self.send_response(200)
-            # TODO: Security?
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
-            length = int(self.headers["Content-Length"])
-            post_data = self.rfile.read(length).decode("utf-8")
-            #post_data = self.rfile.read(length)
-            # Parse data from POST
-            print('Got a post ')
-            print(type(post_data))
-            print(post_data)
-            new_data = parse_qs(post_data)
-            print(type(new_data))
-            for x in new_data:
-               print(x)
-               print(new_data[x])
-            params.new_num_active_workers = int(new_data['num_workers'][0])
-            #change_num_active_workers()
-        else:
-            util.info("POST sent to " + str(parsed_path[2]))
-    def log_message(self, format, *args):
+        partition = params.partitions[params.thread_num]
+        counts = (partition.neighbor_list_rebuilds, partition.neighbor_list_size)
+        partition.neighbor_list_rebuilds = 0
+        partition.neighbor_list_size = 0
+    counts = params.comm.gather(counts)
+    if params.rank == 0:
+        size = sum(count[1] for count in counts)
+        params.neighbor_list_rebuild_rate = sum(count[0] for count in counts)/size if size else 0.0
+
+def start_api_server():
+    """Serve the API from a separate process reading the snapshots that the
+    master writes into snapshot_buffer, or from a thread of the master
+    """
+    global snapshot_buffer
+    if params.api_server == "thread":
+        api.serve(params.host, params.port)
         return
 
+    snapshot_buffer = api.SnapshotBuffer(params.num_particles)
+    server_process = api.start_server_process(snapshot_buffer, params.host, params.port)
+    def stop_api_server():
+        server_process.terminate()
+        snapshot_buffer.close(unlink = True)
+    atexit.register(stop_api_server)
+
+def publish_snapshot():
+    """Publish the master's copy of the particles to the API"""
+    particles = ParticleArray.concatenate(*[partition.particles for partition in params.partitions.values()])
+    if snapshot_buffer:
+        snapshot_buffer.write(api.api_params(), particles)
+    else:
+        api.publish_particles(api.api_params(), particles)
+
+def update_metrics(steps):
+    """Gather the time that every rank spent in each phase and its counters
+    over the last steps timesteps, per timestep, and publish them to the API
+    """
+    global previous_metrics
+    partition = own_partition()
+    metrics = timers.since(previous_metrics)
+    previous_metrics = timers.snapshot()
+    metrics = {
+        "rank": params.rank,
+        "thread_num": params.thread_num,
+        "particles": len(partition.particles) if partition else 0,
+        "phase_ms": {name: 1000*seconds/steps for name, seconds in metrics["phases"].items()},
+        "counts": {name: value/steps for name, value in metrics["counts"].items()},
+    }
+    ranks = params.comm.gather(metrics)
+    if params.rank != 0:
+        return
+    metrics = {
+        "iterations": params.iterations,
+        "steps": steps,
+        "num_active_workers": params.num_active_workers,
+        "timesteps_per_second": params.timesteps_per_second,
+        "total_energy": params.curr_total_energy,
+        "ranks": ranks,
+    }
+    if snapshot_buffer:
+        snapshot_buffer.write_metrics(metrics)
+    else:
+        api.publish_metrics(metrics)
+
+def start_trajectory_writer():
+    """Start recording the trajectory of the particles, if asked to"""
+    if not params.trajectory_dir:
+        return None
+    meta = {name: getattr(params, name) for name in ("num_particles",
+        "simulation_height", "simulation_width", "simulation_depth", "dt",
+        "force", "trajectory_interval")}
+    writer = trajectory.TrajectoryWriter(params.trajectory_dir, meta, params.trajectory_chunk_size)
+    atexit.register(writer.close)
+    return writer
+
+def write_timings(seconds, steps):
+    """Gather the time that every rank spent in each phase and write it to
+    params.timings, along with the wall clock time of the steps timed
+    """
+    phases = params.comm.gather(dict(timers.totals))
+    if params.rank != 0:
+        return
+    result = {
+        "num_particles": params.num_particles,
+        "num_workers": params.num_active_workers,
+        "neighbor_search": params.neighbor_search,
+        "integrator": params.integrator,
+        "master_computes": params.master_computes,
+        "steps": steps,
+        "seconds": seconds,
+        "steps_per_second": steps/seconds if seconds else 0.0,
+        "phases": phases,
+    }
+    with open(params.timings, "w") as f:
+        json.dump(result, f, indent = 4)
+
 def main():
-    global endpoint
-
-    if params.rank is 0:
-        from http.server import HTTPServer
-        port_number = 8080
-        host = "10.0.0.101"
-        server = HTTPServer((host, port_number), Server)
-        util.info("Starting server on port " +  str(port_number) + ", ^c to exit")
-        threading.Thread(target=server.serve_forever).start()
-
-    iterations = 0
-    while True:
+    if params.comm is None:
+        init_mpi()
+    setup()
+
+    trajectory_writer = None
+    if params.rank == 0:
+        if not params.headless:
+            start_api_server()
+        trajectory_writer = start_trajectory_writer()
+
+    iterations = restored_state["iterations"] if restored_state else 0
+    last_iteration = iterations + params.steps if params.steps else None
+    timers.reset()
+    run_start = time.time()
+    while last_iteration is None or iterations < last_iteration:
         # Timing
         samples = 100
         iterations += 1
+        params.iterations = iterations
 
         if (iterations % samples == 1) and params.rank == 0:
             start = time.time()
 
-        # Any Changes to number of workers?
-        update_params()
-        if params.new_num_active_workers is not params.num_active_workers:
-            change_num_active_workers()
-
-        timestep()
+        # Any requests from the API?  Between control points the workers do
+        # not hear from the master at all
+        take_snapshot = False
+        if iterations % params.control_interval == 0:
+            with timers.phase("master_sync"):
+                take_snapshot = update_params()
+            if params.new_num_active_workers != params.num_active_workers:
+                change_num_active_workers()
+        if params.snapshot_interval and iterations % params.snapshot_interval == 0:
+            take_snapshot = True
+        # The master writes checkpoints and trajectories from its copy of the
+        # particles
+        checkpointing = params.checkpoint_interval and iterations % params.checkpoint_interval == 0
+        recording = params.trajectory_dir and iterations % params.trajectory_interval == 0
+        if checkpointing or recording:
+            take_snapshot = True
+
+        if params.adaptive_dt:
+            with timers.phase("adaptive_dt"):
+                update_dt()
+        timestep(take_snapshot)
 
         # Timing
         if (iterations % samples == 0) and params.rank == 0:
             params.timesteps_per_second = samples/(time.time() - start)
+        if iterations % samples == 0 and params.neighbor_search == "verlet":
+            update_neighbor_list_rebuild_rate()
 #            util.info(str(params.partitions))
 #            util.info("Average steps per second: " + str(params.timesteps_per_second))
 
-        if params.rank is 0:
-            # Use a copy of endpoint to prevent queries to endpoint from
-            # receiving an in-progress timestep
-            temp_endpoint =   "{\n"
-            param_endpoint =  "    \"params\": {\n"
-            param_endpoint += "        \"num_particles\": " + str(params.num_particles) + ",\n"
-            param_endpoint += "        \"num_active_workers\": " + str(params.num_active_workers) + ",\n"
-            param_endpoint += "        \"simulation_height\": " + str(params.simulation_height) + ",\n"
-            param_endpoint += "        \"simulation_width\": " + str(params.simulation_width) + ",\n"
-            param_endpoint += "        \"simulation_depth\": " + str(params.simulation_depth) + ",\n"
-            param_endpoint += "        \"timesteps_per_second\": " + str(params.timesteps_per_second) + ",\n"
-            param_endpoint += "        \"total_energy\": " + str(params.curr_total_energy) + "\n"
-            param_endpoint += "    },\n"
-
-            params.curr_total_energy = 0.0
-
-            particles_endpoint = "    \"particles\": [\n"
-            for key, partition in params.partitions.items():
-                for particle in partition.particles:
-#                    particle.neighbors = ""
-#                    particles_endpoint += particle.jsonify()#json.dumps(particle, default=lambda obj: obj.__dict__, sort_keys = True, indent=4) + ",\n"
-                    particles_endpoint += particle.jsonify()#json.dumps(particle, default=lambda obj: obj.__dict__, sort_keys = True, indent=4) + ",\n"
-                    params.curr_total_energy += 0.5 * particle.mass * (particle.velocity[0]**2 + particle.velocity[1]**2 + particle.velocity[2]**2)
-            particles_endpoint = particles_endpoint[:-2] # trim extra comma
-
-            util.debug('init_total_energy_______: ' + str(params.init_total_energy))
-
-            if True:
-#            if not iterations % 1000:
-                sqrt_ratio = math.sqrt(params.init_total_energy / params.curr_total_energy)
-#                ratio = params.init_total_energy / params.curr_total_energy
-                for key, partition in params.partitions.items():
-                    for particle in partition.particles:
-                        for i in range(3):
-                            particle.velocity[i] *= sqrt_ratio
-                    params.comm.send(partition.particles, dest=partition.thread_num, tag=99)
-                util.debug('curr_total_energy_before: ' + str(params.curr_total_energy))
-
-            # RM
-            if True:
-                params.curr_total_energy = 0.0
-#            if not iterations % 1000:
-                for key, partition in params.partitions.items():
-                    for particle in partition.particles:
-                        params.curr_total_energy += 0.5 * particle.mass * (particle.velocity[0]**2 + particle.velocity[1]**2 + particle.velocity[2]**2)
-                util.debug('curr_total_energy_after_: ' + str(params.curr_total_energy))
-            # RM
-
-            endpoint = "{\n" + param_endpoint + particles_endpoint + "\n    ]\n}\n"
-#        elif not iterations % 1000:
-        else:
-            new_particles = params.comm.recv(source=0, status=params.mpi_status, tag=99)
-            params.partitions[params.rank].set_particles(new_particles)
+        # The API reports the total energy, which the thermostat keeps up to
+        # date on the steps that it runs
+        thermostat = params.thermostat_interval and iterations % params.thermostat_interval == 0
+        updating_metrics = params.metrics_interval and not params.headless and iterations % params.metrics_interval == 0
+        if (take_snapshot or updating_metrics) and not params.headless and not thermostat:
+            with timers.phase("energy"):
+                params.curr_total_energy = total_kinetic_energy()
+
+        if params.rank == 0 and take_snapshot and not params.headless:
+            publish_snapshot()
+
+        if thermostat:
+            with timers.phase("thermostat"):
+                rescale_energy()
+
+        if params.rank == 0 and (checkpointing or recording):
+            particles = ParticleArray.concatenate(*[partition.particles for partition in params.partitions.values()])
+            if recording:
+                trajectory_writer.add(iterations, particles)
+
+        if params.load_balance_interval and iterations % params.load_balance_interval == 0:
+            with timers.phase("load_balance"):
+                balance_load()
+
+        # The checkpoint holds the boundaries after the load balancing of this
+        # step, which the particles move to at once.  The master's copies of
+        # the particles are only refreshed by the next snapshot, so they are
+        # taken before
+        if params.rank == 0 and checkpointing:
+            checkpoint.write(params.checkpoint_file, iterations, particles)
+
+        if updating_metrics:
+            update_metrics(params.metrics_interval)
+
+    if params.timings:
+        write_timings(time.time() - run_start, params.steps)
 
 if __name__ == "__main__":
-    main()
+    if params.backend == "local":
+        import localcomm
+        localcomm.run(params.num_workers + (0 if params.master_computes else 1), main)
+    else:
+        main()
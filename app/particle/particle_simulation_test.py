@@ -1,74 +1,49 @@
 #!/usr/bin/python
 """
-Unit test file for particle_simulation.py
+Unit test file for the Particles of particle_simulation.py
 """
 import unittest
-from particle_simulation import Particle
+import params
+from Particle import Particle
 
 class TestParticleMethods(unittest.TestCase):
-    def test_euclidean_distance(self):
-        a = Particle(1, 10, 10)
-        b = Particle(1, 10, 20)
-        self.assertEqual(a.euclidean_distance_to(b), (10, 0, 10))
-
-        a = Particle(1, 0, 0)
-        b = Particle(1, 0, 0)
-        self.assertEqual(a.euclidean_distance_to(b), (0, 0, 0))
-
-        a = Particle(1, -10, 20)
-        b = Particle(1, 10, 20)
-        self.assertEqual(a.euclidean_distance_to(b), (20, 20, 0))
-
-        a = Particle(1, -18, 24)
-        b = Particle(1, 7, 32)
-        self.assertEqual(a.euclidean_distance_to(b), (26.248809496813376, 25, 8))
-
-        a = Particle(1, -100, 0)
-        b = Particle(1, -0.01, 0)
-        self.assertEqual(a.euclidean_distance_to(b), (99.99, 99.99, 0))
-
-    def test_populate_neighbors(self):
-        """
-        Assumes an interaction radius of 100
-        """
-        a = Particle(1, -100, 0)
-        b = Particle(1, 100, 1)
-        c = Particle(1,250,100)
-        Particle.static_particles = [a,b,c]
-        self.assertEqual(Particle.static_particles, [a,b,c])
-
-        b.populate_neighbors()
-        self.assertEqual(b.neighbors, [])
+    def setUp(self):
+        params.force = 100000
+        params.simulation_width = 1000
+        params.simulation_height = 1000
+        params.simulation_depth = 1000
 
-        b = Particle(1, -0.01, 0)
-        Particle.static_particles = [a,b,c]
-        self.assertEqual(Particle.static_particles, [a,b,c])
-
-        a.populate_neighbors()
-        b.populate_neighbors()
-        dist = a.euclidean_distance_to(b)
-        self.assertEqual(len(b.neighbors), 1)
-        self.assertEqual(b.neighbors[0], (a, dist[1], dist[2]))
-
-    def test_move_particle(self):
-        """
-        Make sure the particle always stays within the bound of the height and
-        width of the simulation.  Assumes a 1000 by 1000 simulation size.
-        """
-
-        test_height = 1000
-        test_width = 1000
-
-        a = Particle(1, -100, 0)
-        a.x_velocity = 900
-        a.y_velocity = 480
-
-        for _ in range(10000000):
-            a.move_particle()
-            self.assertGreater(test_width, a.x_position)
-            self.assertLessEqual(0, a.x_position)
-            self.assertGreaterEqual(test_height, a.y_position)
-            self.assertLessEqual(0, a.y_position)
+    def test_euclidean_distance(self):
+        a = Particle(0, 1, [10, 10, 10], [0, 0, 0], 3, 30)
+        b = Particle(1, 1, [10, 20, 10], [0, 0, 0], 3, 30)
+        self.assertEqual(a.euclidean_distance_to(b), (10, (0, -10, 0)))
+
+        b = Particle(1, 1, [10, 10, 10], [0, 0, 0], 3, 30)
+        self.assertEqual(a.euclidean_distance_to(b), (0, (0, 0, 0)))
+
+        b = Particle(1, 1, [-2, 15, 10], [0, 0, 0], 3, 30)
+        self.assertEqual(a.euclidean_distance_to(b), (13, (12, -5, 0)))
+
+    def test_update_velocity(self):
+        """Particles within the cutoff 5*(r_a + r_b) push each other apart"""
+        a = Particle(0, 1, [100, 100, 100], [0, 0, 0], 3, 30)
+        b = Particle(1, 1, [200, 100, 100], [0, 0, 0], 3, 30)
+        c = Particle(2, 1, [600, 100, 100], [0, 0, 0], 3, 30)
+        particles = [a, b, c]
+        for particle in particles:
+            particle.update_velocity(particles)
+        self.assertLess(a.velocity[0], 0)
+        self.assertEqual(a.velocity[0], -b.velocity[0])
+        self.assertEqual(c.velocity, [0, 0, 0])
+
+    def test_update_position(self):
+        """Particles always stay within the bounds of the simulation"""
+        a = Particle(0, 1, [10, 500, 990], [900, -480, 300], 3, 30)
+        for _ in range(10000):
+            a.update_position(0.05)
+            for coordinate in a.position:
+                self.assertLessEqual(0, coordinate)
+                self.assertLessEqual(coordinate, 1000)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+"""Replay a trajectory recorded with --trajectory-dir through the same API as
+a live simulation, without MPI.
+
+    python3 replay.py TRAJECTORY_DIR [--fps 30] [--host HOST] [--port PORT]
+
+The trajectory is memory-mapped, so playback starts at once however long the
+recording is.  Frames are published to /api/v1/get_particles (and
+/api/v1/stream_particles) at --fps frames per second, looping at the end
+unless --no-loop is given.  POST frame=N to /api/v1/post_parameters to seek
+to frame N.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import util
+import params
+import api
+import trajectory
+
+import argparse
+import time
+
+def set_params(recorded):
+    """Set the params reported by the API from the meta data of a Trajectory"""
+    for name in ("num_particles", "simulation_height", "simulation_width",
+            "simulation_depth", "dt", "force"):
+        setattr(params, name, recorded.meta.get(name))
+    params.neighbor_list_rebuild_rate = 0.0
+    params.seek_frame = None
+
+def publish_frame(recorded, index, fps):
+    """Publish frame index of a Trajectory to the API"""
+    particles = recorded.particles(index)
+    params.num_active_workers = int(particles.thread_nums.max()) if len(particles) else 0
+    params.timesteps_per_second = fps*recorded.meta.get("trajectory_interval", 1)
+    params.curr_total_energy = particles.kinetic_energy()
+    header = dict(api.api_params(), frame = index, num_frames = len(recorded),
+            step = int(recorded.frame(index)["steps"]))
+    api.publish_particles(header, particles)
+
+def replay(recorded, fps, loop = True):
+    """Publish the frames of a Trajectory at fps frames per second, seeking
+    whenever a client asks to.  Frames that are due by the time the previous
+    one was published are skipped, so playback keeps to the recorded speed
+    when publishing cannot keep up with fps
+    """
+    index = 0
+    next_frame = time.time()
+    while index < len(recorded):
+        if params.seek_frame is not None:
+            index = min(max(params.seek_frame, 0), len(recorded) - 1)
+            params.seek_frame = None
+        publish_frame(recorded, index, fps)
+
+        next_frame += 1/fps
+        skipped = max(int((time.time() - next_frame)*fps), 0)
+        next_frame += skipped/fps
+        index += 1 + skipped
+        if index >= len(recorded):
+            if loop:
+                index %= len(recorded)
+            elif index - skipped < len(recorded):
+                # Always end on the last frame
+                index = len(recorded) - 1
+        time.sleep(max(next_frame - time.time(), 0))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trajectory_dir",
+            help = "directory of a trajectory recorded with --trajectory-dir")
+    parser.add_argument("--fps", type=float, default = 30,
+            help = "frames published per second")
+    parser.add_argument("--no-loop", action = "store_true",
+            help = "stop at the last frame instead of starting over")
+    parser.add_argument("--host", default = "10.0.0.101",
+            help = "address that the API server listens on")
+    parser.add_argument("--port", type=int, default = 8080,
+            help = "port that the API server listens on")
+    args = parser.parse_args()
+
+    recorded = trajectory.Trajectory(args.trajectory_dir)
+    if len(recorded) == 0:
+        util.error("trajectory " + args.trajectory_dir + " has no frames")
+    set_params(recorded)
+    util.info("Replaying " + str(len(recorded)) + " frames of " + args.trajectory_dir)
+    api.serve(args.host, args.port)
+    replay(recorded, args.fps, not args.no_loop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""
+Unit test file for replay.py
+"""
+import unittest
+import json
+import tempfile
+import time
+import numpy as np
+import params
+import api
+import replay
+import trajectory
+from ParticleArray import ParticleArray
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        writer = trajectory.TrajectoryWriter(self.directory.name,
+                {"num_particles": 10, "trajectory_interval": 5}, chunk_size = 2)
+        for step in range(5):
+            writer.add(5*step, ParticleArray(np.arange(10), np.full(10, 2),
+                np.full((10, 3), float(step)), np.ones((10, 3)), np.ones(10), np.ones(10)))
+        writer.close()
+        self.recorded = trajectory.Trajectory(self.directory.name)
+        replay.set_params(self.recorded)
+
+    def tearDown(self):
+        del self.recorded
+        self.directory.cleanup()
+
+    def published(self):
+        return json.loads(api.snapshot.body("json").decode("utf-8"))
+
+    def test_replay_to_the_end(self):
+        replay.replay(self.recorded, 1000, loop = False)
+        published = self.published()
+        self.assertEqual(published["params"]["frame"], 4)
+        self.assertEqual(published["params"]["step"], 20)
+        self.assertEqual(published["params"]["num_active_workers"], 2)
+        self.assertEqual(published["particles"][0]["position"], [4.0, 4.0, 4.0])
+
+    def test_seek(self):
+        published = []
+        publish_frame = replay.publish_frame
+        replay.publish_frame = lambda recorded, index, fps: published.append(index)
+        try:
+            params.seek_frame = 3
+            replay.replay(self.recorded, 1000, loop = False)
+        finally:
+            replay.publish_frame = publish_frame
+        self.assertEqual(published, [3, 4])
+        self.assertIsNone(params.seek_frame)
+
+    def test_skip_frames_when_behind(self):
+        published = []
+        publish_frame = replay.publish_frame
+        def slow_publish_frame(recorded, index, fps):
+            published.append(index)
+            time.sleep(0.025)
+        replay.publish_frame = slow_publish_frame
+        try:
+            replay.replay(self.recorded, 100, loop = False)
+        finally:
+            replay.publish_frame = publish_frame
+        self.assertEqual(published[0], 0)
+        self.assertEqual(published[-1], 4)
+        self.assertLess(len(published), 5)
+        self.assertEqual(published, sorted(set(published)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+"""Wall clock time that this rank spent in each phase of the simulation
+("halo", "forces", "migration", "master_sync", ...), and counts of the work
+done ("halo_particles", "bytes_sent", ...), summed since the last reset.
+Timing a phase only costs two calls to time.perf_counter and counting only
+adds to a dict, so the timers are always on.
+
+    with timers.phase("forces"):
+        ...
+    timers.count("neighbor_pairs", len(i))
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+import contextlib
+import time
+
+totals = {}
+counts = {}
+
+@contextlib.contextmanager
+def phase(name):
+    """Add the time spent in the body of the with statement to phase name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+
+def count(name, amount):
+    """Add amount to the counter name"""
+    counts[name] = counts.get(name, 0) + amount
+
+def snapshot():
+    """Return a copy of the totals and the counts"""
+    return {"phases": dict(totals), "counts": dict(counts)}
+
+def since(previous):
+    """Return the totals and the counts accumulated since previous, an
+    earlier snapshot (or None for everything since the last reset)
+    """
+    current = snapshot()
+    if previous is None:
+        return current
+    return {group: {name: value - previous[group].get(name, 0)
+        for name, value in current[group].items()} for group in current}
+
+def reset():
+    totals.clear()
+    counts.clear()
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+"""
+Unit test file for timers.py
+"""
+import unittest
+import timers
+
+class TestTimers(unittest.TestCase):
+    def setUp(self):
+        timers.reset()
+
+    def test_since(self):
+        with timers.phase("forces"):
+            pass
+        timers.count("neighbor_pairs", 3)
+        previous = timers.snapshot()
+        timers.count("neighbor_pairs", 4)
+        timers.count("bytes_sent", 104)
+        difference = timers.since(previous)
+        self.assertEqual(difference["counts"], {"neighbor_pairs": 4, "bytes_sent": 104})
+        self.assertEqual(difference["phases"], {"forces": 0.0})
+        self.assertEqual(timers.since(None)["counts"]["neighbor_pairs"], 7)
+
+if __name__ == '__main__':
+    unittest.main()
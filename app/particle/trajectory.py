@@ -0,0 +1,178 @@
+#!/usr/bin/python
+"""Trajectory output for offline analysis and replay.
+
+A trajectory is a directory holding:
+
+    meta.json                       params of the run, the timestep interval
+                                    between frames and the largest number of
+                                    frames per chunk
+    chunk_<k>_ids.npy               (n,) arrays of the particles, which are
+    chunk_<k>_masses.npy            the same in every frame of the chunk
+    chunk_<k>_radii.npy
+    chunk_<k>_steps.npy             (f,) int64 timestep of each frame
+    chunk_<k>_positions.npy         (f, n, 3) float32
+    chunk_<k>_velocities.npy        (f, n, 3) float32
+    chunk_<k>_thread_nums.npy       (f, n) uint16
+
+Row i of every frame of a chunk is the particle ids[i] of that chunk
+(particles are sorted by id).  A frame with different particles than the
+frames before it (for example after a particle left the simulation) starts
+a new chunk.  TrajectoryWriter collects the frames of a chunk and writes
+each full chunk from a background thread, so the simulation never waits for
+the disk, and Trajectory memory-maps the chunks so that any frame can be
+read without loading the rest of the file.
+
+Author: Nicholas Fong
+        Lawrence Berkeley National Laboratory
+        National Energy Research Scientific Computing Center
+
+Acknowledgment:
+        This work was supported by the Director, Office of Science,
+        Division of Mathematical, Information, and Computational
+        Sciences of the U.S. Department of Energy under contract
+        DE-AC02-05CH11231, using resources of the National Energy Research
+        Scientific Computing Center.
+"""
+from ParticleArray import ParticleArray
+
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+particle_fields = ["ids", "masses", "radii"]
+chunk_fields = ["steps", "positions", "velocities", "thread_nums"]
+
+def chunk_filename(directory, chunk, field):
+    return os.path.join(directory, "chunk_" + str(chunk).zfill(5) + "_" + field + ".npy")
+
+def save(filename, array):
+    """Write array to filename, renaming it into place once it is complete"""
+    temp_filename = filename + ".tmp.npy"
+    np.save(temp_filename, array)
+    os.replace(temp_filename, filename)
+
+class TrajectoryWriter:
+    """Records frames of the particles into a trajectory directory.
+
+    add only queues the frame; the background thread sorts it by id, copies it
+    into the current chunk and writes the chunk once it holds chunk_size
+    frames, or before a frame with different particles.  close writes the
+    last, partial chunk.  An exception in the background thread stops the
+    recording, and is raised again by the next call to add or close
+    """
+    def __init__(self, directory, meta, chunk_size = 100):
+        self.directory = directory
+        self.meta = dict(meta, chunk_size = chunk_size)
+        self.chunk_size = chunk_size
+        self.chunk = 0
+        self.particles = None
+        self.frames = []
+        self.error = None
+        self.queue = queue.Queue()
+        os.makedirs(directory, exist_ok = True)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent = 4)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, step, particles):
+        """Record the particles in a ParticleArray as the frame of timestep
+        step.  The ParticleArray must not be modified afterwards
+        """
+        if self.error:
+            raise self.error
+        self.queue.put((step, particles))
+
+    def run(self):
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    self.write_chunk()
+                    return
+                self.add_frame(*frame)
+        except Exception as error:
+            self.error = error
+
+    def add_frame(self, step, particles):
+        """Copy a frame into the current chunk, sorted by id"""
+        order = np.argsort(particles.ids, kind="stable")
+        ids = particles.ids[order]
+        if self.frames and not np.array_equal(ids, self.particles[0]):
+            self.write_chunk()
+        if not self.frames:
+            self.particles = [getattr(particles, name)[order] for name in particle_fields]
+        self.frames.append((step, particles.positions[order].astype(np.float32),
+            particles.velocities[order].astype(np.float32),
+            particles.thread_nums[order].astype(np.uint16)))
+        if len(self.frames) == self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if not self.frames:
+            return
+        for field, array in zip(particle_fields, self.particles):
+            save(chunk_filename(self.directory, self.chunk, field), array)
+        columns = list(zip(*self.frames))
+        arrays = [np.array(columns[0], dtype=np.int64)] + [np.stack(column) for column in columns[1:]]
+        for field, array in zip(chunk_fields, arrays):
+            save(chunk_filename(self.directory, self.chunk, field), array)
+        self.chunk += 1
+        self.frames = []
+
+    def close(self):
+        """Write the frames that are still queued and stop the thread"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+class Trajectory:
+    """Read-only view of a trajectory directory, with every chunk
+    memory-mapped
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.chunks = []
+        chunk = 0
+        while os.path.exists(chunk_filename(directory, chunk, chunk_fields[-1])):
+            self.chunks.append({field: np.load(chunk_filename(directory, chunk, field), mmap_mode="r")
+                for field in particle_fields + chunk_fields})
+            chunk += 1
+        lengths = [len(chunk["steps"]) for chunk in self.chunks]
+        self.offsets = np.cumsum([0] + lengths)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def frame(self, index):
+        """Return a dict of the step and the memory-mapped positions,
+        velocities and thread_nums of frame index, and the ids, masses and
+        radii of its particles
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame " + str(index) + " of a trajectory with " +
+                    str(len(self)) + " frames")
+        chunk = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        index -= int(self.offsets[chunk])
+        frame = {field: self.chunks[chunk][field][index] for field in chunk_fields}
+        frame.update((field, self.chunks[chunk][field]) for field in particle_fields)
+        return frame
+
+    def particles(self, index):
+        """Return frame index as a ParticleArray"""
+        frame = self.frame(index)
+        return ParticleArray(frame["ids"], frame["thread_nums"], frame["positions"],
+                frame["velocities"], frame["masses"], frame["radii"])
+
+    def steps(self):
+        """Return the timestep of every frame"""
+        return np.concatenate([chunk["steps"] for chunk in self.chunks]) if self.chunks \
+                else np.zeros(0, dtype=np.int64)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+"""
+Unit test file for trajectory.py
+"""
+import unittest
+import tempfile
+import numpy as np
+import trajectory
+from ParticleArray import ParticleArray
+
+class TestTrajectory(unittest.TestCase):
+    def test_write_and_read(self):
+        rng = np.random.default_rng(0)
+        frames = []
+        with tempfile.TemporaryDirectory() as directory:
+            writer = trajectory.TrajectoryWriter(directory, {"dt": 0.5}, chunk_size = 3)
+            for step in range(7):
+                order = rng.permutation(50)
+                particles = ParticleArray(order, rng.integers(1, 4, 50),
+                        rng.uniform(0, 1000, (50, 3)), rng.uniform(-100, 100, (50, 3)),
+                        order + 1, np.full(50, 30))
+                frames.append(particles.select(np.argsort(particles.ids)))
+                writer.add(10*step, particles)
+            writer.close()
+
+            recorded = trajectory.Trajectory(directory)
+            self.assertEqual(recorded.meta["dt"], 0.5)
+            self.assertEqual(len(recorded), 7)
+            self.assertEqual(len(recorded.chunks), 3)
+            self.assertEqual(recorded.steps().tolist(), list(range(0, 70, 10)))
+            self.assertEqual(recorded.particles(0).ids.tolist(), list(range(50)))
+            self.assertEqual(recorded.particles(-1).masses.tolist(), list(range(1, 51)))
+            for index in (0, 4, -1):
+                frame = recorded.frame(index)
+                self.assertIsInstance(frame["positions"], np.memmap)
+                np.testing.assert_allclose(frame["positions"], frames[index].positions, rtol=1e-6)
+                particles = recorded.particles(index)
+                np.testing.assert_allclose(particles.velocities, frames[index].velocities, rtol=1e-6)
+                self.assertEqual(particles.thread_nums.tolist(), frames[index].thread_nums.tolist())
+            with self.assertRaises(IndexError):
+                recorded.frame(7)
+            del recorded, frame
+
+    def test_particles_change(self):
+        def particles(ids, step):
+            n = len(ids)
+            return ParticleArray(ids, np.ones(n), np.full((n, 3), float(step)),
+                    np.zeros((n, 3)), np.asarray(ids) + 1, np.full(n, 30))
+        with tempfile.TemporaryDirectory() as directory:
+            writer = trajectory.TrajectoryWriter(directory, {}, chunk_size = 3)
+            writer.add(0, particles([0, 1, 2], 0))
+            writer.add(1, particles([0, 1, 2], 1))
+            # Particle 1 left the simulation
+            writer.add(2, particles([2, 0], 2))
+            writer.add(3, particles([0, 2], 3))
+            writer.close()
+
+            recorded = trajectory.Trajectory(directory)
+            self.assertEqual(len(recorded), 4)
+            self.assertEqual([len(chunk["steps"]) for chunk in recorded.chunks], [2, 2])
+            self.assertEqual(recorded.particles(1).ids.tolist(), [0, 1, 2])
+            self.assertEqual(recorded.particles(1).masses.tolist(), [1, 2, 3])
+            later = recorded.particles(2)
+            self.assertEqual(later.ids.tolist(), [0, 2])
+            self.assertEqual(later.masses.tolist(), [1, 3])
+            self.assertEqual(later.positions.tolist(), [[2.0]*3]*2)
+            del recorded, later
+
+    def test_error_in_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = trajectory.TrajectoryWriter(directory, {})
+            writer.add(0, None)
+            with self.assertRaises(AttributeError):
+                writer.close()
+            with self.assertRaises(AttributeError):
+                writer.add(1, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,9 +12,8 @@ Acknowledgment:
         Scientific Computing Center.
 """
 import params
-import math
 import traceback
-from Particle import Particle
+import numpy as np
 
 def info(string):
     """Print a message in blue to STDOUT"""
@@ -46,26 +45,113 @@ def validate_list(*args):
             error(ArgumentError, "incorrect type argument: " + type(arg) +
                 "was passed instead of a int")
 
-def validate_particle_set(*args):
-    for arg in args:
-        if type(arg) is not set:
-            error(ArgumentError, "incorrect type argument: " + type(arg) +
-                "was passed instead of a set")
-        for obj in arg:
-            if type(obj) is not Particle:
-                error(ArgumentError, "Non-particle type in set; received a " +
-                        type(obj) + " instead of a Particle")
-
-def determine_particle_thread_num(x_position):
-    result = math.ceil((x_position/params.simulation_width)*params.num_active_workers)
-    #print("Got that the thread num should be "+str(result)+"given: x_position " + str(x_position) + " simulation_width of " + str(params.simulation_width) + " and with " + str(params.new_num_active_workers) + " active workers")
-    if result == 0:
-        debug("Got that the thread num should be 0 given: x_position " + str(x_position) + " simulation_width of " + str(params.simulation_width) + " and with " + str(params.num_active_workers) + " active workers")
-    return result
-
-def determine_new_particle_thread_num(x_position):
-    result = math.ceil((x_position/params.simulation_width)*params.new_num_active_workers)
-    if result == 0:
-        debug("Got that the thread num should be 0 given: x_position " + str(x_position) + " simulation_width of " + str(params.simulation_width) + " and with " + str(params.new_num_active_workers) + " active workers")
-    return result
+def prime_factors(n):
+    """Return the prime factors of n in descending order"""
+    factors = []
+    factor = 2
+    while factor*factor <= n:
+        while n % factor == 0:
+            factors.append(factor)
+            n //= factor
+        factor += 1
+    if n > 1:
+        factors.append(n)
+    return sorted(factors, reverse=True)
+
+def balanced_dims(num_workers, num_axes):
+    """Split num_workers into num_axes factors that are as close to each other
+    as possible, largest first (the same grid that MPI_Dims_create picks)
+    """
+    dims = [1]*num_axes
+    for factor in prime_factors(num_workers):
+        dims[dims.index(min(dims))] *= factor
+    return sorted(dims, reverse=True)
+
+def update_decomposition(num_workers):
+    """Split the simulation into a Cartesian grid of num_workers Partitions
+    over the axes named in params.decomposition ("x", "xy" or "xyz"), and
+    store the number of Partitions along each axis in params.dims and the
+    boundaries between them in params.cuts
+    """
+    split = [axis in params.decomposition for axis in "xyz"]
+    factors = iter(balanced_dims(num_workers, sum(split)))
+    params.dims = [next(factors) if split[axis] else 1 for axis in range(3)]
+    sizes = [params.simulation_width, params.simulation_height, params.simulation_depth]
+    params.cuts = [np.append(np.arange(params.dims[axis])*(sizes[axis]//params.dims[axis]),
+        sizes[axis]) for axis in range(3)]
+
+def balanced_cuts(cuts, slab_work):
+    """Return new boundaries for a row of slabs that even out the work in each
+    slab, assuming that the work in each slab is spread evenly across it.
+
+    Each boundary only moves half of the way towards its ideal position, and
+    never more than a quarter of the width of either slab next to it, so that
+    the boundaries cannot cross and particles only ever move to a neighboring
+    Partition
+    """
+    num_slabs = len(slab_work)
+    total = float(np.sum(slab_work))
+    if total <= 0:
+        return cuts
+    # Give every slab a sliver of work so that the cumulative work is strictly
+    # increasing, as np.interp needs
+    slab_work = np.asarray(slab_work, dtype=float) + total*1e-6
+    cumulative = np.concatenate([[0.0], np.cumsum(slab_work)])
+    targets = cumulative[-1]*np.arange(1, num_slabs)/num_slabs
+    ideal = np.interp(targets, cumulative, cuts)
+
+    widths = np.diff(cuts)
+    limit = 0.25*np.minimum(widths[:-1], widths[1:])
+    inner = cuts[1:-1] + np.clip(0.5*(ideal - cuts[1:-1]), -limit, limit)
+    return np.concatenate([cuts[:1], inner, cuts[-1:]])
+
+def balance_cuts(work):
+    """Move the boundaries in params.cuts to even out the work between the
+    Partitions, where work[i] is the work measured by thread i + 1.  Each axis
+    is balanced on the total work of each slab of Partitions along it
+    """
+    work = np.asarray(work, dtype=float).reshape(params.dims)
+    for axis in range(3):
+        if params.dims[axis] == 1:
+            continue
+        other_axes = tuple(a for a in range(3) if a != axis)
+        params.cuts[axis] = balanced_cuts(params.cuts[axis], work.sum(axis=other_axes))
+
+def worker_coordinates(thread_num):
+    """Return the grid coordinates of the Partition that thread_num owns"""
+    index = thread_num - 1
+    return [index//(params.dims[1]*params.dims[2]),
+            (index//params.dims[2]) % params.dims[1],
+            index % params.dims[2]]
+
+def worker_thread_num(coordinates):
+    """Return the thread number that owns the Partition at the given grid
+    coordinates, or None if the coordinates are outside of the grid
+    """
+    if any(c < 0 or c >= d for c, d in zip(coordinates, params.dims)):
+        return None
+    return 1 + (coordinates[0]*params.dims[1] + coordinates[1])*params.dims[2] + coordinates[2]
+
+def worker_rank(thread_num):
+    """Return the rank that computes the Partition of thread_num.  With
+    params.master_computes, the master computes Partition 1 and every other
+    Partition moves down a rank
+    """
+    return thread_num - 1 if params.master_computes else thread_num
+
+def rank_thread_num(rank):
+    """Return the thread number of the Partition that rank computes (0 for a
+    master that does not compute)
+    """
+    return rank + 1 if params.master_computes else rank
+
+def determine_particle_thread_nums(positions):
+    """Return the thread number of the Partition that each of an (n, 3) array
+    of positions falls in
+    """
+    coordinates = [np.clip(np.searchsorted(params.cuts[axis], positions[:, axis]) - 1,
+        0, params.dims[axis] - 1) for axis in range(3)]
+    return 1 + (coordinates[0]*params.dims[1] + coordinates[1])*params.dims[2] + coordinates[2]
 
+def determine_particle_thread_num(position):
+    return int(determine_particle_thread_nums(np.array([position], dtype=float))[0])
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""
+Unit test file for the domain decomposition in util.py
+"""
+import unittest
+import numpy as np
+import util
+import params
+
+class TestDecomposition(unittest.TestCase):
+    def setUp(self):
+        params.simulation_width = 1000
+        params.simulation_height = 1000
+        params.simulation_depth = 1000
+
+    def test_balanced_dims(self):
+        self.assertEqual(util.balanced_dims(8, 3), [2, 2, 2])
+        self.assertEqual(util.balanced_dims(12, 3), [3, 2, 2])
+        self.assertEqual(util.balanced_dims(6, 2), [3, 2])
+        self.assertEqual(util.balanced_dims(7, 3), [7, 1, 1])
+
+    def test_x_decomposition_matches_slabs(self):
+        params.decomposition = "x"
+        util.update_decomposition(3)
+        self.assertEqual(params.dims, [3, 1, 1])
+        self.assertEqual(list(params.cuts[0]), [0, 333, 666, 1000])
+
+    def test_thread_nums_round_trip(self):
+        params.decomposition = "xyz"
+        util.update_decomposition(12)
+        self.assertEqual(params.dims, [3, 2, 2])
+        for thread_num in range(1, 13):
+            coordinates = util.worker_coordinates(thread_num)
+            self.assertEqual(util.worker_thread_num(coordinates), thread_num)
+        self.assertIsNone(util.worker_thread_num([3, 0, 0]))
+        self.assertIsNone(util.worker_thread_num([0, -1, 0]))
+
+        positions = np.random.default_rng(0).uniform(0, 1000, (100, 3))
+        for position, thread_num in zip(positions, util.determine_particle_thread_nums(positions)):
+            coordinates = util.worker_coordinates(thread_num)
+            for axis in range(3):
+                self.assertLessEqual(params.cuts[axis][coordinates[axis]], position[axis])
+                self.assertLessEqual(position[axis], params.cuts[axis][coordinates[axis] + 1])
+
+    def test_worker_ranks(self):
+        for master_computes, ranks in ((False, [1, 2, 3]), (True, [0, 1, 2])):
+            params.master_computes = master_computes
+            self.assertEqual([util.worker_rank(thread_num) for thread_num in (1, 2, 3)], ranks)
+            self.assertEqual([util.rank_thread_num(rank) for rank in ranks], [1, 2, 3])
+        params.master_computes = None
+
+    def test_balanced_cuts(self):
+        def slab_work(cuts):
+            """Work with a density of 10 below x = 250 and 1 above it"""
+            dense = np.minimum(cuts, 250)
+            return 10*np.diff(dense) + (np.diff(cuts) - np.diff(dense))
+
+        cuts = np.array([0.0, 250.0, 500.0, 750.0, 1000.0])
+        for _ in range(50):
+            cuts = util.balanced_cuts(cuts, slab_work(cuts))
+            self.assertTrue((np.diff(cuts) > 0).all())
+        work = slab_work(cuts)
+        self.assertLess(cuts[1], 250)
+        self.assertLess(work.max()/work.min(), 1.1)
+
+if __name__ == '__main__':
+    unittest.main()